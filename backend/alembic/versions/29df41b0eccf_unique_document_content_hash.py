@@ -0,0 +1,56 @@
+"""unique document content hash
+
+Revision ID: 29df41b0eccf
+Revises: df03c5cc4209
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '29df41b0eccf'
+down_revision: Union[str, Sequence[str], None] = 'df03c5cc4209'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Дубликаты, загруженные одновременно до появления ограничения: хэш остается у одного документа
+    # (обработанного, иначе самого раннего), у остальных сбрасывается
+    op.execute("""
+        UPDATE documents SET content_hash = NULL
+        WHERE id IN (
+            SELECT id FROM (
+                SELECT id, row_number() OVER (
+                    PARTITION BY agent_id, user_id, content_hash
+                    ORDER BY processed DESC, id
+                ) AS position
+                FROM documents
+                WHERE content_hash IS NOT NULL
+            ) ranked
+            WHERE position > 1
+        )
+    """)
+    op.drop_index('ix_documents_agent_user_content_hash', table_name='documents')
+    op.create_index(
+        'uq_documents_agent_user_content_hash',
+        'documents',
+        ['agent_id', 'user_id', 'content_hash'],
+        unique=True,
+        postgresql_where=sa.text('content_hash IS NOT NULL')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('uq_documents_agent_user_content_hash', table_name='documents')
+    op.create_index(
+        'ix_documents_agent_user_content_hash',
+        'documents',
+        ['agent_id', 'user_id', 'content_hash']
+    )
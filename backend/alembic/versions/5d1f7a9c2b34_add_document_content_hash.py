@@ -0,0 +1,35 @@
+"""add document content hash
+
+Revision ID: 5d1f7a9c2b34
+Revises: 332dcbeeedc0
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d1f7a9c2b34'
+down_revision: Union[str, Sequence[str], None] = '332dcbeeedc0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Хэш содержимого файла (sha256) для дедупликации загрузок; у старых документов не заполнен
+    op.add_column('documents', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.create_index(
+        'ix_documents_agent_user_content_hash',
+        'documents',
+        ['agent_id', 'user_id', 'content_hash']
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_documents_agent_user_content_hash', table_name='documents')
+    op.drop_column('documents', 'content_hash')
@@ -0,0 +1,50 @@
+"""add runbook records
+
+Revision ID: df03c5cc4209
+Revises: 5d1f7a9c2b34
+Create Date: 2026-10-17 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'df03c5cc4209'
+down_revision: Union[str, Sequence[str], None] = '5d1f7a9c2b34'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Строки таблиц регламентов (код/название алерта -> текст реакции) для ответа без LLM
+    op.create_table(
+        'runbook_records',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('document_id', sa.Integer(), nullable=False),
+        sa.Column('agent_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('alert_code', sa.String(length=32), nullable=True),
+        sa.Column('alert_name', sa.String(length=255), nullable=True),
+        sa.Column('title', sa.Text(), nullable=False),
+        sa.Column('reaction', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['document_id'], ['documents.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['agent_id'], ['agents.id']),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_runbook_records_document_id', 'runbook_records', ['document_id'])
+    op.create_index('ix_runbook_records_agent_user_code', 'runbook_records', ['agent_id', 'user_id', 'alert_code'])
+    op.create_index('ix_runbook_records_agent_user_name', 'runbook_records', ['agent_id', 'user_id', 'alert_name'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_runbook_records_agent_user_name', table_name='runbook_records')
+    op.drop_index('ix_runbook_records_agent_user_code', table_name='runbook_records')
+    op.drop_index('ix_runbook_records_document_id', table_name='runbook_records')
+    op.drop_table('runbook_records')
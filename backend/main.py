@@ -1,4 +1,5 @@
 from typing import Union
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from prometheus_client import generate_latest
@@ -6,8 +7,17 @@ from starlette.responses import Response
 
 from src.core.middlewares import PrometheusMiddleware
 from src.core.routers import router as app_router
+from src.agents.services.ollama_service import OllamaService
 
-app = FastAPI(docs_url="/api/docs")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Закрываем пул соединений с Ollama при остановке приложения
+    await OllamaService.aclose()
+
+
+app = FastAPI(docs_url="/api/docs", lifespan=lifespan)
 app.add_middleware(PrometheusMiddleware)
 app.add_middleware(
     CORSMiddleware,
@@ -2,5 +2,6 @@ from .agent import Agent
 from .document import Document
 from .agent_log import AgentLog
 from .user_agent import UserAgent
+from .runbook_record import RunbookRecord
 
-__all__ = ["Agent", "Document", "AgentLog", "UserAgent"]
+__all__ = ["Agent", "Document", "AgentLog", "UserAgent", "RunbookRecord"]
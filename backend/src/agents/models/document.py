@@ -1,11 +1,19 @@
 from datetime import datetime
-from sqlalchemy import String, DateTime, ForeignKey, Text
+from typing import Optional
+from sqlalchemy import String, DateTime, ForeignKey, Text, Index, text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from src.core.orm.base import Base
 
 
 class Document(Base):
     __tablename__ = "documents"
+    __table_args__ = (
+        # Один документ на содержимое у агента пользователя (дедупликация одновременных загрузок)
+        Index(
+            "uq_documents_agent_user_content_hash", "agent_id", "user_id", "content_hash",
+            unique=True, postgresql_where=text("content_hash IS NOT NULL")
+        ),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     agent_id: Mapped[int] = mapped_column(ForeignKey("agents.id"), nullable=False)
@@ -16,7 +24,11 @@ class Document(Base):
     file_size: Mapped[int]  # Размер файла в байтах
     uploaded_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     processed: Mapped[bool] = mapped_column(default=False)  # Обработан ли файл в векторную БД
+    content_hash: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)  # sha256 содержимого файла (дедупликация)
 
     # Relationships
     agent: Mapped["Agent"] = relationship("Agent", back_populates="documents")
     user: Mapped["User"] = relationship("User", back_populates="documents")
+    runbook_records: Mapped[list["RunbookRecord"]] = relationship(
+        "RunbookRecord", back_populates="document", cascade="all, delete-orphan", passive_deletes=True
+    )
@@ -0,0 +1,28 @@
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import String, DateTime, ForeignKey, Text, Index
+from sqlalchemy.orm import Mapped, mapped_column, relationship
+from src.core.orm.base import Base
+
+
+class RunbookRecord(Base):
+    """Запись регламента: строка таблицы документа с кодом/названием алерта и текстом реакции"""
+
+    __tablename__ = "runbook_records"
+    __table_args__ = (
+        Index("ix_runbook_records_agent_user_code", "agent_id", "user_id", "alert_code"),
+        Index("ix_runbook_records_agent_user_name", "agent_id", "user_id", "alert_name"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    document_id: Mapped[int] = mapped_column(ForeignKey("documents.id", ondelete="CASCADE"), nullable=False, index=True)
+    agent_id: Mapped[int] = mapped_column(ForeignKey("agents.id"), nullable=False)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
+    alert_code: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)  # Код алерта в нижнем регистре (z735)
+    alert_name: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)  # Нормализованное название алерта
+    title: Mapped[str] = mapped_column(Text, nullable=False)  # Название алерта как в документе
+    reaction: Mapped[str] = mapped_column(Text, nullable=False)  # Текст из колонки "Как реагировать"
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    # Relationships
+    document: Mapped["Document"] = relationship("Document", back_populates="runbook_records")
@@ -1,6 +1,7 @@
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update, delete
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import selectinload
 from datetime import datetime
 from ..models.document import Document
@@ -14,7 +15,11 @@ class DocumentRepository:
         self.db = db_session
     
     async def create(self, document_data: DocumentCreate, agent_id: int, user_id: int) -> Document:
-        """Создает новый документ"""
+        """
+        Создает новый документ.
+        Если такой же файл одновременно загрузил другой запрос (уникальный индекс по хэшу содержимого),
+        возвращает уже созданный документ - его file_path отличается от переданного
+        """
         
         document = Document(
             agent_id=agent_id,
@@ -23,16 +28,65 @@ class DocumentRepository:
             file_path=document_data.file_path,
             file_type=document_data.file_type,
             file_size=document_data.file_size,
+            content_hash=document_data.content_hash,
             uploaded_at=datetime.utcnow(),
             processed=False
         )
         
-        self.db.add(document)
+        # Вставка в savepoint: при конфликте откатывается только она, а не вся сессия запроса
+        try:
+            async with self.db.begin_nested():
+                self.db.add(document)
+        except IntegrityError:
+            existing = await self._get_content_duplicate(agent_id, user_id, document_data.content_hash)
+            if existing is None:
+                raise
+            return existing
         await self.db.commit()
         await self.db.refresh(document)
         
         return document
     
+    async def _get_content_duplicate(self, agent_id: int, user_id: int,
+                                     content_hash: Optional[str]) -> Optional[Document]:
+        """Документ, с которым конфликтует вставка по уникальному индексу хэша содержимого"""
+        if content_hash is None:
+            return None
+        return await self.get_by_content_hash(agent_id, user_id, content_hash)
+    
+    async def create_many(self, documents_data: List[DocumentCreate], agent_id: int, user_id: int) -> List[Document]:
+        """
+        Создает несколько документов в одной транзакции.
+        При конфликте по хэшу содержимого документы создаются по одному (см. create):
+        на месте конфликтующих возвращаются уже существующие документы
+        """
+        uploaded_at = datetime.utcnow()
+        documents = [
+            Document(
+                agent_id=agent_id,
+                user_id=user_id,
+                filename=document_data.filename,
+                file_path=document_data.file_path,
+                file_type=document_data.file_type,
+                file_size=document_data.file_size,
+                content_hash=document_data.content_hash,
+                uploaded_at=uploaded_at,
+                processed=False
+            )
+            for document_data in documents_data
+        ]
+        
+        try:
+            async with self.db.begin_nested():
+                self.db.add_all(documents)
+        except IntegrityError:
+            return [await self.create(document_data, agent_id, user_id) for document_data in documents_data]
+        await self.db.commit()
+        for document in documents:
+            await self.db.refresh(document)
+        
+        return documents
+    
     async def get_by_id(self, document_id: int) -> Optional[Document]:
         """Получает документ по ID"""
         result = await self.db.execute(
@@ -57,6 +111,59 @@ class DocumentRepository:
         )
         return result.scalars().all()
     
+    async def get_agent_owners(self) -> List[Tuple[int, int]]:
+        """Возвращает пары (user_id, agent_id), у которых есть документы"""
+        result = await self.db.execute(
+            select(Document.user_id, Document.agent_id).distinct().order_by(Document.user_id, Document.agent_id)
+        )
+        return [(row.user_id, row.agent_id) for row in result.all()]
+    
+    async def get_by_content_hash(self, agent_id: int, user_id: int, content_hash: str) -> Optional[Document]:
+        """
+        Получает документ агента пользователя с таким же содержимым (для дедупликации загрузок).
+        Обработанный документ предпочтительнее: необработанный - повод обработать его повторно
+        """
+        result = await self.db.execute(
+            select(Document).where(
+                Document.agent_id == agent_id,
+                Document.user_id == user_id,
+                Document.content_hash == content_hash
+            ).order_by(Document.processed.desc(), Document.id).limit(1)
+        )
+        return result.scalar_one_or_none()
+    
+    async def get_by_content_hashes(self, agent_id: int, user_id: int, content_hashes: List[str]) -> Dict[str, Document]:
+        """Документы агента пользователя по хэшам содержимого (хэш -> документ, как в get_by_content_hash)"""
+        if not content_hashes:
+            return {}
+        result = await self.db.execute(
+            select(Document).where(
+                Document.agent_id == agent_id,
+                Document.user_id == user_id,
+                Document.content_hash.in_(content_hashes)
+            ).order_by(Document.processed.desc(), Document.id)
+        )
+        documents = {}
+        for document in result.scalars().all():
+            documents.setdefault(document.content_hash, document)
+        return documents
+    
+    async def get_content_keys(self) -> set:
+        """Пары (хэш содержимого, тип файла) всех документов - записи кэша извлечения, которые нужно хранить"""
+        result = await self.db.execute(
+            select(Document.content_hash, Document.file_type).where(Document.content_hash.is_not(None)).distinct()
+        )
+        return {(row.content_hash, row.file_type) for row in result.all()}
+    
+    async def get_existing_ids(self, document_ids: List[int]) -> set:
+        """Возвращает ID из списка, для которых документ еще существует"""
+        if not document_ids:
+            return set()
+        result = await self.db.execute(
+            select(Document.id).where(Document.id.in_(document_ids))
+        )
+        return set(result.scalars().all())
+    
     async def get_by_user_id(self, user_id: int) -> List[Document]:
         """Получает все документы пользователя"""
         result = await self.db.execute(
@@ -97,6 +204,42 @@ class DocumentRepository:
         await self.db.commit()
         return result.scalar_one_or_none()
     
+    async def update_processed_status_many(self, document_ids: List[int], processed: bool) -> int:
+        """Обновляет статус обработки нескольких документов"""
+        if not document_ids:
+            return 0
+        result = await self.db.execute(
+            update(Document)
+            .where(Document.id.in_(document_ids))
+            .values(processed=processed)
+        )
+        
+        await self.db.commit()
+        return result.rowcount
+    
+    async def update_file(self, document_id: int, file_path: str, file_size: int,
+                          content_hash: Optional[str] = None) -> Optional[Document]:
+        """
+        Обновляет файл документа (новая версия) и сбрасывает статус обработки.
+        Если такое же содержимое уже есть у другого документа агента, хэш не сохраняется
+        (уникальный индекс) - документ просто не участвует в дедупликации
+        """
+        values = {
+            "file_path": file_path,
+            "file_size": file_size,
+            "content_hash": content_hash,
+            "uploaded_at": datetime.utcnow(),
+            "processed": False
+        }
+        statement = update(Document).where(Document.id == document_id).returning(Document)
+        try:
+            async with self.db.begin_nested():
+                result = await self.db.execute(statement.values(**values))
+        except IntegrityError:
+            result = await self.db.execute(statement.values(**{**values, "content_hash": None}))
+        await self.db.commit()
+        return result.scalar_one_or_none()
+    
     async def delete(self, document_id: int) -> bool:
         """Удаляет документ"""
         result = await self.db.execute(
@@ -123,3 +266,14 @@ class DocumentRepository:
         )
         await self.db.commit()
         return result.rowcount > 0
+    
+    async def delete_by_agent_and_user(self, agent_id: int, user_id: int) -> int:
+        """Удаляет все документы агента конкретного пользователя"""
+        result = await self.db.execute(
+            delete(Document).where(
+                Document.agent_id == agent_id,
+                Document.user_id == user_id
+            )
+        )
+        await self.db.commit()
+        return result.rowcount
@@ -0,0 +1,87 @@
+from typing import List, Dict, Any, Optional, Sequence
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, delete, or_
+from sqlalchemy.sql import Select
+from datetime import datetime
+from ..models.runbook_record import RunbookRecord
+from ..services.alert_index import extract_alert_keys
+
+
+def build_runbook_lookup(agent_id: int, user_id: int, query: str) -> Optional[Select]:
+    """
+    Запрос записей регламента агента по ключам самого алерта (код и название из заголовка).
+    Общий для асинхронной и синхронной сессии; None, если у алерта нет своих ключей.
+    """
+    keys = extract_alert_keys(query)
+    codes = [key.split(":", 1)[1] for key in keys if key.startswith("code:")]
+    names = [key.split(":", 1)[1] for key in keys if key.startswith("name:")]
+    if not codes and not names:
+        return None
+
+    conditions = []
+    if codes:
+        conditions.append(RunbookRecord.alert_code.in_(codes))
+    if names:
+        conditions.append(RunbookRecord.alert_name.in_(names))
+    return select(RunbookRecord).where(
+        RunbookRecord.agent_id == agent_id,
+        RunbookRecord.user_id == user_id,
+        or_(*conditions)
+    ).order_by(RunbookRecord.id)
+
+
+def pick_runbook_match(records: Sequence[RunbookRecord], query: str) -> Optional[RunbookRecord]:
+    """
+    Выбирает запись по приоритету ключей алерта (название, затем код).
+    Если ключу соответствуют строки с разной реакцией, прямой ответ неоднозначен - None.
+    """
+    for key in extract_alert_keys(query):
+        field, value = key.split(":", 1)
+        matched = [
+            record for record in records
+            if (field == "code" and record.alert_code == value) or (field == "name" and record.alert_name == value)
+        ]
+        if not matched:
+            continue
+        if len({record.reaction for record in matched}) > 1:
+            return None
+        return matched[0]
+    return None
+
+
+class RunbookRecordRepository:
+    """Репозиторий для работы с записями регламентов в БД"""
+
+    def __init__(self, db_session: AsyncSession):
+        self.db = db_session
+
+    async def replace_for_document(self, document_id: int, agent_id: int, user_id: int,
+                                   records: List[Dict[str, Any]]) -> int:
+        """Заменяет записи регламента документа (при повторной обработке старые записи удаляются)"""
+        await self.db.execute(
+            delete(RunbookRecord).where(RunbookRecord.document_id == document_id)
+        )
+        created_at = datetime.utcnow()
+        self.db.add_all([
+            RunbookRecord(
+                document_id=document_id,
+                agent_id=agent_id,
+                user_id=user_id,
+                alert_code=record["alert_code"],
+                alert_name=record["alert_name"],
+                title=record["title"],
+                reaction=record["reaction"],
+                created_at=created_at
+            )
+            for record in records
+        ])
+        await self.db.commit()
+        return len(records)
+
+    async def find_match(self, agent_id: int, user_id: int, query: str) -> Optional[RunbookRecord]:
+        """Ищет запись регламента, точно соответствующую алерту из текста"""
+        statement = build_runbook_lookup(agent_id, user_id, query)
+        if statement is None:
+            return None
+        result = await self.db.execute(statement)
+        return pick_runbook_match(result.scalars().all(), query)
@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Dict, Any
 
@@ -8,6 +9,7 @@ from src.account.models.user import User
 from src.account.services import SubscriptionService
 from src.agents.schemas.analysis import TextAnalysisRequest, TextAnalysisResponse
 from src.agents.services.agent_service import AgentService
+from src.agents.utils.sse import sse_response
 
 router = APIRouter(prefix="/agents", tags=["agents"])
 
@@ -71,6 +73,39 @@ async def analyze_text(
         )
 
 
+@router.post("/{agent_id}/analyze/stream")
+async def analyze_text_stream(
+    agent_id: int,
+    request: TextAnalysisRequest,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_session)
+):
+    """
+    Потоковый анализ текста агентом (Server-Sent Events).
+    События: meta (documents_used), token (text - часть ответа), done (response - итоговый ответ,
+    processing_time, documents_used), error (error_message).
+    Требует активную подписку.
+    """
+    
+    # Проверяем активную подписку
+    subscription_service = SubscriptionService(session=db)
+    active_subscriptions = await subscription_service.get_active_by_user_id(current_user.id)
+    
+    if not active_subscriptions:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Требуется активная подписка для использования агентов"
+        )
+    
+    agent, error_message = await agent_service.validate_analysis_request(
+        agent_id, current_user.id, request.text, db
+    )
+    if error_message:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=error_message)
+    
+    return sse_response(agent_service.analyze_text_stream(agent_id, current_user.id, agent.prompt, request.text))
+
+
 @router.get("/{agent_id}/stats")
 async def get_agent_stats(
     agent_id: int,
@@ -93,7 +128,8 @@ async def get_agent_stats(
         )
     
     try:
-        stats = agent_service.get_agent_stats(agent_id, current_user.id)
+        # Статистика проверяет Ollama и ждет слот синхронно - выполняем ее вне event loop
+        stats = await run_in_threadpool(agent_service.get_agent_stats, agent_id, current_user.id)
         return stats
     except Exception as e:
         raise HTTPException(
@@ -109,7 +145,8 @@ async def check_ollama_status():
     Доступно всем пользователям.
     """
     try:
-        status = agent_service.test_ollama_connection()
+        # Проверка ждет слот Ollama синхронно - выполняем ее вне event loop
+        status = await run_in_threadpool(agent_service.test_ollama_connection)
         return {"status": "connected" if status else "disconnected"}
     except Exception as e:
         return {"status": "error", "message": str(e)}
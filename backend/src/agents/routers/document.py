@@ -1,7 +1,8 @@
+import os
 import logging
 from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List
+from typing import List, Optional
 
 from src.core.orm.database import get_async_session
 from src.core.dependencies import get_current_user
@@ -45,15 +46,8 @@ async def upload_document(
         )
     
     try:
-        # Проверяем размер файла (максимум 50MB)
-        if not document_processor.validate_file_size(file.size):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Размер файла превышает 50MB"
-            )
-        
-        # Сохраняем файл на диск
-        result = document_processor.save_uploaded_file(
+        # Копируем загруженный файл в папку документов агента (размер до 50MB проверяется по мере чтения)
+        result = await document_processor.save_upload_stream(
             user_id=current_user.id,
             agent_id=agent_id,
             file=file,
@@ -66,51 +60,80 @@ async def upload_document(
                 detail=result["error"]
             )
         
-        # Сохраняем документ в БД
         document_repo = DocumentRepository(db)
+        
+        # Такой же файл уже загружен для агента - не храним и не обрабатываем его повторно
+        duplicate = await document_repo.get_by_content_hash(agent_id, current_user.id, result["content_hash"])
+        if duplicate and not duplicate.processed:
+            # Прошлая обработка такого же файла не завершилась - считаем загрузку повтором
+            from src.tasks.document_tasks import prepare_document_retry, dispatch_document_processing
+            retry = await prepare_document_retry(document_repo, duplicate, result)
+            job_id = dispatch_document_processing(
+                retry["document_id"], current_user.id, agent_id, retry["file_path"], retry["filename"],
+                retry["content_hash"]
+            )
+            return {
+                "success": True,
+                "message": "Такой документ уже загружен, но не был обработан - поставлен в очередь повторно",
+                "duplicate": True,
+                "document_id": duplicate.id,
+                "job_id": job_id,
+                "filename": duplicate.filename,
+                "original_filename": result["original_filename"],
+                "file_size": duplicate.file_size,
+                "file_type": duplicate.file_type
+            }
+        if duplicate:
+            os.remove(result["file_path"])
+            logger.info(f"Документ {file.filename} совпадает с уже загруженным документом {duplicate.id}")
+            return {
+                "success": True,
+                "message": "Такой документ уже загружен",
+                "duplicate": True,
+                "document_id": duplicate.id,
+                "filename": duplicate.filename,
+                "original_filename": result["original_filename"],
+                "file_size": duplicate.file_size,
+                "file_type": duplicate.file_type
+            }
+        
+        # Сохраняем документ в БД
         document_data = DocumentCreate(
             filename=result["filename"],
             file_path=result["file_path"],
             file_type=result["file_type"],
-            file_size=result["file_size"]
+            file_size=result["file_size"],
+            content_hash=result["content_hash"]
         )
         
         document = await document_repo.create(document_data, agent_id, current_user.id)
+        if document.file_path != result["file_path"]:
+            # Такой же файл одновременно загрузил другой запрос - он и поставил документ в очередь
+            os.remove(result["file_path"])
+            return {
+                "success": True,
+                "message": "Такой документ уже загружен",
+                "duplicate": True,
+                "document_id": document.id,
+                "filename": document.filename,
+                "original_filename": result["original_filename"],
+                "file_size": document.file_size,
+                "file_type": document.file_type
+            }
         
-        # Обрабатываем документ для векторной БД
-        try:
-            # Извлекаем текст из документа
-            text = document_processor.extract_text(result["file_path"], result["file_type"])
-            
-            if text:
-                # Добавляем в векторную БД
-                doc_data = {
-                    'id': str(document.id),
-                    'text': text,
-                    'filename': result["filename"],
-                    'file_type': result["file_type"],
-                    'uploaded_at': document.uploaded_at.isoformat()
-                }
-                
-                success = agent_service.vector_store.add_documents(current_user.id, agent_id, [doc_data])
-                
-                if success:
-                    # Обновляем статус обработки
-                    await document_repo.update_processed_status(document.id, True)
-                    logger.info(f"Документ {result['filename']} успешно обработан для агента {agent_id}")
-                else:
-                    logger.warning(f"Не удалось добавить документ {result['filename']} в векторную БД")
-            else:
-                logger.warning(f"Не удалось извлечь текст из документа {result['filename']}")
-                
-        except Exception as e:
-            logger.error(f"Ошибка при обработке документа {result['filename']}: {e}")
-            # Документ остается в БД, но с флагом processed=False
+        # Обработка (извлечение текста, эмбеддинги) выполняется в очереди document_processing,
+        # чтобы не блокировать event loop; статус - GET /agents/{agent_id}/documents/{document_id}/status
+        from src.tasks.document_tasks import dispatch_document_processing
+        job_id = dispatch_document_processing(
+            document.id, current_user.id, agent_id, result["file_path"], result["filename"],
+            result["content_hash"]
+        )
         
         return {
             "success": True,
-            "message": "Документ успешно загружен",
+            "message": "Документ загружен и поставлен в очередь на обработку",
             "document_id": document.id,
+            "job_id": job_id,
             "filename": result["filename"],
             "original_filename": result["original_filename"],
             "file_size": result["file_size"],
@@ -175,6 +198,54 @@ async def list_documents(
         )
 
 
+@router.get("/{agent_id}/documents/{document_id}/status")
+async def get_document_status(
+    agent_id: int,
+    document_id: int,
+    job_id: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_session)
+):
+    """
+    Получает статус обработки документа.
+    Если передан job_id (возвращается при загрузке), добавляется состояние задачи:
+    PENDING/STARTED/PROGRESS (stage: extracting, indexing)/SUCCESS/FAILURE.
+    """
+    try:
+        document_repo = DocumentRepository(db)
+        document = await document_repo.get_by_id(document_id)
+        
+        if not document or document.agent_id != agent_id or document.user_id != current_user.id:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Документ не найден"
+            )
+        
+        response = {
+            "document_id": document.id,
+            "filename": document.filename,
+            "processed": document.processed
+        }
+        
+        if job_id:
+            from src.tasks.document_tasks import get_document_job_status
+            job = get_document_job_status(job_id)
+            # Задача должна относиться к этому документу
+            if job.get("document_id", document.id) == document.id and \
+                    job.get("result", {}).get("document_id", document.id) == document.id:
+                response["job"] = job
+        
+        return response
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка при получении статуса документа: {str(e)}"
+        )
+
+
 @router.delete("/{agent_id}/documents/{document_id}")
 async def delete_document(
     agent_id: int,
@@ -208,13 +279,12 @@ async def delete_document(
                 detail="Документ не найден"
             )
         
-        # Удаляем из векторной БД (если был обработан)
-        if document.processed:
-            try:
-                # Здесь можно добавить логику удаления из векторной БД
-                pass
-            except Exception as e:
-                logger.warning(f"Не удалось удалить документ {document.filename} из векторной БД: {e}")
+        # Удаляем из векторной БД всегда: документ мог быть записан в нее обработкой, которая еще
+        # не отметила его обработанным (если чанков нет, удалять нечего)
+        try:
+            agent_service.vector_store.delete_document(document.user_id, document.agent_id, document.id)
+        except Exception as e:
+            logger.warning(f"Не удалось удалить документ {document.filename} из векторной БД: {e}")
         
         # Удаляем файл с диска
         try:
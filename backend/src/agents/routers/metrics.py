@@ -6,6 +6,8 @@ from src.core.orm.database import get_async_session
 from src.core.dependencies import get_current_user
 from src.account.models.user import User
 from src.agents.services.metrics_service import MetricsService
+from src.agents.services.vector_store import VectorStore
+from src.agents.services.response_cache import get_response_cache
 
 router = APIRouter(prefix="/metrics", tags=["metrics"])
 
@@ -110,3 +112,26 @@ async def get_performance_metrics(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Ошибка при получении метрик производительности: {str(e)}"
         )
+
+
+@router.get("/search-cache", response_model=Dict[str, Any])
+async def get_search_cache_metrics(
+    current_user: User = Depends(get_current_user)
+):
+    """Получает статистику кэша поиска, кэша ответов LLM, пула клиентов ChromaDB и эмбеддингов текущего процесса (только для админов)"""
+    check_admin_permissions(current_user)
+    
+    try:
+        vector_store = VectorStore()
+        stats = vector_store.get_cache_stats()
+        stats["chroma_pool"] = vector_store.get_pool_stats()
+        stats["embedding"] = vector_store.get_embedding_stats()
+        response_cache = get_response_cache()
+        if response_cache is not None:
+            stats["response_cache"] = response_cache.stats()
+        return stats
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка при получении статистики кэша поиска: {str(e)}"
+        )
@@ -2,7 +2,6 @@ from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 import os
-import tempfile
 import logging
 
 from src.core.orm.database import get_async_session
@@ -195,7 +194,7 @@ async def upload_document_to_agent(
             )
         
         # Проверяем тип файла
-        allowed_types = ['.txt', '.pdf', '.docx', '.doc', '.xlsx', '.xls']
+        allowed_types = ['.txt', '.csv', '.md', '.pdf', '.docx', '.doc', '.xlsx', '.xls']
         file_ext = os.path.splitext(file.filename)[1].lower()
         if file_ext not in allowed_types:
             raise HTTPException(
@@ -203,63 +202,361 @@ async def upload_document_to_agent(
                 detail=f"Неподдерживаемый тип файла. Разрешены: {', '.join(allowed_types)}"
             )
         
-        # Сохраняем файл во временную директорию
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as temp_file:
-            content = await file.read()
-            temp_file.write(content)
-            temp_file_path = temp_file.name
+        # Копируем загруженный файл в папку документов агента (файл нужен воркеру обработки),
+        # размер до 50MB проверяется по мере чтения
+        from src.agents.services.document_processor import DocumentProcessor
+        result = await DocumentProcessor().save_upload_stream(
+            user_id=current_user.id,
+            agent_id=user_agent.agent_id,
+            file=file,
+            filename=file.filename
+        )
+        if not result["success"]:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=result["error"]
+            )
         
-        try:
-            # Сохраняем документ в БД
-            from src.agents.repositories.document import DocumentRepository
-            from src.agents.schemas.document import DocumentCreate
-            
-            document_repo = DocumentRepository(db)
-            
-            # Создаем запись о документе
-            document_data = DocumentCreate(
-                filename=file.filename,
-                file_path=temp_file_path,
-                file_type=file_ext[1:],  # Убираем точку
-                file_size=len(content)
+        # Сохраняем документ в БД
+        from src.agents.repositories.document import DocumentRepository
+        from src.agents.schemas.document import DocumentCreate
+        
+        document_repo = DocumentRepository(db)
+        
+        # Такой же файл уже загружен для агента - не храним и не обрабатываем его повторно
+        duplicate = await document_repo.get_by_content_hash(
+            user_agent.agent_id, current_user.id, result["content_hash"]
+        )
+        if duplicate and not duplicate.processed:
+            # Прошлая обработка такого же файла не завершилась - считаем загрузку повтором
+            from src.tasks.document_tasks import prepare_document_retry, dispatch_document_processing
+            retry = await prepare_document_retry(document_repo, duplicate, result)
+            job_id = dispatch_document_processing(
+                retry["document_id"], current_user.id, user_agent.agent_id, retry["file_path"],
+                retry["filename"], retry["content_hash"]
+            )
+            return {
+                "message": f"Документ {file.filename} уже загружен, но не был обработан - поставлен в очередь повторно",
+                "document_id": duplicate.id,
+                "job_id": job_id,
+                "duplicate": True
+            }
+        if duplicate:
+            os.remove(result["file_path"])
+            logger.info(f"Документ {file.filename} совпадает с уже загруженным документом {duplicate.id}")
+            return {
+                "message": f"Документ {file.filename} уже загружен",
+                "document_id": duplicate.id,
+                "duplicate": True
+            }
+        
+        # Создаем запись о документе
+        document_data = DocumentCreate(
+            filename=file.filename,
+            file_path=result["file_path"],
+            file_type=result["file_type"],
+            file_size=result["file_size"],
+            content_hash=result["content_hash"]
+        )
+        
+        document = await document_repo.create(
+            document_data=document_data,
+            agent_id=user_agent.agent_id,
+            user_id=current_user.id
+        )
+        if document.file_path != result["file_path"]:
+            # Такой же файл одновременно загрузил другой запрос - он и поставил документ в очередь
+            os.remove(result["file_path"])
+            return {
+                "message": f"Документ {file.filename} уже загружен",
+                "document_id": document.id,
+                "duplicate": True
+            }
+        
+        # Обрабатываем документ в очереди document_processing, не блокируя API
+        from src.tasks.document_tasks import dispatch_document_processing
+        job_id = dispatch_document_processing(
+            document.id, current_user.id, user_agent.agent_id, result["file_path"], result["filename"],
+            result["content_hash"]
+        )
+        
+        return {
+            "message": f"Документ {file.filename} загружен и поставлен в очередь на обработку",
+            "document_id": document.id,
+            "job_id": job_id
+        }
+                
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка при загрузке документа: {str(e)}"
+        )
+
+
+@router.post("/{user_agent_id}/documents/bulk")
+async def bulk_upload_documents_to_agent(
+    user_agent_id: int,
+    files: List[UploadFile] = File(...),
+    current_user: User = Depends(require_active_subscription),
+    db: AsyncSession = Depends(get_async_session)
+):
+    """
+    Массовая загрузка документов для агента: несколько файлов и/или архивы (zip, tar, tar.gz).
+    Документы создаются в одной транзакции и обрабатываются одной задачей с общими пачками записи.
+    """
+    try:
+        repo = get_user_agent_repo(db)
+        
+        # Проверяем, что связь принадлежит пользователю
+        user_agent = await repo.get_by_id(user_agent_id)
+        if not user_agent or user_agent.user_id != current_user.id:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Связь с агентом не найдена"
+            )
+        
+        # Проверяем, что связь активна
+        if not user_agent.is_active:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Связь с агентом неактивна"
             )
+        
+        from starlette.concurrency import run_in_threadpool
+        from src.core.rag_config import RAGConfig
+        from src.agents.services.document_processor import DocumentProcessor
+        from src.agents.repositories.document import DocumentRepository
+        from src.agents.schemas.document import DocumentCreate
+        
+        document_processor = DocumentProcessor()
+        archive_types = ['zip', 'tar', 'gz', 'tgz']
+        saved = []
+        rejected = []
+        
+        for file in files:
+            file_type = os.path.splitext(file.filename)[1].lower().lstrip('.')
+            if file_type not in archive_types:
+                result = await document_processor.save_upload_stream(
+                    current_user.id, user_agent.agent_id, file, file.filename
+                )
+                (saved if result["success"] else rejected).append(
+                    result if result["success"] else {"filename": file.filename, "error": result["error"]}
+                )
+                continue
             
-            document = await document_repo.create(
-                document_data=document_data,
+            # Архив сохраняем во временный файл и распаковываем в потоке, не блокируя event loop
+            archive = await document_processor.save_upload_stream(
+                current_user.id, user_agent.agent_id, file, file.filename,
+                max_size_mb=RAGConfig.BULK_MAX_ARCHIVE_SIZE_MB,
+                allowed_types=archive_types
+            )
+            if not archive["success"]:
+                rejected.append({"filename": file.filename, "error": archive["error"]})
+                continue
+            try:
+                results = await run_in_threadpool(
+                    document_processor.save_archive, current_user.id, user_agent.agent_id, archive["file_path"]
+                )
+            except Exception as e:
+                rejected.append({"filename": file.filename, "error": str(e)})
+                continue
+            finally:
+                os.remove(archive["file_path"])
+            for result in results:
+                (saved if result["success"] else rejected).append(
+                    result if result["success"] else {"filename": result["original_filename"], "error": result["error"]}
+                )
+        
+        if len(saved) > RAGConfig.BULK_MAX_FILES:
+            for result in saved:
+                os.remove(result["file_path"])
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"За один раз можно загрузить не больше {RAGConfig.BULK_MAX_FILES} документов"
+            )
+        
+        # Дедупликация по содержимому: с уже загруженными документами и внутри пачки.
+        # Документ, обработка которого не завершилась, обрабатывается повторно вместе с пачкой
+        from src.tasks.document_tasks import prepare_document_retry
+        document_repo = DocumentRepository(db)
+        existing = await document_repo.get_by_content_hashes(
+            user_agent.agent_id, current_user.id, [result["content_hash"] for result in saved]
+        )
+        seen_hashes = set()
+        unique = []
+        duplicates = []
+        retries = []
+        for result in saved:
+            document = existing.get(result["content_hash"])
+            if result["content_hash"] in seen_hashes or (document is not None and document.processed):
+                os.remove(result["file_path"])
+                duplicates.append(result["original_filename"])
+            elif document is not None:
+                retries.append(await prepare_document_retry(document_repo, document, result))
+            else:
+                unique.append(result)
+            seen_hashes.add(result["content_hash"])
+        
+        job_id = None
+        documents = []
+        if unique:
+            documents = await document_repo.create_many(
+                [
+                    DocumentCreate(
+                        filename=result["original_filename"],
+                        file_path=result["file_path"],
+                        file_type=result["file_type"],
+                        file_size=result["file_size"],
+                        content_hash=result["content_hash"]
+                    )
+                    for result in unique
+                ],
                 agent_id=user_agent.agent_id,
                 user_id=current_user.id
             )
-            
-            # Обрабатываем документ синхронно
-            from src.agents.services.agent_service import AgentService
-            agent_service = AgentService()
-            success = await agent_service.process_document(
-                user_agent.agent_id, 
-                current_user.id, 
-                temp_file_path, 
-                file.filename, 
-                file_ext[1:], 
-                db
+            # Документы, которые одновременно загрузил другой запрос, - дубликаты
+            created = []
+            for document, result in zip(documents, unique):
+                if document.file_path == result["file_path"]:
+                    created.append((document, result))
+                else:
+                    os.remove(result["file_path"])
+                    duplicates.append(result["original_filename"])
+            documents = [document for document, _ in created]
+            unique = [result for _, result in created]
+        
+        batch = [
+            {"document_id": document.id, "file_path": result["file_path"], "filename": result["filename"],
+             "content_hash": result["content_hash"]}
+            for document, result in zip(documents, unique)
+        ] + retries
+        if batch:
+            from src.tasks.document_tasks import dispatch_documents_batch
+            job_id = dispatch_documents_batch(current_user.id, user_agent.agent_id, batch)
+        
+        return {
+            "message": f"Загружено документов: {len(documents)}, дубликатов: {len(duplicates)}, "
+                       f"повторно обрабатывается: {len(retries)}, отклонено: {len(rejected)}",
+            "document_ids": [document.id for document in documents],
+            "retried_ids": [retry["document_id"] for retry in retries],
+            "job_id": job_id,
+            "duplicates": duplicates,
+            "rejected": rejected
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка при массовой загрузке документов: {str(e)}"
+        )
+
+
+@router.put("/{user_agent_id}/documents/{document_id}")
+async def replace_agent_document(
+    user_agent_id: int,
+    document_id: int,
+    file: UploadFile = File(...),
+    current_user: User = Depends(require_active_subscription),
+    db: AsyncSession = Depends(get_async_session)
+):
+    """
+    Загружает новую версию документа агента.
+    Векторная БД обновляется на месте: пересчитываются только измененные чанки,
+    удаленные из документа чанки удаляются.
+    """
+    try:
+        repo = get_user_agent_repo(db)
+        
+        # Проверяем, что связь принадлежит пользователю
+        user_agent = await repo.get_by_id(user_agent_id)
+        if not user_agent or user_agent.user_id != current_user.id:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Связь с агентом не найдена"
             )
-            if success:
-                await document_repo.update_processed_status(document.id, True)
-            
+        
+        # Проверяем, что связь активна
+        if not user_agent.is_active:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Связь с агентом неактивна"
+            )
+        
+        from src.agents.repositories.document import DocumentRepository
+        document_repo = DocumentRepository(db)
+        
+        document = await document_repo.get_by_id(document_id)
+        if not document or document.user_id != current_user.id or document.agent_id != user_agent.agent_id:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Документ не найден"
+            )
+        
+        # Новая версия должна быть того же типа
+        file_ext = os.path.splitext(file.filename)[1].lower()
+        if file_ext[1:] != document.file_type:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Тип файла должен совпадать с исходным документом (.{document.file_type})"
+            )
+        
+        # Сохраняем новую версию в папку документов агента
+        from src.agents.services.document_processor import DocumentProcessor
+        result = await DocumentProcessor().save_upload_stream(
+            user_id=current_user.id,
+            agent_id=user_agent.agent_id,
+            file=file,
+            filename=document.filename
+        )
+        if not result["success"]:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=result["error"]
+            )
+        
+        # Содержимое не изменилось и документ обработан - векторная БД уже актуальна
+        # (необработанный документ с тем же содержимым обрабатываем повторно)
+        if document.content_hash == result["content_hash"] and document.processed:
+            os.remove(result["file_path"])
             return {
-                "message": f"Документ {file.filename} загружен и обработан",
-                "document_id": document.id
+                "message": f"Документ {document.filename} не изменился",
+                "document_id": document.id,
+                "duplicate": True
             }
-            
-        finally:
-            # Удаляем временный файл
-            if os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
+        
+        old_file_path = document.file_path
+        await document_repo.update_file(
+            document.id, result["file_path"], result["file_size"], result["content_hash"]
+        )
+        try:
+            if old_file_path != result["file_path"] and os.path.exists(old_file_path):
+                os.remove(old_file_path)
+        except Exception as e:
+            logger.warning(f"Не удалось удалить старую версию файла {old_file_path}: {e}")
+        
+        # Векторная БД обновляется на месте в очереди document_processing
+        from src.tasks.document_tasks import dispatch_document_processing
+        job_id = dispatch_document_processing(
+            document.id, current_user.id, user_agent.agent_id, result["file_path"], result["filename"],
+            result["content_hash"]
+        )
+        
+        return {
+            "message": f"Новая версия документа {document.filename} поставлена в очередь на обработку",
+            "document_id": document.id,
+            "job_id": job_id
+        }
                 
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Ошибка при загрузке документа: {str(e)}"
+            detail=f"Ошибка при обновлении документа: {str(e)}"
         )
 
 
@@ -315,6 +612,42 @@ async def analyze_text_with_agent(
         )
 
 
+@router.post("/{user_agent_id}/analyze/stream")
+async def analyze_text_with_agent_stream(
+    user_agent_id: int,
+    request: dict,
+    current_user: User = Depends(require_active_subscription),
+    db: AsyncSession = Depends(get_async_session)
+):
+    """Потоковый анализ текста агентом пользователя (Server-Sent Events: meta, token, done, error)"""
+    text = request.get('text', '')
+    repo = get_user_agent_repo(db)
+    
+    # Проверяем, что связь принадлежит пользователю
+    user_agent = await repo.get_by_id(user_agent_id)
+    if not user_agent or user_agent.user_id != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Связь с агентом не найдена"
+        )
+    
+    # Проверяем, что связь активна
+    if not user_agent.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Связь с агентом неактивна"
+        )
+    
+    agent, error_message = await agent_service.validate_analysis_request(
+        user_agent.agent_id, current_user.id, text, db
+    )
+    if error_message:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=error_message)
+    
+    from src.agents.utils.sse import sse_response
+    return sse_response(agent_service.analyze_text_stream(user_agent.agent_id, current_user.id, agent.prompt, text))
+
+
 @router.get("/{user_agent_id}/documents")
 async def get_agent_documents(
     user_agent_id: int,
@@ -384,13 +717,12 @@ async def delete_document(
                 detail="Документ не найден"
             )
         
-        # Удаляем из векторной БД (если был обработан)
-        if document.processed:
-            try:
-                # Здесь можно добавить логику удаления из векторной БД
-                pass
-            except Exception as e:
-                logger.warning(f"Не удалось удалить документ {document.filename} из векторной БД: {e}")
+        # Удаляем из векторной БД всегда: документ мог быть записан в нее обработкой, которая еще
+        # не отметила его обработанным (если чанков нет, удалять нечего)
+        try:
+            agent_service.vector_store.delete_document(document.user_id, document.agent_id, document.id)
+        except Exception as e:
+            logger.warning(f"Не удалось удалить документ {document.filename} из векторной БД: {e}")
         
         # Удаляем файл с диска
         try:
@@ -445,13 +777,31 @@ async def clear_agent_documents(
                 detail="Связь с агентом неактивна"
             )
         
-        # Очищаем векторную базу данных агента
-        success = agent_service.vector_store.delete_agent_collection(current_user.id, user_agent.agent_id)
+        from src.agents.repositories.document import DocumentRepository
+        document_repo = DocumentRepository(db)
+        documents = await document_repo.get_by_agent_and_user(user_agent.agent_id, current_user.id)
+        
+        # Удаляем коллекцию агента целиком: чанки, загруженные до появления document_id
+        # в метаданных, по ID документа не находятся
+        removed = agent_service.vector_store.count_documents(current_user.id, user_agent.agent_id)
+        agent_service.vector_store.delete_agent_collection(current_user.id, user_agent.agent_id)
+        
+        # Удаляем файлы с диска
+        for document in documents:
+            try:
+                if os.path.exists(document.file_path):
+                    os.remove(document.file_path)
+            except Exception as e:
+                logger.warning(f"Не удалось удалить файл {document.file_path}: {e}")
+        
+        deleted = await document_repo.delete_by_agent_and_user(user_agent.agent_id, current_user.id)
         
-        if success:
-            return {"success": True, "message": "Все документы агента удалены"}
-        else:
-            return {"success": False, "message": "Ошибка при удалении документов"}
+        return {
+            "success": True,
+            "message": "Все документы агента удалены",
+            "documents_deleted": deleted,
+            "chunks_deleted": removed
+        }
         
     except HTTPException:
         raise
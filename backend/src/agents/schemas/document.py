@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import Optional
 from pydantic import BaseModel, Field
 
 
@@ -7,6 +8,7 @@ class DocumentCreate(BaseModel):
     file_path: str = Field(..., description="Путь к файлу на диске")
     file_type: str = Field(..., description="Тип файла")
     file_size: int = Field(..., description="Размер файла в байтах")
+    content_hash: Optional[str] = Field(None, description="sha256 содержимого файла")
 
 
 class DocumentResponse(BaseModel):
@@ -18,6 +20,7 @@ class DocumentResponse(BaseModel):
     file_size: int
     uploaded_at: datetime
     processed: bool
+    content_hash: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -1,17 +1,21 @@
 import time
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
 from pathlib import Path
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from .vector_store import VectorStore
 from .ollama_service import OllamaService
+from .response_cache import get_response_cache
 from .document_processor import DocumentProcessor
 from .telegram_service import TelegramService, TelegramMessage
 from ..models.agent import Agent
 from ..models.document import Document
 from ..models.agent_log import AgentLog
 from ..repositories.agent import AgentRepository
+from ..repositories.runbook_record import RunbookRecordRepository
+from src.core.rag_config import RAGConfig
+from src.core.orm.database import AsyncSessionLocal
 
 logger = logging.getLogger(__name__)
 
@@ -24,66 +28,39 @@ class AgentService:
         self.ollama_service = OllamaService()
         self.document_processor = DocumentProcessor()
         self.telegram_service = TelegramService()
+        self.response_cache = get_response_cache()
     
     async def analyze_text(self, agent_id: int, user_id: int, text: str, db_session) -> Dict[str, Any]:
         """Анализирует текст с помощью агента"""
         start_time = time.time()
         
         try:
-            # Валидация входных параметров
-            if not text or not text.strip():
+            agent, error_message = await self.validate_analysis_request(agent_id, user_id, text, db_session)
+            if error_message:
                 return {
                     "success": False,
-                    "error_message": "Текст для анализа не может быть пустым",
-                    "processing_time": 0.0,
-                    "documents_used": 0
-                }
-            
-            # Получаем агента
-            agent = await self._get_agent(agent_id, db_session)
-            if not agent:
-                return {
-                    "success": False,
-                    "error_message": "Агент не найден",
-                    "processing_time": time.time() - start_time,
-                    "documents_used": 0
-                }
-            
-            # Проверяем, что пользователь имеет доступ к агенту
-            from ..repositories.user_agent import UserAgentRepository
-            user_agent_repo = UserAgentRepository(db_session)
-            user_agent = await user_agent_repo.get_by_user_and_agent(user_id, agent_id)
-            if not user_agent or not user_agent.is_active:
-                logger.warning(f"Пользователь {user_id} пытается использовать недоступный агент {agent_id}")
-                return {
-                    "success": False,
-                    "error_message": "Нет доступа к агенту",
-                    "processing_time": time.time() - start_time,
-                    "documents_used": 0
-                }
-            
-            # Проверяем активность агента
-            if not agent.is_active:
-                return {
-                    "success": False,
-                    "error_message": "Агент неактивен",
+                    "error_message": error_message,
                     "processing_time": time.time() - start_time,
                     "documents_used": 0
                 }
             
-            # Проверяем промпт агента
-            if not agent.prompt or not agent.prompt.strip():
+            # Алерт есть в таблице регламента - отвечаем текстом реакции без поиска и LLM
+            runbook_record = await self._find_runbook_record(agent_id, user_id, text, db_session)
+            if runbook_record is not None:
+                processing_time = time.time() - start_time
+                await self._save_log(agent_id, user_id, text, runbook_record.reaction, processing_time, 1, db_session)
                 return {
-                    "success": False,
-                    "error_message": "Промпт агента не настроен",
-                    "processing_time": time.time() - start_time,
-                    "documents_used": 0
+                    "success": True,
+                    "agent_id": agent_id,
+                    "response": runbook_record.reaction,
+                    "processing_time": processing_time,
+                    "documents_used": 1
                 }
             
             # Ищем релевантные документы в векторной БД
             try:
                 logger.info(f"Поиск документов для агента {agent_id}, пользователя {user_id}, запрос: '{text[:100]}...'")
-                context_docs = self.vector_store.search_similar(user_id, agent_id, text, n_results=3)
+                context_docs = await self.vector_store.asearch_similar(user_id, agent_id, text, n_results=3)
                 logger.info(f"Найдено {len(context_docs)} релевантных документов для агента {agent_id}")
                 
                 # Логируем найденные документы
@@ -103,42 +80,35 @@ class AgentService:
             # Формируем контекст из документов
             context = self._build_context(context_docs)
             
-            # Генерируем ответ через Ollama
-            try:
-                response = self.ollama_service.generate_response(
-                    prompt=agent.prompt,
-                    context=context,
-                    user_text=text
-                )
-                
-                # Проверяем, что получили валидный ответ
-                if not response or not response.strip():
-                    response = "Извините, не удалось сгенерировать ответ. Попробуйте переформулировать вопрос."
+            # Повторный алерт с теми же документами - ответ из кэша без вызова Ollama
+            cache_key = self._get_response_cache_key(agent_id, user_id, agent.prompt, context_docs, text)
+            response = self.response_cache.get(cache_key) if cache_key else None
+            
+            # Генерируем ответ через Ollama (асинхронно - event loop свободен на время генерации)
+            if response is None:
+                try:
+                    generation_start = time.time()
+                    response = await self.ollama_service.agenerate_response(
+                        prompt=agent.prompt,
+                        context=context,
+                        user_text=text
+                    )
                     
-            except Exception as e:
-                logger.error(f"Ошибка при генерации ответа через Ollama: {e}")
-                response = f"Произошла ошибка при генерации ответа: {str(e)}"
+                    # Проверяем, что получили валидный ответ
+                    if not response or not response.strip():
+                        response = OllamaService.EMPTY_RESPONSE
+                    elif cache_key:
+                        self.response_cache.set(cache_key, response, time.time() - generation_start)
+                        
+                except Exception as e:
+                    logger.error(f"Ошибка при генерации ответа через Ollama: {e}")
+                    response = f"Произошла ошибка при генерации ответа: {str(e)}"
             
             # Вычисляем время обработки
             processing_time = time.time() - start_time
             
             # Сохраняем лог
-            try:
-                log = AgentLog(
-                    agent_id=agent_id,
-                    user_id=user_id,
-                    text_analyzed=text,
-                    response=response,
-                    processing_time=processing_time,
-                    text_length=len(text),
-                    documents_used=len(context_docs)
-                )
-                
-                db_session.add(log)
-                await db_session.commit()
-            except Exception as e:
-                logger.error(f"Ошибка при сохранении лога: {e}")
-                # Не прерываем выполнение, если не удалось сохранить лог
+            await self._save_log(agent_id, user_id, text, response, processing_time, len(context_docs), db_session)
             
             return {
                 "success": True,
@@ -159,6 +129,133 @@ class AgentService:
                 "documents_used": 0
             }
     
+    async def validate_analysis_request(self, agent_id: int, user_id: int, text: str,
+                                        db_session) -> Tuple[Optional[Agent], Optional[str]]:
+        """Проверяет, что текст не пуст, агент доступен пользователю, активен и настроен. Возвращает (агент, ошибка)"""
+        # Валидация входных параметров
+        if not text or not text.strip():
+            return None, "Текст для анализа не может быть пустым"
+        
+        # Получаем агента
+        agent = await self._get_agent(agent_id, db_session)
+        if not agent:
+            return None, "Агент не найден"
+        
+        # Проверяем, что пользователь имеет доступ к агенту
+        from ..repositories.user_agent import UserAgentRepository
+        user_agent_repo = UserAgentRepository(db_session)
+        user_agent = await user_agent_repo.get_by_user_and_agent(user_id, agent_id)
+        if not user_agent or not user_agent.is_active:
+            logger.warning(f"Пользователь {user_id} пытается использовать недоступный агент {agent_id}")
+            return None, "Нет доступа к агенту"
+        
+        # Проверяем активность агента
+        if not agent.is_active:
+            return None, "Агент неактивен"
+        
+        # Проверяем промпт агента
+        if not agent.prompt or not agent.prompt.strip():
+            return None, "Промпт агента не настроен"
+        
+        return agent, None
+    
+    async def analyze_text_stream(self, agent_id: int, user_id: int, prompt: str,
+                                  text: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Потоковый анализ текста (агент уже проверен validate_analysis_request).
+        Отдает события: "meta" (сколько документов в контексте), "token" (часть ответа по мере генерации),
+        "done" (итоговый ответ) или "error". Работает со своей сессией БД: ответ стримится уже после
+        завершения запроса, в котором открывалась сессия роутера.
+        """
+        start_time = time.time()
+        async with AsyncSessionLocal() as db_session:
+            # Алерт есть в таблице регламента - отдаем текст реакции целиком, без поиска и LLM
+            runbook_record = await self._find_runbook_record(agent_id, user_id, text, db_session)
+            if runbook_record is not None:
+                yield {"event": "meta", "documents_used": 1}
+                yield {"event": "token", "text": runbook_record.reaction}
+                processing_time = time.time() - start_time
+                yield {"event": "done", "response": runbook_record.reaction,
+                       "processing_time": processing_time, "documents_used": 1}
+                await self._save_log(agent_id, user_id, text, runbook_record.reaction, processing_time, 1, db_session)
+                return
+            
+            try:
+                context_docs = await self.vector_store.asearch_similar(user_id, agent_id, text, n_results=3)
+            except Exception as e:
+                logger.error(f"Ошибка при поиске документов для агента {agent_id}, пользователя {user_id}: {e}")
+                yield {"event": "error", "error_message": "Ошибка при поиске документов в базе знаний"}
+                return
+            yield {"event": "meta", "documents_used": len(context_docs)}
+            
+            cache_key = self._get_response_cache_key(agent_id, user_id, prompt, context_docs, text)
+            response = self.response_cache.get(cache_key) if cache_key else None
+            if response is not None:
+                yield {"event": "token", "text": response}
+                yield {"event": "done", "response": response, "processing_time": time.time() - start_time,
+                       "documents_used": len(context_docs)}
+                await self._save_log(agent_id, user_id, text, response, time.time() - start_time,
+                                     len(context_docs), db_session)
+                return
+            
+            generation_start = time.time()
+            async for event in self.ollama_service.astream_response(
+                prompt=prompt,
+                context=self._build_context(context_docs),
+                user_text=text
+            ):
+                if event["event"] == "done":
+                    response = event["response"]
+                    if cache_key:
+                        self.response_cache.set(cache_key, response, time.time() - generation_start)
+                    event = {**event, "processing_time": time.time() - start_time,
+                             "documents_used": len(context_docs)}
+                yield event
+            
+            if response is not None:
+                await self._save_log(agent_id, user_id, text, response, time.time() - start_time,
+                                     len(context_docs), db_session)
+    
+    def _get_response_cache_key(self, agent_id: int, user_id: int, prompt: str,
+                                context_docs: List[Dict[str, Any]], text: str) -> Optional[str]:
+        """Ключ кэша ответов LLM (None, если кэш выключен или документов нет)"""
+        if self.response_cache is None:
+            return None
+        return self.response_cache.build_key(agent_id, user_id, self.ollama_service.model_name,
+                                             prompt, context_docs, text)
+    
+    async def _find_runbook_record(self, agent_id: int, user_id: int, text: str, db_session):
+        """Ищет запись регламента, точно соответствующую алерту (None - нужен поиск и LLM)"""
+        if not RAGConfig.RUNBOOK_DIRECT_ANSWERS:
+            return None
+        try:
+            record = await RunbookRecordRepository(db_session).find_match(agent_id, user_id, text)
+            if record is not None:
+                logger.info(f"Алерт найден в регламенте агента {agent_id}: '{record.title[:100]}'")
+            return record
+        except Exception as e:
+            logger.error(f"Ошибка при поиске в регламенте агента {agent_id}: {e}")
+            return None
+    
+    async def _save_log(self, agent_id: int, user_id: int, text: str, response: str,
+                        processing_time: float, documents_used: int, db_session):
+        """Сохраняет лог анализа (ошибка не прерывает выполнение)"""
+        try:
+            log = AgentLog(
+                agent_id=agent_id,
+                user_id=user_id,
+                text_analyzed=text,
+                response=response,
+                processing_time=processing_time,
+                text_length=len(text),
+                documents_used=documents_used
+            )
+            
+            db_session.add(log)
+            await db_session.commit()
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении лога: {e}")
+    
     def _build_context(self, context_docs: List[Dict[str, Any]]) -> str:
         """Строит контекст из найденных документов"""
         if not context_docs:
@@ -168,7 +265,8 @@ class AgentService:
         for doc in context_docs:
             filename = doc.get('metadata', {}).get('filename', 'Unknown')
             text = doc.get('text', '')
-            context_parts.append(f"Документ: {filename}\n{text[:500]}...")
+            # Чанки уже ограничены по размеру, поэтому передаем их целиком
+            context_parts.append(f"Документ: {filename}\n{text}")
         
         return "\n\n".join(context_parts)
     
@@ -203,7 +301,11 @@ class AgentService:
         """Обновляет агента"""
         try:
             repo = AgentRepository(db_session)
-            return await repo.update(agent_id, agent_data)
+            agent = await repo.update(agent_id, agent_data)
+            if agent is not None and agent_data.prompt is not None and self.response_cache is not None:
+                # Ответы с прежним промптом больше не актуальны
+                self.response_cache.invalidate_agent(agent_id)
+            return agent
         except Exception as e:
             logger.error(f"Ошибка при обновлении агента {agent_id}: {e}")
             return None
@@ -218,29 +320,31 @@ class AgentService:
             return False
     
     async def process_document(self, agent_id: int, user_id: int, file_path: str, 
-                             filename: str, file_type: str, db_session) -> bool:
+                             filename: str, file_type: str, db_session,
+                             document_id: Optional[int] = None) -> bool:
         """Обрабатывает загруженный документ"""
         try:
-            # Извлекаем текст из документа
-            text = self.document_processor.extract_text(file_path, file_type)
+            # Извлекаем текст из документа и разбиваем его на чанки
+            chunks = self.document_processor.extract_chunks(file_path, file_type)
             
-            if not text:
+            if not chunks:
                 logger.warning(f"Не удалось извлечь текст из документа {filename}")
                 return False
             
             # Добавляем в векторную БД
             doc_data = {
-                'id': f"temp_{filename}",
-                'text': text,
+                'id': document_id if document_id is not None else f"temp_{filename}",
+                'chunks': chunks,
                 'filename': filename,
                 'file_type': file_type,
                 'uploaded_at': time.time()
             }
             
-            success = self.vector_store.add_documents(user_id, agent_id, [doc_data])
+            # Обновление на месте: при повторной обработке документа меняются только измененные чанки
+            result = self.vector_store.update_document(user_id, agent_id, doc_data)
             
-            if success:
-                logger.info(f"Документ {filename} успешно обработан для агента {agent_id}")
+            if result is not None:
+                logger.info(f"Документ {filename} успешно обработан для агента {agent_id} ({len(chunks)} чанков, {result})")
                 return True
             else:
                 logger.error(f"Ошибка при добавлении документа {filename} в векторную БД")
@@ -262,18 +366,15 @@ class AgentService:
             
             # Подсчитываем документы
             docs_count = 0
-            if vector_path.exists():
-                try:
-                    import chromadb
-                    client = chromadb.PersistentClient(path=str(vector_path))
-                    collection = client.get_collection(f"agent_{agent_id}_docs")
-                    docs_count = collection.count()
-                except:
-                    pass
+            try:
+                docs_count = self.vector_store.count_documents(user_id, agent_id)
+            except Exception as e:
+                logger.warning(f"Не удалось подсчитать документы агента {agent_id}: {e}")
             
             return {
                 "agent_id": agent_id,
                 "documents_count": docs_count,
+                "collection_version": self.vector_store.get_collection_version(user_id, agent_id),
                 "vector_db_path": str(vector_path),
                 "ollama_status": self.ollama_service.test_connection()
             }
@@ -0,0 +1,262 @@
+import os
+import re
+import json
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Iterable
+
+from src.core.rag_config import RAGConfig
+
+logger = logging.getLogger(__name__)
+
+# Код алерта: z735, c217, C214a и т.п. Только буквы-префиксы кодов (RAG_ALERT_CODE_PREFIXES),
+# иначе за коды принимаются обычные слова вроде p99, x86, h264
+_CODE_PREFIXES = re.escape(RAGConfig.ALERT_CODE_PREFIXES.lower() + RAGConfig.ALERT_CODE_PREFIXES.upper())
+_CODE = rf'[{_CODE_PREFIXES}]\d+[a-z]?'
+ALERT_CODE_PATTERN = re.compile(rf'\b({_CODE})\b')
+# Название алерта Grafana: [Alerting] Memory OpenApi IS/CS alert
+ALERTING_NAME_PATTERN = re.compile(r'\[Alerting\]\s*([^\n]+?)(?:\s+alert\b|\s*$)', re.IGNORECASE | re.MULTILINE)
+# Фраза после кода алерта: z735 Инвалидные пакеты в MTBDM
+CODE_PHRASE_PATTERN = re.compile(rf'\b{_CODE}[.:]?\s+([^\n|]+)')
+
+# Слишком длинные значения (например, текст "Как реагировать") не индексируем
+MAX_NAME_LENGTH = 200
+MIN_NAME_LENGTH = 4
+
+
+def normalize_alert_name(name: str) -> str:
+    """Нормализует название алерта: регистр, пробелы, пунктуация по краям, хвост 'alert'"""
+    name = re.sub(r'\s+', ' ', name).strip().lower()
+    name = re.sub(r'\s+alert$', '', name)
+    return name.strip(' .:;,-')
+
+
+def _name_key(name: str) -> Optional[str]:
+    normalized = normalize_alert_name(name)
+    if MIN_NAME_LENGTH <= len(normalized) <= MAX_NAME_LENGTH:
+        return f"name:{normalized}"
+    return None
+
+
+def _first_line(text: str) -> str:
+    for line in text.split('\n'):
+        if line.strip():
+            return line.strip()
+    return ""
+
+
+def extract_document_keys(text: str) -> Dict[str, List[str]]:
+    """
+    Извлекает ключи индекса из текста чанка.
+    Возвращает ключи первой строки (заголовок/строка таблицы) и ключи остального текста.
+    """
+    first_line = _first_line(text)
+    first_keys = set()
+
+    for code in ALERT_CODE_PATTERN.findall(first_line):
+        first_keys.add(f"code:{code.lower()}")
+
+    # Первая строка целиком и каждая ячейка строки таблицы ("Колонка: значение")
+    candidates = [first_line]
+    for cell in first_line.split('|'):
+        candidates.append(cell)
+        if ':' in cell:
+            candidates.append(cell.split(':', 1)[1])
+    for name in ALERTING_NAME_PATTERN.findall(first_line) + CODE_PHRASE_PATTERN.findall(first_line):
+        candidates.append(name)
+    for candidate in candidates:
+        key = _name_key(candidate)
+        if key:
+            first_keys.add(key)
+
+    body_keys = set()
+    for code in ALERT_CODE_PATTERN.findall(text):
+        body_keys.add(f"code:{code.lower()}")
+    for name in ALERTING_NAME_PATTERN.findall(text):
+        key = _name_key(name)
+        if key:
+            body_keys.add(key)
+
+    return {"first_line": sorted(first_keys), "body": sorted(body_keys - first_keys)}
+
+
+def extract_query_keys(query: str) -> List[str]:
+    """Извлекает ключи для поиска по индексу из текста алерта (в порядке приоритета)"""
+    keys = []
+
+    for name in ALERTING_NAME_PATTERN.findall(query):
+        keys.append(_name_key(name))
+    for code in ALERT_CODE_PATTERN.findall(query):
+        keys.append(f"code:{code.lower()}")
+    for name in CODE_PHRASE_PATTERN.findall(query):
+        keys.append(_name_key(name))
+
+    # Убираем пустые и дубликаты, сохраняя порядок
+    return list(dict.fromkeys(key for key in keys if key))
+
+
+def extract_alert_keys(text: str) -> List[str]:
+    """
+    Ключи самого алерта - только из его первой строки (заголовка).
+    Коды, упомянутые в теле, не учитываются; код из заголовка - только если он там один.
+    """
+    first_line = _first_line(text)
+    keys = [_name_key(name) for name in ALERTING_NAME_PATTERN.findall(first_line)]
+
+    codes = {code.lower() for code in ALERT_CODE_PATTERN.findall(first_line)}
+    if len(codes) == 1:
+        keys.append(f"code:{codes.pop()}")
+        keys.extend(_name_key(name) for name in CODE_PHRASE_PATTERN.findall(first_line))
+
+    return list(dict.fromkeys(key for key in keys if key))
+
+
+class AlertIndex:
+    """
+    Инвертированный индекс алертов агента: код алерта / нормализованное название -> ID чанков.
+    Хранится в JSON рядом с векторной БД агента и обновляется при загрузке документов.
+    Изменения выполняются под блокировкой файла (API и воркеры Celery пишут в один индекс)
+    и всегда начинаются с перечитывания файла, чтобы не затереть чужие изменения.
+    """
+
+    _cache: Dict[str, Dict[str, Any]] = {}  # Загруженные индексы по пути файла
+    _lock = threading.Lock()
+
+    def __init__(self, index_path: Path):
+        self.index_path = Path(index_path)
+
+    @staticmethod
+    def _empty() -> Dict[str, Any]:
+        return {"first_line": {}, "body": {}, "chunks": {}}
+
+    def exists(self) -> bool:
+        return self.index_path.exists()
+
+    @contextmanager
+    def _locked(self):
+        """Блокировка индекса между потоками и процессами (на отдельном файле - сам индекс подменяется)"""
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock, open(self.index_path.with_name(f"{self.index_path.name}.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self, force: bool = False) -> Dict[str, Any]:
+        """
+        Загружает индекс с диска (перечитывает, если файл изменил другой процесс).
+        force - читать файл, даже если mtime совпадает с кэшем (перед изменением под блокировкой:
+        две записи в пределах разрешения mtime иначе неотличимы)
+        """
+        path_str = str(self.index_path)
+        try:
+            mtime = os.path.getmtime(path_str)
+        except OSError:
+            return self._empty()
+
+        cached = self._cache.get(path_str)
+        if cached and cached["mtime"] == mtime and not force:
+            return cached["data"]
+
+        try:
+            with open(path_str, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.error(f"Не удалось прочитать индекс алертов {path_str}: {e}")
+            return self._empty()
+
+        self._cache[path_str] = {"mtime": mtime, "data": data}
+        return data
+
+    def _save(self, data: Dict[str, Any]):
+        """Атомарно сохраняет индекс на диск"""
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.index_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+        self._cache[str(self.index_path)] = {"mtime": os.path.getmtime(self.index_path), "data": data}
+
+    def add_chunks(self, ids: Iterable[str], texts: Iterable[str]):
+        """Добавляет чанки в индекс"""
+        with self._locked():
+            data = self._load(force=True)
+            for chunk_id, text in zip(ids, texts):
+                self._add_chunk(data, chunk_id, text)
+            self._save(data)
+
+    def remove_chunks(self, ids: Iterable[str]):
+        """Удаляет чанки из индекса"""
+        with self._locked():
+            data = self._load(force=True)
+            for chunk_id in ids:
+                self._remove_chunk(data, chunk_id)
+            self._save(data)
+
+    def rebuild(self, ids: Iterable[str], texts: Iterable[str]):
+        """Полностью перестраивает индекс по содержимому коллекции"""
+        with self._locked():
+            data = self._empty()
+            for chunk_id, text in zip(ids, texts):
+                self._add_chunk(data, chunk_id, text)
+            self._save(data)
+        logger.info(f"Индекс алертов {self.index_path} перестроен: {len(data['chunks'])} чанков")
+
+    def _add_chunk(self, data: Dict[str, Any], chunk_id: str, text: str):
+        self._remove_chunk(data, chunk_id)
+        keys = extract_document_keys(text or "")
+        for section in ("first_line", "body"):
+            for key in keys[section]:
+                postings = data[section].setdefault(key, [])
+                if chunk_id not in postings:
+                    postings.append(chunk_id)
+        data["chunks"][chunk_id] = keys
+
+    def _remove_chunk(self, data: Dict[str, Any], chunk_id: str):
+        keys = data["chunks"].pop(chunk_id, None)
+        if not keys:
+            return
+        for section in ("first_line", "body"):
+            for key in keys.get(section, []):
+                postings = data[section].get(key)
+                if postings and chunk_id in postings:
+                    postings.remove(chunk_id)
+                    if not postings:
+                        del data[section][key]
+
+    def lookup(self, query: str) -> Optional[Dict[str, Any]]:
+        """
+        Ищет чанки по ключам алерта из запроса.
+        Сначала совпадения в первой строке чанка, затем в остальном тексте.
+        Возвращает {'ids': [...], 'match_type': 'first_line'|'full_text'} или None.
+        """
+        query_keys = extract_query_keys(query)
+        if not query_keys:
+            return None
+
+        data = self._load()
+        for section, match_type in (("first_line", "first_line"), ("body", "full_text")):
+            for key in query_keys:
+                ids = data[section].get(key)
+                if ids:
+                    logger.info(f"Индекс алертов: ключ '{key}' -> {len(ids)} чанков ({match_type})")
+                    return {"ids": list(ids), "match_type": match_type, "key": key}
+        return None
+
+    def replace_with(self, other: "AlertIndex"):
+        """Подменяет индекс файлом другого индекса (готовый индекс теневой коллекции при переиндексации)"""
+        with self._locked():
+            os.replace(other.index_path, self.index_path)
+            self._cache.pop(str(self.index_path), None)
+            other._cache.pop(str(other.index_path), None)
+
+    def delete(self):
+        """Удаляет индекс с диска"""
+        with self._locked():
+            self._cache.pop(str(self.index_path), None)
+            if self.index_path.exists():
+                os.remove(self.index_path)
@@ -0,0 +1,267 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ChromaClientPool:
+    """
+    Пул клиентов ChromaDB (по одному на директорию векторной БД) с кэшем хендлов коллекций.
+    Создание клиентов защищено блокировками, простаивающие клиенты вытесняются по LRU.
+    Клиенты выдаются в аренду (lease): устаревший или вытесненный клиент сразу убирается из пула
+    (новые запросы получают новый клиент), а закрывается, только когда завершатся начатые на нем запросы.
+    Актуальность клиента проверяется по поколению каждого агента отдельно (version_key): в общей
+    коллекции запись одного агента не заставляет переоткрывать клиент ради остальных.
+    """
+
+    def __init__(self, max_clients: int, idle_ttl: int):
+        self.max_clients = max_clients
+        self.idle_ttl = idle_ttl
+        # path -> {client, system, collections, last_used, opened_at, versions, refs, retired}
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._path_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._retired_in_use = 0
+        self.created = 0
+        self.evicted = 0
+
+    def _get_path_lock(self, path_str: str) -> threading.Lock:
+        with self._lock:
+            lock = self._path_locks.get(path_str)
+            if lock is None:
+                lock = self._path_locks[path_str] = threading.Lock()
+            return lock
+
+    @staticmethod
+    def _is_fresh(entry: Dict[str, Any], version: Optional[int], version_key: Any,
+                  changed_at: Optional[float]) -> bool:
+        """
+        Видит ли клиент поколение version агента version_key. Агент, к которому через клиент еще
+        не обращались, актуален, если его коллекция не менялась после открытия клиента (changed_at)
+        """
+        if version is None:
+            return True
+        known = entry["versions"].get(version_key)
+        if known is None:
+            if changed_at is not None and changed_at >= entry["opened_at"]:
+                return False
+            entry["versions"][version_key] = version
+            return True
+        return known == version
+
+    def _take_locked(self, path_str: str, version: Optional[int], version_key: Any = None,
+                     changed_at: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Берет в аренду актуальный клиент пула (None, если клиента нет или он устарел)"""
+        entry = self._entries.get(path_str)
+        if entry is None or not self._is_fresh(entry, version, version_key, changed_at):
+            return None
+        entry["last_used"] = time.time()
+        entry["refs"] += 1
+        self._entries.move_to_end(path_str)
+        return entry
+
+    def _acquire(self, vector_path: Path, version: Optional[int] = None, version_key: Any = None,
+                 changed_at: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Берет в аренду клиент для директории (вернуть - _release).
+        Если передано поколение коллекции агента и оно отличается от поколения, которое видел клиент,
+        открывается новый клиент: коллекцию мог изменить другой процесс (воркер Celery).
+        """
+        path_str = str(vector_path)
+        with self._lock:
+            entry = self._take_locked(path_str, version, version_key, changed_at)
+        if entry is not None:
+            return entry
+
+        # Создание клиента дорогое - блокируем только эту директорию, а не весь пул
+        to_close = []
+        with self._get_path_lock(path_str):
+            with self._lock:
+                entry = self._take_locked(path_str, version, version_key, changed_at)
+                if entry is None and path_str in self._entries:
+                    to_close += self._retire_locked(path_str)
+            if entry is None:
+                # Время открытия - до создания клиента: изменения во время открытия считаются более новыми
+                opened_at = time.time()
+                client, system = self._create_client(path_str)
+                entry = {
+                    "client": client, "system": system, "collections": {}, "last_used": time.time(),
+                    "opened_at": opened_at, "versions": {} if version is None else {version_key: version},
+                    "refs": 1, "retired": False
+                }
+                with self._lock:
+                    self._entries[path_str] = entry
+                    self.created += 1
+                    to_close += self._evict_locked()
+
+        for closed_path, closed_entry in to_close:
+            self._stop_client(closed_path, closed_entry)
+        return entry
+
+    def _release(self, path_str: str, entry: Dict[str, Any]):
+        """Возвращает аренду; последний запрос на выведенном из пула клиенте закрывает его"""
+        with self._lock:
+            entry["refs"] -= 1
+            close = entry["retired"] and entry["refs"] == 0
+            if close:
+                self._retired_in_use -= 1
+        if close:
+            self._stop_client(path_str, entry)
+
+    @contextmanager
+    def lease(self, vector_path: Path, version: Optional[int] = None, version_key: Any = None,
+              changed_at: Optional[float] = None):
+        """Клиент директории на время блока with (не закрывается, пока блок не завершится)"""
+        entry = self._acquire(vector_path, version, version_key, changed_at)
+        try:
+            yield entry
+        finally:
+            self._release(str(vector_path), entry)
+
+    @contextmanager
+    def collection(self, vector_path: Path, name: str, metadata: Optional[Dict[str, Any]] = None,
+                   version: Optional[int] = None, version_key: Any = None, changed_at: Optional[float] = None):
+        """Хендл коллекции из кэша пула (коллекция создается при первом обращении) на время блока with"""
+        with self.lease(vector_path, version, version_key, changed_at) as entry:
+            handle = entry["collections"].get(name)
+            if handle is None:
+                with self._get_path_lock(str(vector_path)):
+                    handle = entry["collections"].get(name)
+                    if handle is None:
+                        handle = entry["client"].get_or_create_collection(name=name, metadata=metadata)
+                        entry["collections"][name] = handle
+                        logger.info(f"Открыта коллекция {name} в {vector_path}")
+            yield handle
+
+    @contextmanager
+    def existing_collection(self, vector_path: Path, name: str, version: Optional[int] = None,
+                            version_key: Any = None, changed_at: Optional[float] = None):
+        """Существующая коллекция на время блока with (None, если ее нет); не создает ни директорию, ни коллекцию"""
+        if not Path(vector_path).exists():
+            yield None
+            return
+
+        with self.lease(vector_path, version, version_key, changed_at) as entry:
+            handle = entry["collections"].get(name)
+            if handle is None:
+                try:
+                    handle = entry["client"].get_collection(name=name)
+                    entry["collections"][name] = handle
+                except Exception:
+                    handle = None
+            yield handle
+
+    def delete_collection(self, vector_path: Path, name: str, version: Optional[int] = None,
+                          version_key: Any = None, changed_at: Optional[float] = None) -> bool:
+        """Удаляет коллекцию и ее хендл из кэша пула (False, если коллекции нет)"""
+        if not Path(vector_path).exists():
+            return False
+        with self.lease(vector_path, version, version_key, changed_at) as entry:
+            with self._get_path_lock(str(vector_path)):
+                entry["collections"].pop(name, None)
+                try:
+                    entry["client"].delete_collection(name=name)
+                except Exception:
+                    return False
+        logger.info(f"Удалена коллекция {name} в {vector_path}")
+        return True
+
+    def adopt_version(self, vector_path: Path, collection, version: int, version_key: Any = None):
+        """
+        Коллекцию изменил этот процесс через хендл collection и увеличил поколение агента до version:
+        клиент уже видит свою запись и остается актуальным. Если между открытием клиента и записью
+        поколение менял кто-то еще (или запись шла через уже замененный клиент), клиент не трогаем -
+        он переоткроется при следующем обращении.
+        """
+        with self._lock:
+            entry = self._entries.get(str(vector_path))
+            if entry is None or entry["versions"].get(version_key) != version - 1:
+                return
+            if any(handle is collection for handle in entry["collections"].values()):
+                entry["versions"][version_key] = version
+
+    def discard(self, vector_path: Path):
+        """Убирает клиент директории из пула (например, перед ее удалением)"""
+        path_str = str(vector_path)
+        with self._lock:
+            to_close = self._retire_locked(path_str) if path_str in self._entries else []
+        for closed_path, closed_entry in to_close:
+            self._stop_client(closed_path, closed_entry)
+
+    def _retire_locked(self, path_str: str) -> List[Any]:
+        """
+        Убирает клиент из пула и из общего кэша систем chromadb (следующий PersistentClient для пути
+        будет новым). Возвращает [(path, entry)], если клиент можно закрыть сразу (нет аренд)
+        """
+        entry = self._entries.pop(path_str)
+        entry["retired"] = True
+        self._detach_client(path_str, entry)
+        if entry["refs"] == 0:
+            return [(path_str, entry)]
+        self._retired_in_use += 1
+        return []
+
+    def _evict_locked(self) -> List[Any]:
+        """Вытесняет клиентов, простаивающих дольше idle_ttl и лишних сверх max_clients"""
+        now = time.time()
+        to_close = []
+        while self._entries:
+            path_str, entry = next(iter(self._entries.items()))
+            if len(self._entries) > self.max_clients or now - entry["last_used"] > self.idle_ttl:
+                to_close += self._retire_locked(path_str)
+                self.evicted += 1
+            else:
+                break
+        return to_close
+
+    def _create_client(self, path_str: str):
+        """Создает клиент ChromaDB. Возвращает (клиент, его System)"""
+        try:
+            import chromadb
+            from chromadb.api.shared_system_client import SharedSystemClient
+            Path(path_str).mkdir(parents=True, exist_ok=True)
+            client = chromadb.PersistentClient(path=path_str)
+            logger.info(f"Создан новый клиент ChromaDB для пути: {path_str}")
+        except Exception as e:
+            logger.error(f"Ошибка при создании клиента ChromaDB: {e}")
+            raise
+        return client, SharedSystemClient._identifer_to_system.get(path_str)
+
+    def _detach_client(self, path_str: str, entry: Dict[str, Any]):
+        """Убирает System клиента из общего кэша chromadb, не останавливая ее"""
+        try:
+            from chromadb.api.shared_system_client import SharedSystemClient
+            if entry["system"] is not None and SharedSystemClient._identifer_to_system.get(path_str) is entry["system"]:
+                SharedSystemClient._identifer_to_system.pop(path_str)
+        except Exception as e:
+            logger.debug(f"Не удалось убрать клиент ChromaDB {path_str} из кэша систем: {e}")
+
+    def _stop_client(self, path_str: str, entry: Dict[str, Any]):
+        """Освобождает ресурсы клиента ChromaDB (SQLite, HNSW-индексы в памяти)"""
+        entry["collections"].clear()
+        try:
+            # PersistentClient не имеет публичного close: останавливаем его System
+            if entry["system"] is not None:
+                entry["system"].stop()
+        except Exception as e:
+            logger.debug(f"Не удалось корректно закрыть клиент ChromaDB {path_str}: {e}")
+        logger.info(f"Клиент ChromaDB для пути {path_str} закрыт")
+
+    def stats(self) -> Dict[str, Any]:
+        """Возвращает статистику пула"""
+        with self._lock:
+            return {
+                "clients": len(self._entries),
+                "collections": sum(len(entry["collections"]) for entry in self._entries.values()),
+                "leases": sum(entry["refs"] for entry in self._entries.values()),
+                "retired_in_use": self._retired_in_use,
+                "max_clients": self.max_clients,
+                "idle_ttl": self.idle_ttl,
+                "created": self.created,
+                "evicted": self.evicted
+            }
@@ -0,0 +1,63 @@
+import os
+import fcntl
+import logging
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CollectionVersionStore:
+    """
+    Счетчик поколений коллекции агента.
+    Увеличивается при каждом изменении коллекции и входит в ключи кэшей,
+    поэтому устаревшие записи просто перестают находиться - без сброса всего кэша.
+    Хранится в файле рядом с векторной БД, чтобы его видели и API, и воркеры Celery.
+    """
+
+    def __init__(self, base_path: Path, filename: str = "collection_version"):
+        self.base_path = Path(base_path)
+        self.filename = filename
+
+    def get_version_path(self, user_id: int, agent_id: int) -> Path:
+        """Получает путь к файлу поколения коллекции агента"""
+        return self.base_path / str(user_id) / str(agent_id) / self.filename
+
+    def get(self, user_id: int, agent_id: int) -> int:
+        """Текущее поколение коллекции (0, если коллекция ни разу не менялась)"""
+        try:
+            with open(self.get_version_path(user_id, agent_id), "r") as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось прочитать поколение коллекции агента {agent_id}: {e}")
+            return 0
+
+    def bump(self, user_id: int, agent_id: int) -> int:
+        """Увеличивает поколение коллекции (атомарно между процессами)"""
+        path = self.get_version_path(user_id, agent_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Блокировка на отдельном файле, а само значение подменяется атомарно через os.replace,
+        # чтобы читатели никогда не видели частично записанный файл
+        with open(path.with_suffix(".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                version = self.get(user_id, agent_id) + 1
+                tmp_path = path.with_suffix(".tmp")
+                with open(tmp_path, "w") as f:
+                    f.write(str(version))
+                os.replace(tmp_path, path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        logger.info(f"{self.filename} агента {agent_id} пользователя {user_id}: {version}")
+        return version
+
+    def changed_at(self, user_id: int, agent_id: int) -> Optional[float]:
+        """Время последнего изменения поколения (None, если коллекция ни разу не менялась)"""
+        try:
+            return os.stat(self.get_version_path(user_id, agent_id)).st_mtime
+        except OSError:
+            return None
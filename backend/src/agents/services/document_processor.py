@@ -1,9 +1,14 @@
 import os
 import shutil
+import hashlib
 import logging
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Iterator
 from ..utils.file_handlers import FileProcessor
+from ..utils.chunker import TextChunker
+from ..utils.runbook_parser import RunbookParser
+from .extraction_cache import ExtractionCache, compute_file_hash
+from src.core.rag_config import RAGConfig
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +20,8 @@ class DocumentProcessor:
         self.base_path = Path(base_path)
         self.base_path.mkdir(exist_ok=True)
         self.file_processor = FileProcessor()
+        self.chunker = TextChunker()
+        self.extraction_cache = ExtractionCache(self.base_path / "extracted") if RAGConfig.EXTRACTION_CACHE_ENABLED else None
     
     def get_agent_docs_path(self, user_id: int, agent_id: int) -> Path:
         """Получает путь к папке документов агента"""
@@ -78,6 +85,179 @@ class DocumentProcessor:
                 "error": str(e)
             }
     
+    async def save_upload_stream(self, user_id: int, agent_id: int, file, filename: str,
+                                 max_size_mb: Optional[int] = None,
+                                 allowed_types: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Копирует загруженный файл в папку документов агента.
+        Тело запроса к этому моменту уже сохранено Starlette во временный файл (UploadFile),
+        поэтому это вторая копия: она читается частями, размер проверяется по мере чтения
+        (не доверяя заголовкам), а хэш содержимого (sha256) считается на лету - для
+        дедупликации без повторного чтения. Копия пишется в .part и переименовывается
+        только целиком, при ошибке .part удаляется.
+        """
+        from starlette.concurrency import run_in_threadpool
+        
+        max_size_mb = max_size_mb or RAGConfig.UPLOAD_MAX_SIZE_MB
+        max_size_bytes = max_size_mb * 1024 * 1024
+        
+        # Тип проверяем до записи, чтобы не сохранять неподдерживаемые файлы
+        file_type = Path(filename).suffix.lower().lstrip('.')
+        supported_types = allowed_types or self.file_processor.get_supported_types()
+        if file_type not in supported_types:
+            logger.warning(f"Неподдерживаемый тип файла {file_type} для файла {filename}")
+            return {
+                "success": False,
+                "error": f"Неподдерживаемый тип файла: {file_type}. Разрешены: {', '.join(supported_types)} "
+            }
+        
+        file_path = self._new_document_path(user_id, agent_id, filename)
+        part_path = file_path.with_name(file_path.name + ".part")
+        
+        hasher = hashlib.sha256()
+        file_size = 0
+        try:
+            with open(part_path, "wb") as buffer:
+                while True:
+                    chunk = await file.read(RAGConfig.UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    file_size += len(chunk)
+                    if file_size > max_size_bytes:
+                        raise ValueError(f"Размер файла превышает {max_size_mb}MB")
+                    hasher.update(chunk)
+                    await run_in_threadpool(buffer.write, chunk)
+            
+            os.replace(part_path, file_path)
+        except ValueError as e:
+            logger.warning(f"Файл {filename} отклонен: {e}")
+            return {"success": False, "error": str(e)}
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении файла {filename}: {e}")
+            return {"success": False, "error": str(e)}
+        finally:
+            if part_path.exists():
+                os.remove(part_path)
+        
+        logger.info(f"Файл {filename} сохранен для агента {agent_id}, размер: {file_size} байт")
+        return {
+            "success": True,
+            "filename": file_path.name,
+            "original_filename": filename,
+            "file_path": str(file_path),
+            "file_type": file_type,
+            "file_size": file_size,
+            "content_hash": hasher.hexdigest()
+        }
+    
+    def _new_document_path(self, user_id: int, agent_id: int, filename: str) -> Path:
+        """Путь для нового файла в папке документов агента (с уникальным префиксом)"""
+        docs_path = self.get_agent_docs_path(user_id, agent_id)
+        docs_path.mkdir(parents=True, exist_ok=True)
+        return docs_path / f"{int(os.urandom(4).hex(), 16)}_{Path(filename).name}"
+    
+    def save_archive(self, user_id: int, agent_id: int, archive_path: str,
+                     max_files: Optional[int] = None, max_total_mb: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Распаковывает архив (zip, tar, tar.gz) в папку документов агента.
+        Каждый файл копируется потоково с проверкой размера и подсчетом хэша, неподдерживаемые
+        типы и служебные файлы пропускаются. Возвращает результаты в формате save_upload_stream.
+        Суммарный распакованный размер проверяется по мере чтения: при превышении архив
+        отклоняется целиком (ValueError), уже распакованные файлы удаляются.
+        """
+        import tarfile
+        import zipfile
+        
+        max_files = max_files or RAGConfig.BULK_MAX_FILES
+        max_size_mb = RAGConfig.UPLOAD_MAX_SIZE_MB
+        max_total_mb = max_total_mb or RAGConfig.BULK_MAX_EXTRACTED_SIZE_MB
+        supported_types = self.file_processor.get_supported_types()
+        results = []
+        saved = 0
+        total_size = 0
+        
+        def members():
+            if zipfile.is_zipfile(archive_path):
+                with zipfile.ZipFile(archive_path) as archive:
+                    for info in archive.infolist():
+                        if not info.is_dir():
+                            with archive.open(info) as member:
+                                yield info.filename, member
+            elif tarfile.is_tarfile(archive_path):
+                with tarfile.open(archive_path, "r:*") as archive:
+                    for info in archive:
+                        if info.isfile():
+                            member = archive.extractfile(info)
+                            if member is not None:
+                                with member:
+                                    yield info.name, member
+            else:
+                raise ValueError("Неподдерживаемый формат архива (ожидается zip или tar)")
+        
+        try:
+            for member_name, member in members():
+                filename = Path(member_name).name
+                if not filename or filename.startswith('.') or '__MACOSX' in member_name:
+                    continue
+                file_type = Path(filename).suffix.lower().lstrip('.')
+                if file_type not in supported_types:
+                    results.append({"success": False, "original_filename": member_name,
+                                    "error": f"Неподдерживаемый тип файла: {file_type}"})
+                    continue
+                if saved >= max_files:
+                    raise ValueError(f"В архиве больше {max_files} документов")
+            
+                file_path = self._new_document_path(user_id, agent_id, filename)
+                part_path = file_path.with_name(file_path.name + ".part")
+                hasher = hashlib.sha256()
+                file_size = 0
+                too_large = False
+                try:
+                    with open(part_path, "wb") as buffer:
+                        while True:
+                            chunk = member.read(RAGConfig.UPLOAD_CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            file_size += len(chunk)
+                            total_size += len(chunk)
+                            if total_size > max_total_mb * 1024 * 1024:
+                                raise ValueError(f"Распакованный архив превышает {max_total_mb}MB")
+                            if file_size > max_size_mb * 1024 * 1024:
+                                too_large = True
+                                break
+                            hasher.update(chunk)
+                            buffer.write(chunk)
+                    if not too_large:
+                        os.replace(part_path, file_path)
+                finally:
+                    if part_path.exists():
+                        os.remove(part_path)
+                if too_large:
+                    results.append({"success": False, "original_filename": member_name,
+                                    "error": f"Размер файла превышает {max_size_mb}MB"})
+                    continue
+            
+                saved += 1
+                results.append({
+                    "success": True,
+                    "filename": file_path.name,
+                    "original_filename": filename,
+                    "file_path": str(file_path),
+                    "file_type": file_type,
+                    "file_size": file_size,
+                    "content_hash": hasher.hexdigest()
+                })
+        
+        except Exception:
+            # Архив отклонен целиком - не оставляем уже распакованные файлы
+            for result in results:
+                if result["success"] and os.path.exists(result["file_path"]):
+                    os.remove(result["file_path"])
+            raise
+        
+        logger.info(f"Архив {archive_path}: сохранено {saved} документов для агента {agent_id}")
+        return results
+    
     def extract_text(self, file_path: str, file_type: str) -> str:
         """Извлекает текст из документа"""
         try:
@@ -86,6 +266,44 @@ class DocumentProcessor:
             logger.error(f"Ошибка при извлечении текста из {file_path}: {e}")
             raise
     
+    def iter_document_segments(self, file_path: str, file_type: str,
+                               content_hash: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Потоково отдает сегменты документа: из кэша извлечения, если файл уже разбирался,
+        иначе извлекает их из файла и попутно сохраняет в кэш.
+        """
+        if self.extraction_cache is None:
+            return self.file_processor.iter_segments(file_path, file_type)
+        
+        content_hash = content_hash or compute_file_hash(file_path)
+        cached = self.extraction_cache.read(content_hash, file_type)
+        if cached is not None:
+            logger.info(f"Документ {file_path}: сегменты взяты из кэша извлечения")
+            return cached
+        
+        return self.extraction_cache.write_through(
+            content_hash, file_type, self.file_processor.iter_segments(file_path, file_type)
+        )
+    
+    def extract_chunks(self, file_path: str, file_type: str, content_hash: Optional[str] = None,
+                       runbook_parser: Optional[RunbookParser] = None) -> List[Dict[str, Any]]:
+        """
+        Извлекает документ структурными сегментами и разбивает их на чанки для векторной БД.
+        runbook_parser по пути собирает записи алертов из таблиц регламентов.
+        """
+        try:
+            # Сегменты идут в чанкер потоком и не собираются в памяти. Список чанков документа
+            # собирается целиком: по нему update_document сравнивает документ с векторной БД
+            segments = self.iter_document_segments(file_path, file_type, content_hash)
+            if runbook_parser is not None:
+                segments = runbook_parser.observe(segments)
+            chunks = self.chunker.chunk_segments(segments)
+            logger.info(f"Документ {file_path}: {len(chunks)} чанков")
+            return chunks
+        except Exception as e:
+            logger.error(f"Ошибка при разбиении документа {file_path} на чанки: {e}")
+            raise
+    
     def delete_document(self, user_id: int, agent_id: int, filename: str) -> bool:
         """Удаляет документ"""
         try:
@@ -0,0 +1,125 @@
+import time
+import sqlite3
+import logging
+import threading
+from array import array
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from prometheus_client import Counter
+
+logger = logging.getLogger(__name__)
+
+
+EMBEDDING_CACHE_EVENTS = Counter(
+    "rag_embedding_cache_events_total",
+    "Embedding cache events (hit, miss, store, prune)",
+    ["event"]
+)
+
+# Ограничение SQLite на число параметров в одном запросе
+_QUERY_BATCH = 500
+
+
+class EmbeddingCache:
+    """
+    Кэш эмбеддингов по содержимому: (модель, хэш нормализованного текста чанка) -> вектор.
+    Хранится в SQLite рядом с векторными БД, поэтому общий для API и воркеров Celery:
+    при повторной загрузке документа модель считает только новые и измененные чанки.
+    Лишние записи удаляются не на каждую запись, а раз в prune_interval сохраненных векторов,
+    поэтому кэш может ненадолго превышать max_entries.
+    """
+
+    def __init__(self, db_path: Path, model_name: str, max_entries: int, prune_interval: int = 1):
+        self.db_path = Path(db_path)
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.prune_interval = max(1, prune_interval)
+        # Векторов сохранено этим процессом с последней очистки
+        self._unpruned = 0
+        self._prune_lock = threading.Lock()
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, chunk_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+                "created_at REAL NOT NULL, PRIMARY KEY (model, chunk_hash))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_embeddings_created_at ON embeddings (created_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        """Соединение на поток (sqlite3 не разрешает общие соединения между потоками)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, chunk_hashes: Iterable[str], model_name: Optional[str] = None) -> Dict[str, List[float]]:
+        """Возвращает найденные в кэше векторы по хэшам чанков (по умолчанию - модели кэша)"""
+        chunk_hashes = list(dict.fromkeys(chunk_hashes))
+        found: Dict[str, List[float]] = {}
+        conn = self._connect()
+        for start in range(0, len(chunk_hashes), _QUERY_BATCH):
+            batch = chunk_hashes[start:start + _QUERY_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            rows = conn.execute(
+                f"SELECT chunk_hash, vector FROM embeddings WHERE model = ? AND chunk_hash IN ({placeholders})",
+                [model_name or self.model_name, *batch]
+            ).fetchall()
+            for chunk_hash, blob in rows:
+                found[chunk_hash] = array("f", blob).tolist()
+
+        self.hits += len(found)
+        self.misses += len(chunk_hashes) - len(found)
+        EMBEDDING_CACHE_EVENTS.labels(event="hit").inc(len(found))
+        EMBEDDING_CACHE_EVENTS.labels(event="miss").inc(len(chunk_hashes) - len(found))
+        return found
+
+    def put_many(self, items: Iterable[Tuple[str, List[float]]], model_name: Optional[str] = None):
+        """Сохраняет векторы в кэш"""
+        now = time.time()
+        model_name = model_name or self.model_name
+        rows = [(model_name, chunk_hash, array("f", vector).tobytes(), now) for chunk_hash, vector in items]
+        if not rows:
+            return
+        conn = self._connect()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+        EMBEDDING_CACHE_EVENTS.labels(event="store").inc(len(rows))
+
+        with self._prune_lock:
+            self._unpruned += len(rows)
+            if self._unpruned < self.prune_interval:
+                return
+            self._unpruned = 0
+        self._prune(conn)
+
+    def _prune(self, conn: sqlite3.Connection):
+        """Удаляет самые старые записи сверх max_entries"""
+        total = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = total - self.max_entries
+        if excess <= 0:
+            return
+        with conn:
+            conn.execute(
+                "DELETE FROM embeddings WHERE rowid IN "
+                "(SELECT rowid FROM embeddings ORDER BY created_at LIMIT ?)",
+                (excess,)
+            )
+        EMBEDDING_CACHE_EVENTS.labels(event="prune").inc(excess)
+        logger.info(f"Кэш эмбеддингов: удалено {excess} старых записей")
+
+    def stats(self) -> Dict[str, Any]:
+        """Возвращает статистику кэша эмбеддингов текущего процесса"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
@@ -0,0 +1,171 @@
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional
+
+from prometheus_client import Counter, Histogram
+
+from src.core.rag_config import RAGConfig
+
+logger = logging.getLogger(__name__)
+
+
+EMBEDDING_TEXTS = Counter(
+    "rag_embedding_texts_total",
+    "Texts embedded by the embedding service",
+    ["model"]
+)
+
+EMBEDDING_BATCH_SIZE = Histogram(
+    "rag_embedding_batch_size",
+    "Texts per model forward pass",
+    ["model"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+)
+
+EMBEDDING_BATCH_LATENCY = Histogram(
+    "rag_embedding_batch_duration_seconds",
+    "Model forward pass latency in seconds",
+    ["model"]
+)
+
+EMBEDDING_QUEUE_WAIT = Histogram(
+    "rag_embedding_queue_wait_seconds",
+    "Time a request waits in the embedding queue",
+    ["model"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+
+
+class EmbeddingService:
+    """
+    Сервис эмбеддингов: один экземпляр на модель в процессе и отдельный поток, который собирает
+    одновременные запросы (загрузка документов, поиск по алертам) в общие пачки.
+    Модель и поток создаются лениво - уже после fork воркера Celery/uvicorn.
+    Обычно используется модель из RAGConfig; другая модель нужна, пока агенты не переиндексированы после ее смены.
+    """
+
+    _instances: Dict[str, "EmbeddingService"] = {}
+    _lock = threading.Lock()
+
+    def __new__(cls, model_name: Optional[str] = None):
+        model_name = model_name or RAGConfig.EMBEDDING_MODEL
+        if model_name not in cls._instances:
+            with cls._lock:
+                if model_name not in cls._instances:
+                    cls._instances[model_name] = super(EmbeddingService, cls).__new__(cls)
+        return cls._instances[model_name]
+
+    def __init__(self, model_name: Optional[str] = None):
+        if not hasattr(self, 'initialized'):
+            self.model_name = model_name or RAGConfig.EMBEDDING_MODEL
+            self.batch_size = RAGConfig.EMBEDDING_BATCH_SIZE
+            self.max_wait = RAGConfig.EMBEDDING_MAX_WAIT_MS / 1000
+            self.timeout = RAGConfig.EMBEDDING_TIMEOUT
+            self._model = None
+            self._encode = None
+            self._queue: "queue.Queue[tuple]" = queue.Queue()
+            self._worker: Optional[threading.Thread] = None
+            self._worker_lock = threading.Lock()
+            self.requests = 0
+            self.batches = 0
+            self.texts = 0
+            self.initialized = True
+
+    def _load_model(self):
+        """Загружает модель (sentence-transformers, при его отсутствии - встроенная модель ChromaDB)"""
+        try:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.model_name, device=RAGConfig.EMBEDDING_DEVICE)
+            self._encode = lambda texts: self._model.encode(
+                texts, batch_size=self.batch_size, convert_to_numpy=True, show_progress_bar=False
+            ).tolist()
+            logger.info(f"Загружена модель эмбеддингов {self.model_name} ({RAGConfig.EMBEDDING_DEVICE})")
+        except ImportError:
+            # Встроенная функция ChromaDB - та же all-MiniLM-L6-v2 в ONNX
+            from chromadb.utils import embedding_functions
+            self._model = embedding_functions.DefaultEmbeddingFunction()
+            self._encode = lambda texts: [list(map(float, vector)) for vector in self._model(texts)]
+            logger.warning("sentence-transformers не установлен, используем модель эмбеддингов ChromaDB")
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="embedding-worker", daemon=True)
+                self._worker.start()
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Вычисляет эмбеддинги текстов (запрос может быть объединен с запросами других потоков)"""
+        if not texts:
+            return []
+        self._ensure_worker()
+        future: Future = Future()
+        self._queue.put((list(texts), future, time.time()))
+        return future.result(timeout=self.timeout)
+
+    def embed_query(self, text: str) -> List[float]:
+        """Эмбеддинг поискового запроса"""
+        return self.embed([text])[0]
+
+    def _collect_batch(self) -> List[tuple]:
+        """Ждет первый запрос и добирает к нему запросы, пришедшие в течение max_wait"""
+        requests = [self._queue.get()]
+        size = len(requests[0][0])
+        deadline = time.time() + self.max_wait
+        while size < self.batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            requests.append(request)
+            size += len(request[0])
+        return requests
+
+    def _run(self):
+        """Цикл потока эмбеддингов: одна пачка - один проход модели"""
+        while True:
+            requests = self._collect_batch()
+            started = time.time()
+            texts = [text for request in requests for text in request[0]]
+
+            try:
+                if self._model is None:
+                    self._load_model()
+                vectors = self._encode(texts)
+            except Exception as e:
+                logger.error(f"Ошибка вычисления эмбеддингов: {e}")
+                for _, future, _ in requests:
+                    future.set_exception(e)
+                continue
+
+            EMBEDDING_BATCH_LATENCY.labels(model=self.model_name).observe(time.time() - started)
+            EMBEDDING_BATCH_SIZE.labels(model=self.model_name).observe(len(texts))
+            EMBEDDING_TEXTS.labels(model=self.model_name).inc(len(texts))
+            self.requests += len(requests)
+            self.batches += 1
+            self.texts += len(texts)
+
+            offset = 0
+            for request_texts, future, enqueued_at in requests:
+                EMBEDDING_QUEUE_WAIT.labels(model=self.model_name).observe(started - enqueued_at)
+                future.set_result(vectors[offset:offset + len(request_texts)])
+                offset += len(request_texts)
+
+    def stats(self) -> Dict[str, Any]:
+        """Возвращает статистику сервиса эмбеддингов текущего процесса"""
+        return {
+            "model": self.model_name,
+            "loaded": self._model is not None,
+            "requests": self.requests,
+            "batches": self.batches,
+            "texts": self.texts,
+            "queued": self._queue.qsize(),
+            "avg_batch_size": round(self.texts / self.batches, 2) if self.batches else 0.0
+        }
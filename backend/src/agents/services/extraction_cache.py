@@ -0,0 +1,110 @@
+import os
+import time
+import gzip
+import json
+import hashlib
+import logging
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, Optional, Set, Tuple
+
+from ..utils.file_handlers import SEGMENTS_FORMAT_VERSION
+
+logger = logging.getLogger(__name__)
+
+
+def compute_file_hash(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """sha256 содержимого файла (тот же, что считается при загрузке)"""
+    hasher = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class ExtractionCache:
+    """
+    Кэш извлеченных сегментов документов (страницы, строки, абзацы) в сжатом JSONL.
+    Ключ - хэш содержимого файла, тип файла (одни и те же байты как txt, csv и md разбираются
+    по-разному) и версия формата сегментов, поэтому переиндексация, смена параметров чанкинга
+    или модели эмбеддингов не требуют повторного разбора PDF/XLSX, а одинаковые файлы у разных
+    агентов разбираются один раз. Записи удаленных документов убирает prune.
+    """
+
+    def __init__(self, base_path: Path):
+        self.base_path = Path(base_path)
+
+    def get_path(self, content_hash: str, file_type: str) -> Path:
+        """Путь к файлу сегментов для хэша содержимого и типа файла"""
+        return self.base_path / content_hash[:2] / f"{content_hash}.{file_type}.v{SEGMENTS_FORMAT_VERSION}.jsonl.gz"
+
+    def exists(self, content_hash: str, file_type: str) -> bool:
+        return self.get_path(content_hash, file_type).exists()
+
+    def read(self, content_hash: str, file_type: str) -> Optional[Iterator[Dict[str, Any]]]:
+        """Потоково читает сохраненные сегменты (None, если их нет)"""
+        path = self.get_path(content_hash, file_type)
+        if not path.exists():
+            return None
+
+        def segments():
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    yield json.loads(line)
+
+        return segments()
+
+    def write_through(self, content_hash: str, file_type: str,
+                      segments: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """
+        Пропускает сегменты дальше (в чанкер), попутно сохраняя их.
+        Файл появляется только после полного прохода - прерванное извлечение не оставит неполный кэш.
+        """
+        path = self.get_path(content_hash, file_type)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        completed = False
+        try:
+            with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=6) as f:
+                for segment in segments:
+                    f.write(json.dumps(segment, ensure_ascii=False))
+                    f.write("\n")
+                    yield segment
+            os.replace(tmp_path, path)
+            completed = True
+            logger.info(f"Сегменты документа {content_hash[:12]} сохранены в кэш извлечения")
+        finally:
+            if not completed and tmp_path.exists():
+                os.remove(tmp_path)
+
+    def delete(self, content_hash: str, file_type: str):
+        """Удаляет сохраненные сегменты"""
+        path = self.get_path(content_hash, file_type)
+        if path.exists():
+            os.remove(path)
+
+    def prune(self, keep: Set[Tuple[str, str]], min_age: float = 3600) -> int:
+        """
+        Удаляет сегменты, которых нет в keep (пары хэш, тип файла существующих документов),
+        и файлы старых версий формата. Файлы моложе min_age секунд не трогаем: документ мог
+        быть только что загружен. Возвращает число удаленных файлов
+        """
+        if not self.base_path.exists():
+            return 0
+        suffix = f".v{SEGMENTS_FORMAT_VERSION}.jsonl.gz"
+        now = time.time()
+        removed = 0
+        for path in self.base_path.glob("*/*"):
+            try:
+                if now - path.stat().st_mtime < min_age:
+                    continue
+                if path.name.endswith(suffix):
+                    content_hash, _, file_type = path.name[:-len(suffix)].partition(".")
+                    if (content_hash, file_type) in keep:
+                        continue
+                os.remove(path)
+                removed += 1
+            except OSError as e:
+                logger.warning(f"Не удалось удалить {path} из кэша извлечения: {e}")
+        if removed:
+            logger.info(f"Кэш извлечения: удалено {removed} файлов удаленных документов")
+        return removed
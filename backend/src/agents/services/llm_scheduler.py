@@ -0,0 +1,279 @@
+import math
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager, asynccontextmanager
+from typing import Optional
+
+import redis
+from prometheus_client import Counter, Gauge, Histogram
+
+from src.core.config import settings
+from src.core.rag_config import RAGConfig
+
+logger = logging.getLogger(__name__)
+
+
+class LLMPriority:
+    """Приоритеты запросов к LLM (меньше - раньше)"""
+    ALERT = 0  # Алерты из Telegram
+    INTERACTIVE = 1  # Анализ из интерфейса и API
+    HEALTH_CHECK = 2  # Проверка подключения к Ollama
+
+    NAMES = {ALERT: "alert", INTERACTIVE: "interactive", HEALTH_CHECK: "health_check"}
+
+
+# Сколько можно ждать слот по умолчанию (секунды): запрос, который не успевает начаться, отклоняется
+DEFAULT_DEADLINES = {
+    LLMPriority.ALERT: RAGConfig.LLM_ALERT_DEADLINE,
+    LLMPriority.INTERACTIVE: RAGConfig.LLM_INTERACTIVE_DEADLINE,
+    LLMPriority.HEALTH_CHECK: RAGConfig.LLM_HEALTH_CHECK_DEADLINE,
+}
+
+LLM_QUEUE_DEPTH = Gauge(
+    "llm_scheduler_queue_depth",
+    "Requests waiting for an LLM slot across all workers",
+    ["priority"]
+)
+LLM_IN_FLIGHT = Gauge(
+    "llm_scheduler_in_flight",
+    "LLM requests currently holding a slot across all workers"
+)
+LLM_WAIT_SECONDS = Histogram(
+    "llm_scheduler_wait_seconds",
+    "Time spent waiting for an LLM slot",
+    ["priority"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+)
+LLM_SHED = Counter(
+    "llm_scheduler_shed_total",
+    "LLM requests rejected before start (estimate - expected wait exceeds the deadline, deadline - deadline passed)",
+    ["priority", "reason"]
+)
+LLM_SCHEDULER_FALLBACK = Counter(
+    "llm_scheduler_fallback_total",
+    "LLM requests started without a slot because Redis was unavailable"
+)
+
+# Атомарная попытка занять слот: чистит истекшие аренды и пропавших ожидающих, ставит запрос
+# в очередь (score = приоритет и время постановки) и выдает слот, если запрос среди первых
+# в очереди на свободные слоты. Возвращает -1 (слот получен) или позицию в очереди
+ACQUIRE_SCRIPT = """
+local holders, queue, beats = KEYS[1], KEYS[2], KEYS[3]
+local token = ARGV[1]
+local now = tonumber(ARGV[2])
+local lease = tonumber(ARGV[3])
+local limit = tonumber(ARGV[4])
+local stale = tonumber(ARGV[5])
+
+redis.call("zremrangebyscore", holders, "-inf", now)
+local dead = redis.call("zrangebyscore", beats, "-inf", now - stale)
+for _, member in ipairs(dead) do
+    redis.call("zrem", queue, member)
+    redis.call("zrem", beats, member)
+end
+
+redis.call("zadd", queue, "NX", ARGV[6], token)
+redis.call("zadd", beats, now, token)
+
+local free = limit - redis.call("zcard", holders)
+local rank = redis.call("zrank", queue, token)
+if rank < free then
+    redis.call("zrem", queue, token)
+    redis.call("zrem", beats, token)
+    redis.call("zadd", holders, now + lease, token)
+    return -1
+end
+return rank
+"""
+
+# Score очереди: приоритет в старших разрядах, время постановки (мс) в младших - FIFO внутри приоритета
+PRIORITY_SCORE_STEP = 10 ** 13
+
+
+class LLMOverloadedError(Exception):
+    """Запрос к LLM отклонен: слот не освободится до истечения срока ожидания"""
+
+
+class LLMScheduler:
+    """
+    Ограничение одновременных запросов к Ollama для всех процессов (воркеры Celery, uvicorn) через Redis.
+    Слоты - аренды с истечением в sorted set (упавший процесс не занимает слот навсегда),
+    ожидающие - очередь по приоритету и времени постановки. Запрос, который по оценке
+    (позиция в очереди и среднее время генерации) или фактически не получает слот до своего
+    срока, отклоняется с LLMOverloadedError, а не ждет в очереди Ollama до таймаута.
+    При недоступном Redis запросы выполняются без ограничения.
+    """
+
+    key_prefix = "mara:llm_scheduler"
+
+    def __init__(self, max_concurrency: int, lease_ttl: int, poll_interval: float = 0.1,
+                 stale_after: float = 10.0, executor_threads: int = 4, url: Optional[str] = None):
+        self.max_concurrency = max_concurrency
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.client = redis.Redis.from_url(url or settings.redis.url, socket_timeout=1)
+        self._acquire = self.client.register_script(ACQUIRE_SCRIPT)
+        self.holders_key = f"{self.key_prefix}:holders"
+        self.queue_key = f"{self.key_prefix}:queue"
+        self.beats_key = f"{self.key_prefix}:heartbeats"
+        # Скользящее среднее длительности генерации в процессе - для оценки ожидания
+        self.avg_duration: Optional[float] = None
+        self._stats_lock = threading.Lock()
+        # Потоки для обращений к Redis из async кода (aslot)
+        self._executor = ThreadPoolExecutor(max_workers=executor_threads, thread_name_prefix="llm-scheduler")
+
+    def _try_acquire(self, token: str, priority: int, enqueued_at: float) -> int:
+        now = time.time()
+        score = priority * PRIORITY_SCORE_STEP + int(enqueued_at * 1000)
+        return int(self._acquire(
+            keys=[self.holders_key, self.queue_key, self.beats_key],
+            args=[token, now, self.lease_ttl, self.max_concurrency, self.stale_after, score]
+        ))
+
+    def _release(self, token: str):
+        try:
+            pipe = self.client.pipeline()
+            pipe.zrem(self.holders_key, token)
+            pipe.zrem(self.queue_key, token)
+            pipe.zrem(self.beats_key, token)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Не удалось освободить слот LLM в Redis: {e}")
+
+    def _release_after(self, poll: Optional[Future], token: str):
+        if poll is not None:
+            wait([poll])
+        self._release(token)
+
+    def _update_depth(self):
+        """Обновляет метрики глубины очереди по приоритетам и числа занятых слотов"""
+        try:
+            pipe = self.client.pipeline()
+            for priority in LLMPriority.NAMES:
+                low = priority * PRIORITY_SCORE_STEP
+                pipe.zcount(self.queue_key, low, f"({low + PRIORITY_SCORE_STEP}")
+            pipe.zcard(self.holders_key)
+            *depths, in_flight = pipe.execute()
+        except Exception:
+            return
+        for priority, depth in zip(LLMPriority.NAMES, depths):
+            LLM_QUEUE_DEPTH.labels(priority=LLMPriority.NAMES[priority]).set(depth)
+        LLM_IN_FLIGHT.set(in_flight)
+
+    def _record_duration(self, duration: float):
+        with self._stats_lock:
+            if self.avg_duration is None:
+                self.avg_duration = duration
+            else:
+                self.avg_duration = 0.8 * self.avg_duration + 0.2 * duration
+
+    def _check_deadline(self, token: str, priority: int, rank: int, deadline_at: float):
+        """Отклоняет запрос, если срок истек или ожидание по оценке дольше оставшегося срока"""
+        remaining = deadline_at - time.time()
+        reason = None
+        if remaining <= 0:
+            reason = "deadline"
+        elif self.avg_duration is not None:
+            expected_wait = math.ceil((rank + 1) / self.max_concurrency) * self.avg_duration
+            if expected_wait > remaining:
+                reason = "estimate"
+        if reason is None:
+            return
+
+        self._release(token)
+        name = LLMPriority.NAMES[priority]
+        LLM_SHED.labels(priority=name, reason=reason).inc()
+        logger.warning(f"Запрос к LLM ({name}) отклонен: позиция в очереди {rank}, осталось {max(remaining, 0):.1f} с")
+        raise LLMOverloadedError(f"LLM перегружена: запрос ({name}) не может начаться за отведенное время")
+
+    def _start(self, priority: int, deadline: Optional[float]):
+        token = uuid.uuid4().hex
+        enqueued_at = time.time()
+        deadline_at = enqueued_at + (DEFAULT_DEADLINES[priority] if deadline is None else deadline)
+        return token, enqueued_at, deadline_at
+
+    def _poll(self, token: str, priority: int, enqueued_at: float, deadline_at: float) -> bool:
+        """Одна попытка занять слот. True - слот получен (или Redis недоступен и запрос идет без ограничения)"""
+        try:
+            rank = self._try_acquire(token, priority, enqueued_at)
+        except redis.RedisError as e:
+            logger.warning(f"Redis недоступен для очереди LLM, запрос выполняется без ограничения: {e}")
+            LLM_SCHEDULER_FALLBACK.inc()
+            return True
+        if rank < 0:
+            LLM_WAIT_SECONDS.labels(priority=LLMPriority.NAMES[priority]).observe(time.time() - enqueued_at)
+            return True
+        self._update_depth()
+        self._check_deadline(token, priority, rank, deadline_at)
+        return False
+
+    @contextmanager
+    def slot(self, priority: int = LLMPriority.INTERACTIVE, deadline: Optional[float] = None):
+        """Занимает слот на время запроса к LLM (синхронный код: Celery, проверка подключения)"""
+        token, enqueued_at, deadline_at = self._start(priority, deadline)
+        try:
+            while not self._poll(token, priority, enqueued_at, deadline_at):
+                time.sleep(self.poll_interval)
+        except BaseException:
+            # Например, мягкий лимит времени задачи Celery, пока запрос ждал в очереди
+            self._release(token)
+            raise
+
+        started_at = time.time()
+        try:
+            yield
+        finally:
+            self._record_duration(time.time() - started_at)
+            self._release(token)
+
+    @asynccontextmanager
+    async def aslot(self, priority: int = LLMPriority.INTERACTIVE, deadline: Optional[float] = None):
+        """
+        Асинхронная версия slot: ожидание слота не блокирует event loop.
+        Клиент Redis синхронный, поэтому обращения к нему выполняются в потоке
+        """
+        token, enqueued_at, deadline_at = self._start(priority, deadline)
+        poll = None
+        try:
+            while True:
+                poll = self._executor.submit(self._poll, token, priority, enqueued_at, deadline_at)
+                if await asyncio.wrap_future(poll):
+                    break
+                await asyncio.sleep(self.poll_interval)
+        except BaseException:
+            # Например, клиент отключился, пока запрос ждал в очереди. Попытка занять слот
+            # могла еще выполняться в потоке и получить слот - освобождаем после нее
+            self._executor.submit(self._release_after, poll, token)
+            raise
+
+        started_at = time.time()
+        try:
+            yield
+        finally:
+            self._record_duration(time.time() - started_at)
+            # Освобождение выполнится и при отмене корутины: задача уже передана потоку
+            await asyncio.wrap_future(self._executor.submit(self._release, token))
+
+
+_scheduler: Optional[LLMScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_llm_scheduler() -> Optional[LLMScheduler]:
+    """Общий для процесса планировщик запросов к LLM (None, если ограничение выключено)"""
+    global _scheduler
+    if RAGConfig.LLM_MAX_CONCURRENCY <= 0:
+        return None
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = LLMScheduler(
+                    max_concurrency=RAGConfig.LLM_MAX_CONCURRENCY,
+                    lease_ttl=RAGConfig.LLM_SLOT_LEASE_TTL
+                )
+    return _scheduler
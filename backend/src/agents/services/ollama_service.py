@@ -1,18 +1,110 @@
+import re
+import json
 import logging
 import os
-from typing import List, Dict, Any, Optional
+import asyncio
+import weakref
+from typing import List, Dict, Any, Optional, AsyncIterator
+import httpx
+from contextlib import nullcontext
 from langchain_ollama import OllamaLLM
 from langchain.prompts import PromptTemplate
 from langchain.schema import HumanMessage, SystemMessage
 
+from .llm_scheduler import LLMPriority, LLMOverloadedError, get_llm_scheduler
+
 logger = logging.getLogger(__name__)
 
+# Служебные префиксы ответа модели ("Ответ:", "Найден алерт ...:"), которые отрезаются от начала ответа
+RESPONSE_PREFIX_PATTERNS = [
+    re.compile(r'^(Ответ|Response|Результат|По документаци|Найден алерт):\s*', re.IGNORECASE),
+    # Типичные фразы-повторения
+    re.compile(r'^.*?найден алерт.*?:\s*', re.IGNORECASE),
+    re.compile(r'^.*?соответствует.*?:\s*', re.IGNORECASE),
+    re.compile(r'^.*?правильный ответ.*?:\s*', re.IGNORECASE),
+    re.compile(r'^.*?окончательный ответ.*?:\s*', re.IGNORECASE),
+]
+
+
+def strip_response_prefixes(response: str) -> str:
+    """Отрезает служебные префиксы от начала ответа модели"""
+    for pattern in RESPONSE_PREFIX_PATTERNS:
+        response = pattern.sub('', response)
+    return response
+
+
+class ResponseStreamCleaner:
+    """
+    Применяет правила _clean_response к потоку токенов, насколько это возможно без полного ответа:
+    схлопывает пробелы и отрезает служебные префиксы, придерживая начало ответа (HEAD_SIZE символов).
+    Проверки всего ответа (повторы, слишком короткий ответ) выполняются в конце по полному тексту.
+    """
+    
+    HEAD_SIZE = 80
+    
+    def __init__(self):
+        self.raw_parts: List[str] = []
+        self._head = ""
+        self._head_released = False
+        self._last_is_space = True  # Пробелы в начале ответа отбрасываются
+    
+    @property
+    def raw_text(self) -> str:
+        return "".join(self.raw_parts)
+    
+    def feed(self, token: str) -> str:
+        """Принимает очередной токен и возвращает текст, который уже можно отдать клиенту"""
+        self.raw_parts.append(token)
+        text = self._collapse_spaces(token)
+        if self._head_released:
+            return text
+        self._head += text
+        if len(self._head) < self.HEAD_SIZE:
+            return ""
+        return self._release_head()
+    
+    def finish(self) -> str:
+        """Возвращает придержанный остаток (для коротких ответов)"""
+        return "" if self._head_released else self._release_head()
+    
+    def _release_head(self) -> str:
+        self._head_released = True
+        return strip_response_prefixes(self._head)
+    
+    def _collapse_spaces(self, token: str) -> str:
+        parts = []
+        for char in token:
+            if char.isspace():
+                if not self._last_is_space:
+                    parts.append(" ")
+                self._last_is_space = True
+            else:
+                parts.append(char)
+                self._last_is_space = False
+        return "".join(parts)
+
 
 class OllamaService:
     """Сервис для работы с Ollama моделью"""
     
+    # Асинхронные HTTP клиенты по event loop: соединения клиента привязаны к своему циклу
+    # (у uvicorn цикл один на процесс, задачи Celery создают новый цикл на каждый запуск)
+    _async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+    
+    # Параметры генерации (общие для синхронного и асинхронного вызова)
+    TEMPERATURE = 0.05  # Очень низкая температура для максимально точных ответов
+    TOP_P = 0.9  # Ограничиваем выбор токенов
+    TOP_K = 40  # Ограничиваем количество кандидатов
+    REPEAT_PENALTY = 1.1  # Штраф за повторения
+    
+    # Ответы-заглушки при пустом ответе модели и при ошибке (не кэшируются)
+    EMPTY_RESPONSE = "Извините, не удалось сгенерировать ответ. Попробуйте переформулировать вопрос."
+    ERROR_RESPONSE_PREFIX = "Произошла ошибка"
+    
     def __init__(self, model_name: str = "llama3.2:3b", base_url: str = None):
         self.model_name = model_name
+        self.timeout = float(os.getenv("OLLAMA_TIMEOUT", "60"))
+        self.max_connections = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "32"))
         
         # Используем переменные окружения или значения по умолчанию
         if base_url is None:
@@ -32,11 +124,11 @@ class OllamaService:
             self.llm = OllamaLLM(
                 model=self.model_name,
                 base_url=self.base_url,
-                temperature=0.05,  # Очень низкая температура для максимально точных ответов
-                timeout=60,  # Таймаут 1 минута
-                top_p=0.9,  # Ограничиваем выбор токенов
-                top_k=40,   # Ограничиваем количество кандидатов
-                repeat_penalty=1.1  # Штраф за повторения
+                temperature=self.TEMPERATURE,
+                timeout=self.timeout,
+                top_p=self.TOP_P,
+                top_k=self.TOP_K,
+                repeat_penalty=self.REPEAT_PENALTY
             )
             logger.info(f"Модель Ollama {self.model_name} инициализирована по адресу {self.base_url}")
         except Exception as e:
@@ -44,8 +136,12 @@ class OllamaService:
             self.llm = None
             raise
     
-    def generate_response(self, prompt: str, context: str = "", user_text: str = "") -> str:
-        """Генерирует ответ на основе промпта, контекста и пользовательского текста"""
+    def generate_response(self, prompt: str, context: str = "", user_text: str = "",
+                          priority: int = LLMPriority.INTERACTIVE) -> str:
+        """
+        Генерирует ответ на основе промпта, контекста и пользовательского текста.
+        Запрос ждет свободный слот Ollama в очереди с приоритетом priority
+        """
         try:
             if not self.llm:
                 self._initialize_model()
@@ -65,12 +161,13 @@ class OllamaService:
             logger.info(f"Full prompt preview: {full_prompt[:1000]}...")
             
             # Генерируем ответ
-            response = self.llm.invoke(full_prompt)
+            with self._slot(priority):
+                response = self.llm.invoke(full_prompt)
             
             # Валидация и обработка ответа
             if not response or not response.strip():
                 logger.warning("Получен пустой ответ от модели")
-                return "Извините, не удалось сгенерировать ответ. Попробуйте переформулировать вопрос."
+                return self.EMPTY_RESPONSE
             
             # Очищаем и форматируем ответ
             cleaned_response = self._clean_response(response.strip())
@@ -83,6 +180,151 @@ class OllamaService:
             # Возвращаем информативное сообщение об ошибке вместо исключения
             return f"Произошла ошибка при обработке запроса: {str(e)}"
     
+    async def agenerate_response(self, prompt: str, context: str = "", user_text: str = "",
+                                 priority: int = LLMPriority.INTERACTIVE) -> str:
+        """
+        Асинхронная версия generate_response: запрос к HTTP API Ollama через общий пул соединений,
+        event loop не блокируется на время генерации.
+        """
+        try:
+            if not prompt or not prompt.strip():
+                raise ValueError("Промпт не может быть пустым")
+            
+            if not context or not context.strip():
+                logger.warning("Контекст документации пустой")
+                return "Алерт не найден в документации"
+            
+            full_prompt = self._build_prompt(prompt, context, user_text)
+            logger.info(f"Full prompt length: {len(full_prompt)} characters")
+            
+            async with self._aslot(priority):
+                response = await self._agenerate(full_prompt)
+            
+            if not response or not response.strip():
+                logger.warning("Получен пустой ответ от модели")
+                return self.EMPTY_RESPONSE
+            
+            cleaned_response = self._clean_response(response.strip())
+            
+            logger.info(f"Сгенерирован ответ для модели {self.model_name}: {cleaned_response[:100]}...")
+            return cleaned_response
+            
+        except Exception as e:
+            logger.error(f"Ошибка при генерации ответа: {e}")
+            return f"Произошла ошибка при обработке запроса: {str(e)}"
+    
+    async def astream_response(self, prompt: str, context: str = "", user_text: str = "",
+                               priority: int = LLMPriority.INTERACTIVE) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Потоковая генерация: отдает события {"event": "token", "text": ...} по мере генерации
+        и в конце {"event": "done", "response": ...} с ответом, очищенным по всем правилам _clean_response
+        (клиент заменяет им накопленный текст, если они отличаются).
+        """
+        if not prompt or not prompt.strip():
+            yield {"event": "error", "error_message": "Промпт не может быть пустым"}
+            return
+        
+        if not context or not context.strip():
+            logger.warning("Контекст документации пустой")
+            yield {"event": "token", "text": "Алерт не найден в документации"}
+            yield {"event": "done", "response": "Алерт не найден в документации"}
+            return
+        
+        full_prompt = self._build_prompt(prompt, context, user_text)
+        cleaner = ResponseStreamCleaner()
+        try:
+            async with self._aslot(priority), self._get_async_client().stream(
+                "POST", "/api/generate", json=self._get_generate_payload(full_prompt, stream=True)
+            ) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    text = cleaner.feed(chunk.get("response", ""))
+                    if text:
+                        yield {"event": "token", "text": text}
+                    if chunk.get("done"):
+                        break
+            
+            tail = cleaner.finish()
+            if tail:
+                yield {"event": "token", "text": tail}
+        except Exception as e:
+            logger.error(f"Ошибка при потоковой генерации ответа: {e}")
+            yield {"event": "error", "error_message": f"Произошла ошибка при обработке запроса: {str(e)}"}
+            return
+        
+        raw_response = cleaner.raw_text.strip()
+        if not raw_response:
+            logger.warning("Получен пустой ответ от модели")
+            final_response = self.EMPTY_RESPONSE
+        else:
+            final_response = self._clean_response(raw_response)
+        
+        logger.info(f"Сгенерирован потоковый ответ для модели {self.model_name}: {final_response[:100]}...")
+        yield {"event": "done", "response": final_response}
+    
+    @staticmethod
+    def _slot(priority: int):
+        """Слот Ollama для синхронного запроса (без ограничения, если планировщик выключен)"""
+        scheduler = get_llm_scheduler()
+        return scheduler.slot(priority) if scheduler is not None else nullcontext()
+    
+    @staticmethod
+    def _aslot(priority: int):
+        """Слот Ollama для асинхронного запроса"""
+        scheduler = get_llm_scheduler()
+        return scheduler.aslot(priority) if scheduler is not None else nullcontext()
+    
+    @classmethod
+    def is_failed_response(cls, response: Optional[str]) -> bool:
+        """Ответ - заглушка вместо результата генерации (ошибка или пустой ответ модели)"""
+        return not response or response == cls.EMPTY_RESPONSE or response.startswith(cls.ERROR_RESPONSE_PREFIX)
+    
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """Общий HTTP клиент Ollama для текущего event loop (keep-alive соединения переиспользуются)"""
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.timeout, connect=5.0),
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections)
+            )
+            self._async_clients[loop] = client
+        return client
+    
+    def _get_generate_payload(self, full_prompt: str, stream: bool) -> Dict[str, Any]:
+        """Тело запроса /api/generate с параметрами генерации"""
+        return {
+            "model": self.model_name,
+            "prompt": full_prompt,
+            "stream": stream,
+            "options": {
+                "temperature": self.TEMPERATURE,
+                "top_p": self.TOP_P,
+                "top_k": self.TOP_K,
+                "repeat_penalty": self.REPEAT_PENALTY
+            }
+        }
+    
+    async def _agenerate(self, full_prompt: str) -> str:
+        """Генерирует ответ через HTTP API Ollama"""
+        response = await self._get_async_client().post(
+            "/api/generate", json=self._get_generate_payload(full_prompt, stream=False)
+        )
+        response.raise_for_status()
+        return response.json().get("response", "")
+    
+    @classmethod
+    async def aclose(cls):
+        """Закрывает HTTP клиент текущего event loop (при остановке приложения)"""
+        client = cls._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+    
     def _build_prompt(self, prompt: str, context: str = "", user_text: str = "") -> str:
         """Строит полный промпт для модели"""
         # Извлекаем ключевые слова из алерта
@@ -162,14 +404,8 @@ class OllamaService:
         # Убираем повторяющиеся фразы
         response = re.sub(r'(.+?)\1+', r'\1', response)
         
-        # Если ответ начинается с "Ответ:" или подобного, убираем это
-        response = re.sub(r'^(Ответ|Response|Результат|По документаци|Найден алерт):\s*', '', response, flags=re.IGNORECASE)
-        
-        # Убираем типичные фразы-повторения
-        response = re.sub(r'^.*?найден алерт.*?:\s*', '', response, flags=re.IGNORECASE)
-        response = re.sub(r'^.*?соответствует.*?:\s*', '', response, flags=re.IGNORECASE)
-        response = re.sub(r'^.*?правильный ответ.*?:\s*', '', response, flags=re.IGNORECASE)
-        response = re.sub(r'^.*?окончательный ответ.*?:\s*', '', response, flags=re.IGNORECASE)
+        # Если ответ начинается с "Ответ:" или подобного, убираем это (и типичные фразы-повторения)
+        response = strip_response_prefixes(response)
         
         # Если ответ содержит только повторение входного текста, возвращаем fallback
         if len(response) < 10 or response.lower() in ['да', 'нет', 'ok', 'хорошо']:
@@ -240,10 +476,19 @@ class OllamaService:
             if not self.llm:
                 self._initialize_model()
             
-            # Простой тест
-            test_response = self.llm.invoke("Ответь 'OK' если ты работаешь")
+            # Простой тест (с низшим приоритетом: при нагрузке проверка отклоняется, а не ждет алерты)
+            with self._slot(LLMPriority.HEALTH_CHECK):
+                test_response = self.llm.invoke("Ответь 'OK' если ты работаешь")
             return "OK" in test_response.upper()
             
+        except LLMOverloadedError:
+            # Все слоты заняты генерацией - проверяем доступность без генерации
+            logger.info("Ollama занята, проверяем подключение по списку моделей")
+            try:
+                return httpx.get(f"{self.base_url}/api/tags", timeout=5.0).status_code == 200
+            except Exception as e:
+                logger.error(f"Ошибка при тестировании подключения к Ollama: {e}")
+                return False
         except Exception as e:
             logger.error(f"Ошибка при тестировании подключения к Ollama: {e}")
             return False
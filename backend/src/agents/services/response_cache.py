@@ -0,0 +1,142 @@
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from prometheus_client import Counter
+
+from src.core.rag_config import RAGConfig
+from .ollama_service import OllamaService
+from .search_cache import SearchCache, MemorySearchCache, RedisSearchCache
+from .single_flight import normalize_alert_text
+
+logger = logging.getLogger(__name__)
+
+
+RESPONSE_CACHE_EVENTS = Counter(
+    "llm_response_cache_events_total",
+    "LLM response cache events (hit, miss, eviction, expiration)",
+    ["backend", "event"]
+)
+
+RESPONSE_CACHE_SAVED_SECONDS = Counter(
+    "llm_response_cache_saved_seconds_total",
+    "LLM generation time saved by response cache hits (generation time of the cached response)"
+)
+
+
+class MemoryResponseCache(MemorySearchCache):
+    events_metric = RESPONSE_CACHE_EVENTS
+
+
+class RedisResponseCache(RedisSearchCache):
+    events_metric = RESPONSE_CACHE_EVENTS
+    key_prefix = "mara:llm_response"
+
+
+class ResponseCache:
+    """
+    Кэш ответов LLM на повторяющиеся алерты. При низкой температуре ответ определяется промптом агента,
+    найденными чанками и самим алертом, поэтому ключ - хэш (модель, промпт агента, id и хэши содержимого
+    чанков, нормализованный текст алерта). Измененный документ или промпт дают другой ключ, а записи агента
+    дополнительно удаляются явно при изменении документов и промпта (invalidate_agent).
+    Ключи начинаются с agent_id и user_id, чтобы записи агента удалялись по префиксу.
+    """
+
+    def __init__(self, cache: SearchCache):
+        self.cache = cache
+
+    @staticmethod
+    def get_alert_identity(text: str) -> str:
+        """
+        Нормализованный текст алерта целиком: алерты с одним кодом, но разными подробностями
+        (хост, значения метрик) - разные инциденты, и ответ, цитирующий один, не подходит другому
+        """
+        return normalize_alert_text(text)
+
+    @staticmethod
+    def _get_chunk_identity(doc: Dict[str, Any]) -> str:
+        metadata = doc.get("metadata") or {}
+        chunk_hash = metadata.get("chunk_hash") or hashlib.sha256(doc.get("text", "").encode("utf-8")).hexdigest()
+        return f"{metadata.get('document_id')}:{metadata.get('chunk_index')}:{chunk_hash}"
+
+    @staticmethod
+    def _get_agent_prefix(agent_id: int, user_id: Optional[int] = None) -> str:
+        return f"{agent_id}:" if user_id is None else f"{agent_id}:{user_id}:"
+
+    def build_key(self, agent_id: int, user_id: int, model_name: str, prompt: str,
+                  context_docs: List[Dict[str, Any]], alert_text: str) -> Optional[str]:
+        """Ключ ответа (None - кэшировать нечего: без найденных документов LLM не вызывается)"""
+        if not context_docs:
+            return None
+        parts = [
+            model_name,
+            prompt,
+            *[self._get_chunk_identity(doc) for doc in context_docs],
+            self.get_alert_identity(alert_text)
+        ]
+        digest = hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+        return f"{self._get_agent_prefix(agent_id, user_id)}{digest}"
+
+    def get(self, key: Optional[str]) -> Optional[str]:
+        """Возвращает сохраненный ответ (время его генерации учитывается как сэкономленное)"""
+        if key is None:
+            return None
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        RESPONSE_CACHE_SAVED_SECONDS.inc(entry.get("generation_time", 0.0))
+        return entry["response"]
+
+    def set(self, key: Optional[str], response: str, generation_time: float):
+        """Сохраняет ответ модели (ошибки и пустые ответы не сохраняются)"""
+        if key is None or OllamaService.is_failed_response(response):
+            return
+        self.cache.set(key, {"response": response, "generation_time": round(generation_time, 3)})
+
+    def invalidate_agent(self, agent_id: int, user_id: Optional[int] = None) -> int:
+        """Удаляет ответы агента (всех пользователей или одного): изменились документы или промпт"""
+        deleted = self.cache.delete_prefix(self._get_agent_prefix(agent_id, user_id))
+        if deleted:
+            logger.info(f"Удалено {deleted} кэшированных ответов агента {agent_id}")
+        return deleted
+
+    def stats(self) -> Dict[str, Any]:
+        return self.cache.stats()
+
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def create_response_cache() -> SearchCache:
+    """Создает хранилище ответов согласно RAGConfig (redis с откатом на memory)"""
+    if RAGConfig.RESPONSE_CACHE_BACKEND == "redis":
+        try:
+            cache = RedisResponseCache(
+                ttl=RAGConfig.RESPONSE_CACHE_TTL,
+                max_entry_bytes=RAGConfig.SEARCH_CACHE_MAX_ENTRY_BYTES
+            )
+            cache.client.ping()
+            logger.info("Кэш ответов LLM: Redis")
+            return cache
+        except Exception as e:
+            logger.warning(f"Redis недоступен для кэша ответов LLM, используем память процесса: {e}")
+
+    return MemoryResponseCache(
+        ttl=RAGConfig.RESPONSE_CACHE_TTL,
+        max_entries=RAGConfig.RESPONSE_CACHE_MAX_ENTRIES,
+        max_bytes=RAGConfig.RESPONSE_CACHE_MAX_BYTES
+    )
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Общий для процесса кэш ответов LLM (None, если выключен)"""
+    global _response_cache
+    if not RAGConfig.RESPONSE_CACHE_ENABLED:
+        return None
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache(create_response_cache())
+    return _response_cache
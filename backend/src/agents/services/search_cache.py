@@ -0,0 +1,250 @@
+import json
+import time
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from prometheus_client import Counter
+
+from src.core.config import settings
+from src.core.rag_config import RAGConfig
+
+logger = logging.getLogger(__name__)
+
+
+SEARCH_CACHE_EVENTS = Counter(
+    "rag_search_cache_events_total",
+    "Search cache events (hit, miss, eviction, expiration)",
+    ["backend", "event"]
+)
+
+
+class SearchCache(ABC):
+    """Базовый класс кэша результатов поиска в векторной БД"""
+
+    backend_name = "base"
+    events_metric = SEARCH_CACHE_EVENTS
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _record(self, event: str, count: int = 1):
+        if event == "hit":
+            self.hits += count
+        elif event == "miss":
+            self.misses += count
+        elif event in ("eviction", "expiration"):
+            self.evictions += count
+        self.events_metric.labels(backend=self.backend_name, event=event).inc(count)
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        """Получает значение из кэша"""
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: Any):
+        """Сохраняет значение в кэш"""
+        pass
+
+    @abstractmethod
+    def clear(self):
+        """Очищает кэш полностью"""
+        pass
+
+    @abstractmethod
+    def delete_prefix(self, prefix: str) -> int:
+        """Удаляет записи, ключи которых начинаются с prefix. Возвращает число удаленных записей"""
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        """Возвращает статистику кэша"""
+        total = self.hits + self.misses
+        return {
+            "backend": self.backend_name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+class MemorySearchCache(SearchCache):
+    """In-process кэш с вытеснением LRU, TTL и ограничением по объему в байтах"""
+
+    backend_name = "memory"
+
+    def __init__(self, ttl: int, max_entries: int, max_bytes: int):
+        super().__init__()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (value, expires_at, size)
+        self._bytes = 0
+        self._last_sweep = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._record("miss")
+                return None
+
+            value, expires_at, _ = entry
+            if time.time() >= expires_at:
+                self._remove(key)
+                self._record("expiration")
+                self._record("miss")
+                return None
+
+            self._entries.move_to_end(key)
+            self._record("hit")
+            return value
+
+    def set(self, key: str, value: Any):
+        size = len(json.dumps(value, ensure_ascii=False, default=str).encode("utf-8"))
+        if size > self.max_bytes:
+            logger.debug(f"Результат поиска ({size} байт) превышает бюджет кэша и не сохраняется")
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (value, time.time() + self.ttl, size)
+            self._bytes += size
+            self._evict()
+
+    def _evict(self):
+        """Удаляет просроченные, затем наименее используемые записи до попадания в лимиты"""
+        now = time.time()
+        # Полный проход по просроченным записям делаем не чаще раза в 1/10 TTL
+        if now - self._last_sweep >= self.ttl / 10:
+            self._last_sweep = now
+            expired = [key for key, entry in self._entries.items() if entry[1] <= now]
+            for key in expired:
+                self._remove(key)
+            if expired:
+                self._record("expiration", len(expired))
+
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            key = next(iter(self._entries))
+            self._remove(key)
+            self._record("eviction")
+
+    def _remove(self, key: str):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def delete_prefix(self, prefix: str) -> int:
+        with self._lock:
+            keys = [key for key in self._entries if key.startswith(prefix)]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats.update({
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl
+        })
+        return stats
+
+
+class RedisSearchCache(SearchCache):
+    """
+    Общий для всех процессов кэш в Redis (том же, что использует Celery).
+    TTL задается через SETEX, объем ограничивается политикой maxmemory Redis
+    и максимальным размером одной записи.
+    """
+
+    backend_name = "redis"
+    key_prefix = "mara:rag_search"
+
+    def __init__(self, ttl: int, max_entry_bytes: int, url: Optional[str] = None):
+        super().__init__()
+        import redis
+
+        self.ttl = ttl
+        self.max_entry_bytes = max_entry_bytes
+        self.client = redis.Redis.from_url(url or settings.redis.url, socket_timeout=1)
+
+    def _key(self, key: str) -> str:
+        return f"{self.key_prefix}:{key}"
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            raw = self.client.get(self._key(key))
+        except Exception as e:
+            logger.warning(f"Кэш поиска в Redis недоступен: {e}")
+            self._record("miss")
+            return None
+
+        if raw is None:
+            self._record("miss")
+            return None
+
+        self._record("hit")
+        return json.loads(raw)
+
+    def set(self, key: str, value: Any):
+        raw = json.dumps(value, ensure_ascii=False, default=str)
+        if len(raw.encode("utf-8")) > self.max_entry_bytes:
+            logger.debug("Результат поиска превышает максимальный размер записи кэша и не сохраняется")
+            return
+
+        try:
+            self.client.setex(self._key(key), self.ttl, raw)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить результат поиска в Redis: {e}")
+
+    def clear(self):
+        try:
+            for key in self.client.scan_iter(match=f"{self.key_prefix}:*", count=500):
+                self.client.delete(key)
+        except Exception as e:
+            logger.warning(f"Не удалось очистить кэш поиска в Redis: {e}")
+
+    def delete_prefix(self, prefix: str) -> int:
+        deleted = 0
+        try:
+            for key in self.client.scan_iter(match=f"{self._key(prefix)}*", count=500):
+                deleted += self.client.delete(key)
+        except Exception as e:
+            logger.warning(f"Не удалось удалить записи кэша в Redis: {e}")
+        return deleted
+
+
+def create_search_cache() -> SearchCache:
+    """Создает кэш поиска согласно RAGConfig (redis с откатом на memory)"""
+    if RAGConfig.SEARCH_CACHE_BACKEND == "redis":
+        try:
+            cache = RedisSearchCache(
+                ttl=RAGConfig.SEARCH_CACHE_TTL,
+                max_entry_bytes=RAGConfig.SEARCH_CACHE_MAX_ENTRY_BYTES
+            )
+            cache.client.ping()
+            logger.info("Кэш поиска: Redis")
+            return cache
+        except Exception as e:
+            logger.warning(f"Redis недоступен для кэша поиска, используем память процесса: {e}")
+
+    return MemorySearchCache(
+        ttl=RAGConfig.SEARCH_CACHE_TTL,
+        max_entries=RAGConfig.SEARCH_CACHE_MAX_ENTRIES,
+        max_bytes=RAGConfig.SEARCH_CACHE_MAX_BYTES
+    )
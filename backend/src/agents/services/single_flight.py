@@ -0,0 +1,156 @@
+import re
+import json
+import time
+import uuid
+import hashlib
+import logging
+from typing import Any, Callable, Optional
+
+from prometheus_client import Counter
+
+from src.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+SINGLE_FLIGHT_EVENTS = Counter(
+    "llm_single_flight_events_total",
+    "Single-flight events for identical concurrent analyses (leader, follower, fallback, timeout)",
+    ["name", "event"]
+)
+
+# Освобождение блокировки только своим владельцем (блокировка могла истечь и достаться другому)
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+def normalize_alert_text(text: str) -> str:
+    """Нормализует текст алерта для сравнения: регистр и пробельные символы не важны"""
+    return re.sub(r'\s+', ' ', text or "").strip().lower()
+
+
+def build_flight_key(*parts: Any) -> str:
+    """Ключ single-flight из частей (agent_id, нормализованный текст, поколение коллекции и т.п.)"""
+    raw = "\x1f".join(str(part) for part in parts)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def build_alert_flight_key(user_id: int, agent_id: int, alert_text: str, collection_version: int) -> str:
+    """
+    Ключ анализа алерта: агент может быть общим для нескольких пользователей, а ответ строится
+    по коллекции и промпту конкретного пользователя - запросы разных пользователей не объединяются
+    """
+    return build_flight_key(user_id, agent_id, normalize_alert_text(alert_text), collection_version)
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых одновременных вычислений между процессами (воркерами Celery) через Redis.
+    Первый вызов с ключом (лидер) берет блокировку SET NX и выполняет функцию, результат на короткое
+    время сохраняется в Redis; остальные вызовы с тем же ключом ждут этот результат вместо повторного
+    вычисления. Если лидер упал или не успел за wait_timeout - вызов выполняет функцию сам.
+    При недоступном Redis функция просто выполняется (без объединения).
+    """
+
+    key_prefix = "mara:single_flight"
+
+    def __init__(self, name: str, lock_ttl: int, wait_timeout: float, result_ttl: int,
+                 poll_interval: float = 0.2, url: Optional[str] = None):
+        import redis
+
+        self.name = name
+        self.lock_ttl = lock_ttl
+        self.wait_timeout = wait_timeout
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self.client = redis.Redis.from_url(url or settings.redis.url, socket_timeout=2)
+        self._release_lock = self.client.register_script(RELEASE_LOCK_SCRIPT)
+
+    def _lock_key(self, key: str) -> str:
+        return f"{self.key_prefix}:{self.name}:{key}:lock"
+
+    def _result_key(self, key: str) -> str:
+        return f"{self.key_prefix}:{self.name}:{key}:result"
+
+    def _record(self, event: str):
+        SINGLE_FLIGHT_EVENTS.labels(name=self.name, event=event).inc()
+
+    def run(self, key: str, func: Callable[[], Any]) -> Any:
+        """
+        Выполняет func (результат должен сериализоваться в JSON) или дожидается результата
+        такого же вызова в другом процессе
+        """
+        lock_key = self._lock_key(key)
+        result_key = self._result_key(key)
+        token = uuid.uuid4().hex
+
+        try:
+            raw = self.client.get(result_key)
+            if raw is not None:
+                self._record("follower")
+                return json.loads(raw)
+            acquired = self.client.set(lock_key, token, nx=True, ex=self.lock_ttl)
+        except Exception as e:
+            logger.warning(f"Redis недоступен для объединения запросов {self.name}: {e}")
+            self._record("fallback")
+            return func()
+
+        if acquired:
+            return self._run_leader(key, token, func)
+
+        result = self._wait_for_result(key)
+        if result is not None:
+            return result
+        return func()
+
+    def _run_leader(self, key: str, token: str, func: Callable[[], Any]) -> Any:
+        self._record("leader")
+        try:
+            result = func()
+            try:
+                self.client.setex(self._result_key(key), self.result_ttl, json.dumps(result, ensure_ascii=False))
+            except Exception as e:
+                logger.warning(f"Не удалось сохранить результат {self.name} в Redis: {e}")
+            return result
+        finally:
+            try:
+                self._release_lock(keys=[self._lock_key(key)], args=[token])
+            except Exception as e:
+                logger.warning(f"Не удалось освободить блокировку {self.name} в Redis: {e}")
+
+    def _wait_for_result(self, key: str) -> Optional[Any]:
+        """Ждет результат лидера; None - лидер завершился без результата, истекло время или Redis недоступен"""
+        lock_key = self._lock_key(key)
+        result_key = self._result_key(key)
+        deadline = time.monotonic() + self.wait_timeout
+        logger.info(f"Такой же запрос {self.name} уже выполняется, ожидаем его результат")
+
+        try:
+            while time.monotonic() < deadline:
+                raw = self.client.get(result_key)
+                if raw is not None:
+                    self._record("follower")
+                    return json.loads(raw)
+                if not self.client.exists(lock_key):
+                    # Лидер освободил блокировку без результата (ошибка) - результат мог появиться
+                    # между двумя запросами, проверяем последний раз
+                    raw = self.client.get(result_key)
+                    if raw is not None:
+                        self._record("follower")
+                        return json.loads(raw)
+                    logger.warning(f"Запрос {self.name} завершился без результата, выполняем сами")
+                    self._record("fallback")
+                    return None
+                time.sleep(self.poll_interval)
+        except Exception as e:
+            logger.warning(f"Redis недоступен при ожидании результата {self.name}: {e}")
+            self._record("fallback")
+            return None
+
+        logger.warning(f"Не дождались результата {self.name} за {self.wait_timeout} с, выполняем сами")
+        self._record("timeout")
+        return None
@@ -1,11 +1,23 @@
 import os
+import fcntl
+import asyncio
 import logging
 from typing import List, Dict, Any, Optional
 from pathlib import Path
 import threading
 import hashlib
-import time
-from functools import lru_cache
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from src.core.rag_config import RAGConfig
+from ..utils.chunker import TextChunker, make_chunk_id, LOCATION_FIELDS
+from .alert_index import AlertIndex
+from .search_cache import create_search_cache
+from .collection_version import CollectionVersionStore
+from .chroma_pool import ChromaClientPool
+from .embedding_service import EmbeddingService
+from .embedding_cache import EmbeddingCache
 
 logger = logging.getLogger(__name__)
 
@@ -15,9 +27,6 @@ class VectorStore:
     
     _instance = None
     _lock = threading.Lock()
-    _clients = {}  # Кэш клиентов по путям
-    _search_cache = {}  # Кэш результатов поиска
-    _cache_ttl = 300  # TTL кэша в секундах (5 минут)
     
     def __new__(cls, base_path: str = "docs"):
         if cls._instance is None:
@@ -30,98 +39,237 @@ class VectorStore:
         if not hasattr(self, 'initialized'):
             self.base_path = Path(base_path)
             self.base_path.mkdir(exist_ok=True)
+            self.chunker = TextChunker()
+            self.search_cache = create_search_cache()
+            self.versions = CollectionVersionStore(self.base_path)
+            # Активное поколение индекса агента: переиндексация строит коллекцию следующего поколения
+            # и переключает поиск на нее, увеличив это значение
+            self.generations = CollectionVersionStore(self.base_path, filename="index_generation")
+            self.embedder = EmbeddingService()
+            self.embedding_cache = None
+            if RAGConfig.EMBEDDING_CACHE_ENABLED:
+                self.embedding_cache = EmbeddingCache(
+                    self.base_path / "embedding_cache.sqlite3",
+                    model_name=RAGConfig.EMBEDDING_MODEL,
+                    max_entries=RAGConfig.EMBEDDING_CACHE_MAX_ENTRIES,
+                    prune_interval=RAGConfig.EMBEDDING_CACHE_PRUNE_INTERVAL
+                )
+            self.pool = ChromaClientPool(
+                max_clients=RAGConfig.CHROMA_MAX_CLIENTS,
+                idle_ttl=RAGConfig.CHROMA_CLIENT_IDLE_TTL
+            )
+            # Пул потоков для вызова поиска из async кода: число одновременных запросов к ChromaDB ограничено
+            self.executor = ThreadPoolExecutor(max_workers=RAGConfig.SEARCH_THREADS, thread_name_prefix="vector-search")
             self.initialized = True
         
     def get_agent_vector_path(self, user_id: int, agent_id: int) -> Path:
         """Получает путь к векторной БД для конкретного агента"""
         return self.base_path / str(user_id) / str(agent_id) / "vector_store"
     
-    def _get_client(self, vector_path: Path):
-        """Получает или создает клиент ChromaDB для конкретного пути"""
-        path_str = str(vector_path)
-        
-        if path_str not in self._clients:
-            try:
-                import chromadb
-                client = chromadb.PersistentClient(path=path_str)
-                self._clients[path_str] = client
-                logger.info(f"Создан новый клиент ChromaDB для пути: {path_str}")
-            except Exception as e:
-                logger.error(f"Ошибка при создании клиента ChromaDB: {e}")
-                raise
-        
-        return self._clients[path_str]
+    def get_agent_index_path(self, user_id: int, agent_id: int) -> Path:
+        """Получает путь к индексу алертов агента"""
+        return self.base_path / str(user_id) / str(agent_id) / "alert_index.json"
     
-    def _get_collection(self, user_id: int, agent_id: int):
-        """Получает коллекцию для агента"""
-        vector_path = self.get_agent_vector_path(user_id, agent_id)
-        
-        # Создаем директорию если не существует
-        vector_path.mkdir(parents=True, exist_ok=True)
-        
-        client = self._get_client(vector_path)
-        collection_name = f"agent_{agent_id}_docs"
-        
-        logger.info(f"Получаем коллекцию {collection_name} для агента {agent_id}")
-        
+    def _get_alert_index(self, user_id: int, agent_id: int) -> AlertIndex:
+        """Получает инвертированный индекс алертов агента"""
+        return AlertIndex(self.get_agent_index_path(user_id, agent_id))
+    
+    def get_agent_reindex_lock_path(self, user_id: int, agent_id: int) -> Path:
+        """Получает путь к файлу блокировки переиндексации агента"""
+        return self.base_path / str(user_id) / str(agent_id) / "reindex.lock"
+    
+    def get_agent_model_path(self, user_id: int, agent_id: int, generation: int) -> Path:
+        """Получает путь к файлу с моделью эмбеддингов поколения коллекции агента"""
+        return self.base_path / str(user_id) / str(agent_id) / f"embedding_model.g{generation}"
+    
+    def get_generation_model(self, user_id: int, agent_id: int, generation: Optional[int] = None) -> str:
+        """
+        Модель эмбеддингов, которой построено поколение коллекции агента (по умолчанию - активное).
+        Для поколения без записи (создано до учета моделей или еще пустое) запоминается текущая модель
+        из RAGConfig: после смены RAG_EMBEDDING_MODEL запросы и новые записи эмбеддятся прежней моделью,
+        пока переиндексация не переключит агента на поколение, построенное новой.
+        """
+        if generation is None:
+            generation = self.generations.get(user_id, agent_id)
+        path = self.get_agent_model_path(user_id, agent_id, generation)
         try:
-            collection = client.get_collection(name=collection_name)
-            logger.info(f"Коллекция {collection_name} найдена, количество документов: {collection.count()}")
-            return collection
-        except Exception as e:
-            logger.warning(f"Коллекция {collection_name} не найдена, создаем новую: {e}")
-            # Если коллекция не существует, создаем её
-            collection = client.get_or_create_collection(
-                name=collection_name,
-                metadata={"description": f"Documents for agent {agent_id}"}
-            )
-            logger.info(f"Создана новая коллекция {collection_name}")
-            return collection
+            return path.read_text().strip() or RAGConfig.EMBEDDING_MODEL
+        except FileNotFoundError:
+            self._set_generation_model(user_id, agent_id, generation, RAGConfig.EMBEDDING_MODEL)
+            return RAGConfig.EMBEDDING_MODEL
+    
+    def _set_generation_model(self, user_id: int, agent_id: int, generation: int, model_name: str):
+        path = self.get_agent_model_path(user_id, agent_id, generation)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(model_name)
+        os.replace(tmp_path, path)
     
-    def _get_cache_key(self, user_id: int, agent_id: int, query: str, n_results: int) -> str:
-        """Генерирует ключ для кэша поиска"""
-        cache_data = f"{user_id}_{agent_id}_{query}_{n_results}"
+    def _get_embedder(self, model_name: str) -> EmbeddingService:
+        """Сервис эмбеддингов модели (модель по умолчанию уже создана в self.embedder)"""
+        if model_name == self.embedder.model_name:
+            return self.embedder
+        return EmbeddingService(model_name)
+    
+    def get_collection_name(self, agent_id: int, generation: int = 0) -> str:
+        """Имя коллекции агента (коллекции, построенные переиндексацией, имеют суффикс поколения)"""
+        name = f"agent_{agent_id}_docs"
+        return f"{name}_g{generation}" if generation else name
+    
+    @property
+    def shared_mode(self) -> bool:
+        """Все агенты хранятся в общих коллекциях с фильтрацией по метаданным"""
+        return RAGConfig.VECTOR_STORE_MODE == "shared"
+    
+    def get_shared_vector_path(self) -> Path:
+        """Путь к общей векторной БД (режим shared)"""
+        return self.base_path / "shared" / "vector_store"
+    
+    def _get_shard(self, agent_id: int) -> int:
+        """Шард общей коллекции: все записи агента лежат в одном шарде"""
+        return agent_id % RAGConfig.SHARED_SHARDS
+    
+    def _get_location(self, user_id: int, agent_id: int, shared: Optional[bool] = None,
+                      generation: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Где лежат записи агента: путь к БД, имя коллекции и поколение коллекции агента для пула
+        (versioning). По умолчанию - активное поколение индекса агента, generation указывает на теневую коллекцию.
+        """
+        if generation is None:
+            generation = self.generations.get(user_id, agent_id)
+        versioning = {"version": self.versions.get(user_id, agent_id), "version_key": (user_id, agent_id)}
+        if self.shared_mode if shared is None else shared:
+            shard = self._get_shard(agent_id)
+            name = f"shared_docs_{shard}"
+            # Клиент общей БД открыт и для других агентов: свежесть по поколению этого агента
+            versioning["changed_at"] = self.versions.changed_at(user_id, agent_id)
+            return {
+                "path": self.get_shared_vector_path(),
+                "name": f"{name}_g{generation}" if generation else name,
+                "generation": generation,
+                "description": f"Shared documents, shard {shard}",
+                "versioning": versioning
+            }
+        return {
+            "path": self.get_agent_vector_path(user_id, agent_id),
+            "name": self.get_collection_name(agent_id, generation),
+            "generation": generation,
+            "description": f"Documents for agent {agent_id}",
+            "versioning": versioning
+        }
+    
+    def _get_where(self, user_id: int, agent_id: int, shared: Optional[bool] = None,
+                   **fields) -> Optional[Dict[str, Any]]:
+        """Фильтр записей агента (в режиме shared коллекция общая) с дополнительными условиями по метаданным"""
+        conditions = []
+        if self.shared_mode if shared is None else shared:
+            conditions += [{"user_id": user_id}, {"agent_id": agent_id}]
+        conditions += [{field: value} for field, value in fields.items()]
+        if not conditions:
+            return None
+        if len(conditions) == 1:
+            return conditions[0]
+        return {"$and": conditions}
+    
+    def _get_record_id(self, user_id: int, agent_id: int, chunk_id: str, shared: Optional[bool] = None) -> str:
+        """ID записи в коллекции: в общей коллекции ID должны быть уникальны между агентами"""
+        if self.shared_mode if shared is None else shared:
+            return f"u{user_id}_a{agent_id}_{chunk_id}"
+        return chunk_id
+    
+    def _collection(self, user_id: int, agent_id: int, shared: Optional[bool] = None,
+                    generation: Optional[int] = None):
+        """
+        Коллекция агента на время блока with (хендл кэшируется в пуле, создается при первом обращении).
+        Хендл привязан к поколению коллекции и переоткрывается после изменений из других процессов;
+        клиент не закрывается, пока блок не завершится.
+        """
+        location = self._get_location(user_id, agent_id, shared, generation)
+        model_name = self.get_generation_model(user_id, agent_id, location["generation"])
+        return self.pool.collection(
+            location["path"],
+            location["name"],
+            metadata={"description": location["description"], "embedding_model": model_name},
+            **location["versioning"]
+        )
+    
+    def _existing_collection(self, user_id: int, agent_id: int, shared: Optional[bool] = None,
+                             generation: Optional[int] = None):
+        """Существующая коллекция агента на время блока with (None, если ее нет)"""
+        location = self._get_location(user_id, agent_id, shared, generation)
+        return self.pool.existing_collection(location["path"], location["name"], **location["versioning"])
+    
+    def _get_agent_records(self, collection, user_id: int, agent_id: int, include: List[str],
+                           shared: Optional[bool] = None, where_fields: Optional[Dict[str, Any]] = None,
+                           **kwargs) -> Dict[str, Any]:
+        """Получает записи агента из коллекции (с фильтром в режиме shared)"""
+        where = self._get_where(user_id, agent_id, shared, **(where_fields or {}))
+        if where is not None:
+            kwargs["where"] = where
+        return collection.get(include=include, **kwargs)
+    
+    def count_documents(self, user_id: int, agent_id: int) -> int:
+        """Количество записей в коллекции агента (0, если коллекции нет)"""
+        with self._existing_collection(user_id, agent_id) as collection:
+            if collection is None:
+                return 0
+            if not self.shared_mode:
+                return collection.count()
+            return len(self._get_agent_records(collection, user_id, agent_id, include=[]).get('ids') or [])
+    
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику пула клиентов ChromaDB"""
+        return self.pool.stats()
+    
+    def _get_cache_key(self, user_id: int, agent_id: int, query: str, n_results: int, version: int) -> str:
+        """Генерирует ключ для кэша поиска (с учетом поколения коллекции)"""
+        cache_data = f"{user_id}_{agent_id}_v{version}_{query}_{n_results}"
         return hashlib.md5(cache_data.encode()).hexdigest()
     
-    def _get_cached_result(self, cache_key: str) -> Optional[List[Dict[str, Any]]]:
-        """Получает результат из кэша если он еще актуален"""
-        if cache_key in self._search_cache:
-            result, timestamp = self._search_cache[cache_key]
-            if time.time() - timestamp < self._cache_ttl:
-                logger.debug(f"Результат найден в кэше для ключа: {cache_key}")
-                return result
-            else:
-                # Удаляем устаревший результат
-                del self._search_cache[cache_key]
-        return None
+    def get_collection_version(self, user_id: int, agent_id: int) -> int:
+        """Текущее поколение коллекции агента"""
+        return self.versions.get(user_id, agent_id)
     
-    def _cache_result(self, cache_key: str, result: List[Dict[str, Any]]):
-        """Сохраняет результат в кэш"""
-        self._search_cache[cache_key] = (result, time.time())
-        logger.debug(f"Результат сохранен в кэш для ключа: {cache_key}")
+    def invalidate_agent_cache(self, user_id: int, agent_id: int, collection=None) -> int:
+        """
+        Инвалидирует кэш поиска агента за O(1): увеличивает поколение коллекции,
+        и записи со старым поколением больше не находятся (и вытесняются по LRU/TTL).
+        collection - хендл, через который этот процесс изменил коллекцию: его клиент остается актуальным
+        """
+        from .response_cache import get_response_cache
+
+        response_cache = get_response_cache()
+        if response_cache is not None:
+            # Ответы LLM построены на старых документах
+            response_cache.invalidate_agent(agent_id, user_id)
+        version = self.versions.bump(user_id, agent_id)
+        if collection is not None:
+            location = self._get_location(user_id, agent_id)
+            self.pool.adopt_version(location["path"], collection, version, (user_id, agent_id))
+        return version
     
     def clear_cache(self):
         """Очищает кэш поиска"""
-        self._search_cache.clear()
+        self.search_cache.clear()
         logger.info("Кэш поиска очищен")
     
+    def get_embedding_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику сервиса и кэша эмбеддингов"""
+        stats = self.embedder.stats()
+        if self.embedding_cache is not None:
+            stats["cache"] = self.embedding_cache.stats()
+        return stats
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику кэша поиска"""
+        return self.search_cache.stats()
+    
     def create_agent_collection(self, user_id: int, agent_id: int) -> str:
         """Создает коллекцию для агента в ChromaDB"""
         try:
-            import chromadb
-            vector_path = self.get_agent_vector_path(user_id, agent_id)
-            vector_path.mkdir(parents=True, exist_ok=True)
-            
-            # Создаем клиент ChromaDB
-            client = chromadb.PersistentClient(path=str(vector_path))
-            collection_name = f"agent_{agent_id}_docs"
-            
-            # Создаем или получаем коллекцию
-            collection = client.get_or_create_collection(
-                name=collection_name,
-                metadata={"description": f"Documents for agent {agent_id}"}
-            )
-            
+            with self._collection(user_id, agent_id):
+                pass
+            collection_name = self.get_collection_name(agent_id)
             logger.info(f"Создана коллекция {collection_name} для агента {agent_id}")
             return collection_name
             
@@ -132,73 +280,245 @@ class VectorStore:
             logger.error(f"Ошибка при создании коллекции для агента {agent_id}: {e}")
             raise
     
-    def add_documents(self, user_id: int, agent_id: int, documents: List[Dict[str, Any]]) -> bool:
-        """Добавляет документы в векторную БД агента"""
-        try:
-            # Получаем коллекцию (создается автоматически если не существует)
-            collection = self._get_collection(user_id, agent_id)
-            
-            # Подготавливаем данные для добавления
-            texts = []
-            metadatas = []
-            ids = []
+    def _build_records(self, user_id: int, agent_id: int, documents: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+        """
+        Готовит записи коллекции из документов.
+        Если в документе уже есть готовые 'chunks' (структурные чанки из DocumentProcessor),
+        используются они, иначе 'text' режется чанкером.
+        """
+        records = {"ids": [], "texts": [], "hashes": [], "metadatas": []}
+        
+        for doc in documents:
+            chunks = doc.get('chunks')
+            if chunks is None:
+                chunks = self.chunker.chunk_text(doc.get('text', ''))
             
-            for i, doc in enumerate(documents):
-                texts.append(doc['text'])
-                metadatas.append({
+            for chunk in chunks:
+                metadata = {
+                    'user_id': user_id,
+                    'agent_id': agent_id,
+                    'document_id': str(doc['id']),
                     'filename': doc['filename'],
                     'file_type': doc['file_type'],
-                    'uploaded_at': str(doc['uploaded_at'])
-                })
-                ids.append(f"doc_{doc['id']}_{i}")
-            
-            # Добавляем документы в коллекцию
-            collection.add(
+                    'uploaded_at': str(doc['uploaded_at']),
+                    'chunk_index': chunk['chunk_index'],
+                    'chunk_hash': chunk['chunk_hash'],
+                    'kind': chunk.get('kind', 'text')
+                }
+                # ChromaDB не принимает None в метаданных - переносим только заданные поля
+                for field in LOCATION_FIELDS:
+                    if chunk.get(field) is not None:
+                        metadata[field] = chunk[field]
+                
+                # Стабильные ID (документ + хэш содержимого) позволяют повторно загружать документ без дублей
+                records["ids"].append(self._get_record_id(user_id, agent_id, make_chunk_id(doc['id'], chunk['chunk_hash'])))
+                records["texts"].append(chunk['text'])
+                records["hashes"].append(chunk['chunk_hash'])
+                records["metadatas"].append(metadata)
+        
+        return records
+    
+    def _upsert_records(self, collection, records: Dict[str, List[Any]], indexes: List[int], model_name: str):
+        """Записывает выбранные записи в коллекцию пачками (эмбеддинги - моделью поколения коллекции)"""
+        batch_size = RAGConfig.UPSERT_BATCH_SIZE
+        for start in range(0, len(indexes), batch_size):
+            batch = indexes[start:start + batch_size]
+            texts = [records["texts"][i] for i in batch]
+            collection.upsert(
                 documents=texts,
-                metadatas=metadatas,
-                ids=ids
+                embeddings=self._embed_chunks(texts, [records["hashes"][i] for i in batch], model_name),
+                metadatas=[records["metadatas"][i] for i in batch],
+                ids=[records["ids"][i] for i in batch]
             )
+    
+    def _update_alert_index(self, user_id: int, agent_id: int, collection,
+                            added_ids: List[str], added_texts: List[str], removed_ids: List[str] = None):
+        """Обновляет индекс алертов (при первой загрузке индексируем всю коллекцию)"""
+        alert_index = self._get_alert_index(user_id, agent_id)
+        if not alert_index.exists():
+            self._rebuild_alert_index(user_id, agent_id, collection)
+            return
+        if removed_ids:
+            alert_index.remove_chunks(removed_ids)
+        if added_ids:
+            alert_index.add_chunks(added_ids, added_texts)
+    
+    def add_documents(self, user_id: int, agent_id: int, documents: List[Dict[str, Any]],
+                      generation: Optional[int] = None) -> bool:
+        """
+        Добавляет документы в векторную БД агента.
+        С generation пишет в теневую коллекцию переиндексации: индекс алертов и кэш поиска не трогаются.
+        """
+        try:
+            records = self._build_records(user_id, agent_id, documents)
+            
+            if not records["ids"]:
+                logger.warning(f"Нет чанков для добавления в коллекцию агента {agent_id}")
+                return False
             
-            logger.info(f"Добавлено {len(documents)} документов в коллекцию agent_{agent_id}_docs")
+            # Поколение фиксируем один раз: коллекция и модель эмбеддингов должны совпадать
+            target = self.generations.get(user_id, agent_id) if generation is None else generation
+            model_name = self.get_generation_model(user_id, agent_id, target)
+            
+            # Получаем коллекцию (создается автоматически если не существует)
+            with self._collection(user_id, agent_id, generation=target) as collection:
+                self._upsert_records(collection, records, list(range(len(records["ids"]))), model_name)
+                if generation is None:
+                    self._update_alert_index(user_id, agent_id, collection, records["ids"], records["texts"])
+                    self.invalidate_agent_cache(user_id, agent_id, collection)
+            
+            logger.info(f"Добавлено {len(records['ids'])} чанков из {len(documents)} документов в коллекцию агента {agent_id}")
             return True
             
         except Exception as e:
             logger.error(f"Ошибка при добавлении документов в векторную БД: {e}")
             return False
     
+    def update_document(self, user_id: int, agent_id: int, document: Dict[str, Any]) -> Optional[Dict[str, int]]:
+        """
+        Обновляет документ в векторной БД на месте (по ID документа).
+        Сравнивает хэши старых и новых чанков: удаляет исчезнувшие, добавляет новые и измененные,
+        у неизмененных обновляет только метаданные (позиция в документе), без повторного вычисления эмбеддингов.
+        Для нового документа равносильно add_documents. Возвращает счетчики или None при ошибке.
+        """
+        try:
+            records = self._build_records(user_id, agent_id, [document])
+            
+            if not records["ids"]:
+                logger.warning(f"Нет чанков для документа {document['id']} агента {agent_id}")
+                return None
+            
+            active = self.generations.get(user_id, agent_id)
+            model_name = self.get_generation_model(user_id, agent_id, active)
+            with self._collection(user_id, agent_id, generation=active) as collection:
+                existing = self._get_agent_records(
+                    collection, user_id, agent_id, include=['metadatas'],
+                    where_fields={'document_id': str(document['id'])}
+                )
+                existing_metadatas = dict(zip(existing.get('ids') or [], existing.get('metadatas') or []))
+                
+                new_ids = set(records["ids"])
+                removed_ids = [record_id for record_id in existing_metadatas if record_id not in new_ids]
+                added = []
+                changed_metadata = []
+                for i, record_id in enumerate(records["ids"]):
+                    old_metadata = existing_metadatas.get(record_id)
+                    if old_metadata is None:
+                        added.append(i)
+                    elif self._metadata_changed(old_metadata, records["metadatas"][i]):
+                        changed_metadata.append(i)
+                
+                batch_size = RAGConfig.UPSERT_BATCH_SIZE
+                for start in range(0, len(removed_ids), batch_size):
+                    collection.delete(ids=removed_ids[start:start + batch_size])
+                self._upsert_records(collection, records, added, model_name)
+                for start in range(0, len(changed_metadata), batch_size):
+                    batch = changed_metadata[start:start + batch_size]
+                    collection.update(
+                        ids=[records["ids"][i] for i in batch],
+                        metadatas=[records["metadatas"][i] for i in batch]
+                    )
+                
+                result = {
+                    "added": len(added),
+                    "removed": len(removed_ids),
+                    "unchanged": len(records["ids"]) - len(added)
+                }
+                
+                if added or removed_ids or changed_metadata:
+                    self._update_alert_index(
+                        user_id, agent_id, collection,
+                        [records["ids"][i] for i in added],
+                        [records["texts"][i] for i in added],
+                        removed_ids
+                    )
+                    self.invalidate_agent_cache(user_id, agent_id, collection)
+                
+            logger.info(f"Документ {document['id']} агента {agent_id} обновлен: {result}")
+            return result
+            
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении документа {document.get('id')} в векторной БД: {e}")
+            return None
+    
+    @staticmethod
+    def _metadata_changed(old: Dict[str, Any], new: Dict[str, Any]) -> bool:
+        """Изменились ли метаданные чанка (время загрузки не учитываем - оно меняется при каждой загрузке)"""
+        return any(old.get(field) != value for field, value in new.items() if field != 'uploaded_at') \
+            or any(field not in new for field in old)
+    
+    def _embed_chunks(self, texts: List[str], chunk_hashes: List[str], model_name: str) -> List[List[float]]:
+        """Эмбеддинги чанков: неизмененные берутся из кэша, модель считает только новые"""
+        embedder = self._get_embedder(model_name)
+        if self.embedding_cache is None:
+            return embedder.embed(texts)
+        
+        try:
+            cached = self.embedding_cache.get_many(chunk_hashes, model_name)
+        except Exception as e:
+            logger.warning(f"Кэш эмбеддингов недоступен: {e}")
+            return embedder.embed(texts)
+        
+        missing = {}
+        for text, chunk_hash in zip(texts, chunk_hashes):
+            if chunk_hash not in cached and chunk_hash not in missing:
+                missing[chunk_hash] = text
+        
+        if missing:
+            vectors = embedder.embed(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            cached.update(computed)
+            try:
+                self.embedding_cache.put_many(computed.items(), model_name)
+            except Exception as e:
+                logger.warning(f"Не удалось сохранить эмбеддинги в кэш: {e}")
+        
+        logger.info(f"Эмбеддинги: {len(texts) - len(missing)} из кэша, {len(missing)} вычислено")
+        return [cached[chunk_hash] for chunk_hash in chunk_hashes]
+    
     def search_similar(self, user_id: int, agent_id: int, query: str, n_results: int = 5) -> List[Dict[str, Any]]:
         """Ищет похожие документы по запросу"""
         try:
             # Проверяем кэш
-            cache_key = self._get_cache_key(user_id, agent_id, query, n_results)
-            cached_result = self._get_cached_result(cache_key)
+            version = self.versions.get(user_id, agent_id)
+            cache_key = self._get_cache_key(user_id, agent_id, query, n_results, version)
+            cached_result = self.search_cache.get(cache_key)
             if cached_result is not None:
+                logger.debug(f"Результат найден в кэше для ключа: {cache_key}")
                 return cached_result
             
-            vector_path = self.get_agent_vector_path(user_id, agent_id)
+            vector_path = self._get_location(user_id, agent_id)["path"]
             logger.info(f"Ищем векторную БД по пути: {vector_path}")
-            logger.info(f"Путь существует: {vector_path.exists()}")
             
             if not vector_path.exists():
                 logger.warning(f"Векторная БД для агента {agent_id} не найдена по пути: {vector_path}")
                 return []
             
+            # Запрос эмбеддим той же моделью, которой построено активное поколение коллекции
+            active = self.generations.get(user_id, agent_id)
+            model_name = self.get_generation_model(user_id, agent_id, active)
+            
             # Получаем коллекцию (создается автоматически если не существует)
-            collection = self._get_collection(user_id, agent_id)
+            with self._collection(user_id, agent_id, generation=active) as collection:
+                # Сначала пробуем точный поиск по названию алерта
+                exact_results = self._search_exact_alert(user_id, agent_id, collection, query)
+                if not exact_results:
+                    # Если точный поиск не дал результатов, ищем по смыслу
+                    query_kwargs = {}
+                    where = self._get_where(user_id, agent_id)
+                    if where is not None:
+                        query_kwargs["where"] = where
+                    results = collection.query(
+                        query_embeddings=[self._get_embedder(model_name).embed_query(query)],
+                        n_results=n_results,
+                        **query_kwargs
+                    )
             
-            # Сначала пробуем точный поиск по названию алерта
-            exact_results = self._search_exact_alert(collection, query)
             if exact_results:
                 logger.info(f"Найден точный алерт: {exact_results[0].get('text', '')[:100]}...")
-                self._cache_result(cache_key, exact_results)
+                self.search_cache.set(cache_key, exact_results)
                 return exact_results
             
-            # Если точный поиск не дал результатов, ищем по смыслу
-            results = collection.query(
-                query_texts=[query],
-                n_results=n_results
-            )
-            
             # Форматируем результаты и приоритизируем первую строку
             formatted_results = []
             if results['documents'] and results['documents'][0]:
@@ -228,7 +548,7 @@ class VectorStore:
                 formatted_results.sort(key=lambda x: (not x['has_first_line_match'], x['distance']))
             
             # Сохраняем результат в кэш
-            self._cache_result(cache_key, formatted_results)
+            self.search_cache.set(cache_key, formatted_results)
             
             return formatted_results
             
@@ -236,86 +556,50 @@ class VectorStore:
             logger.error(f"Ошибка при поиске похожих документов: {e}")
             return []
     
-    def _search_exact_alert(self, collection, query: str) -> List[Dict[str, Any]]:
-        """Умный поиск алертов - извлекает все алерты из текста и ищет точные совпадения в первой строке"""
+    async def asearch_similar(self, user_id: int, agent_id: int, query: str, n_results: int = 5) -> List[Dict[str, Any]]:
+        """search_similar для async кода: выполняется в пуле потоков и не блокирует event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, partial(self.search_similar, user_id, agent_id, query, n_results)
+        )
+    
+    def _search_exact_alert(self, user_id: int, agent_id: int, collection, query: str) -> List[Dict[str, Any]]:
+        """Точный поиск алерта по инвертированному индексу (код алерта / название -> чанки)"""
         try:
-            # Извлекаем все возможные алерты из запроса
-            alerts = self._extract_alerts_from_text(query)
-            logger.info(f"Найдено алертов в тексте: {alerts}")
-            
-            if not alerts:
-                return []
+            alert_index = self._get_alert_index(user_id, agent_id)
             
-            # Получаем все документы из коллекции
-            all_docs = collection.get()
+            # Коллекции, загруженные до появления индекса, индексируем один раз
+            if not alert_index.exists():
+                self._rebuild_alert_index(user_id, agent_id, collection)
             
-            if not all_docs or not all_docs.get('documents'):
+            match = alert_index.lookup(query)
+            if not match:
                 return []
             
-            # Ищем точные совпадения для каждого алерта, приоритизируя первую строку
-            for alert in alerts:
-                for i, doc_text in enumerate(all_docs['documents']):
-                    # Сначала проверяем первую строку документа
-                    first_line = self._get_first_line(doc_text)
-                    if first_line and self._is_exact_match(alert, first_line):
-                        logger.info(f"Найдено точное совпадение в первой строке для '{alert}': {first_line}")
-                        return [{
-                            'text': doc_text,
-                            'metadata': {
-                                'filename': all_docs['metadatas'][i].get('filename', 'unknown') if all_docs.get('metadatas') else 'unknown',
-                                'file_type': all_docs['metadatas'][i].get('file_type', 'unknown') if all_docs.get('metadatas') else 'unknown',
-                                'uploaded_at': all_docs['metadatas'][i].get('uploaded_at', 'unknown') if all_docs.get('metadatas') else 'unknown',
-                                'match_type': 'first_line'
-                            }
-                        }]
-            
-            # Если в первой строке не найдено, ищем в остальном тексте
-            for alert in alerts:
-                for i, doc_text in enumerate(all_docs['documents']):
-                    if self._is_exact_match(alert, doc_text):
-                        logger.info(f"Найдено точное совпадение в тексте для '{alert}': {doc_text[:200]}...")
-                        return [{
-                            'text': doc_text,
-                            'metadata': {
-                                'filename': all_docs['metadatas'][i].get('filename', 'unknown') if all_docs.get('metadatas') else 'unknown',
-                                'file_type': all_docs['metadatas'][i].get('file_type', 'unknown') if all_docs.get('metadatas') else 'unknown',
-                                'uploaded_at': all_docs['metadatas'][i].get('uploaded_at', 'unknown') if all_docs.get('metadatas') else 'unknown',
-                                'match_type': 'full_text'
-                            }
-                        }]
+            found = collection.get(ids=match['ids'][:1], include=['documents', 'metadatas'])
+            if not found or not found.get('documents'):
+                logger.warning(f"Индекс алертов ссылается на отсутствующие чанки: {match['ids'][:1]}")
+                return []
             
-            return []
+            metadata = dict(found['metadatas'][0] or {}) if found.get('metadatas') else {}
+            metadata['match_type'] = match['match_type']
+            logger.info(f"Найдено точное совпадение ({match['match_type']}) по ключу '{match['key']}'")
+            return [{
+                'text': found['documents'][0],
+                'metadata': metadata
+            }]
             
         except Exception as e:
             logger.error(f"Ошибка при точном поиске алерта: {e}")
             return []
     
-    def _extract_alerts_from_text(self, text: str) -> List[str]:
-        """Извлекает все алерты из текста пользователя"""
-        import re
-        alerts = []
-        
-        # Паттерны для разных типов алертов
-        patterns = [
-            r'\[Alerting\]\s+([^\n]+?)(?:\s+alert)?',  # [Alerting] Memory OpenApi IS/CS alert
-            r'z\d+[a-z]?\s+([^\n]+?)(?:\s+alert)?',    # z735 Инвалидные пакеты в MTBDM
-            r'c\d+[a-z]?\s+([^\n]+?)(?:\s+alert)?',    # c217 <10% свободного места
-            r'[A-Z]\d+[a-z]?\s+([^\n]+?)(?:\s+alert)?', # C214. Не работает MTBank Moby
-        ]
-        
-        for pattern in patterns:
-            matches = re.findall(pattern, text, re.IGNORECASE | re.MULTILINE)
-            for match in matches:
-                alert_name = match.strip()
-                if alert_name and len(alert_name) > 3:  # Фильтруем слишком короткие совпадения
-                    alerts.append(alert_name)
-        
-        # Дополнительно извлекаем ключевые слова из алерта
-        alert_keywords = self._extract_keywords_from_alert(text)
-        alerts.extend(alert_keywords)
-        
-        # Убираем дубликаты
-        return list(set(alerts))
+    def _rebuild_alert_index(self, user_id: int, agent_id: int, collection, shared: Optional[bool] = None):
+        """Перестраивает индекс алертов агента по всем чанкам коллекции"""
+        all_docs = self._get_agent_records(collection, user_id, agent_id, include=['documents'], shared=shared)
+        self._get_alert_index(user_id, agent_id).rebuild(
+            all_docs.get('ids') or [],
+            all_docs.get('documents') or []
+        )
     
     def _extract_keywords_from_alert(self, text: str) -> List[str]:
         """Извлекает ключевые слова из алерта для улучшенного поиска"""
@@ -363,41 +647,220 @@ class VectorStore:
         
         return ""
     
-    def _is_exact_match(self, alert: str, table_row: str) -> bool:
-        """Проверяет точное совпадение алерта в строке таблицы"""
-        # Нормализуем строки для сравнения
-        alert_normalized = alert.lower().strip()
-        row_normalized = table_row.lower().strip()
-        
-        # Проверяем различные варианты совпадения
-        if alert_normalized in row_normalized:
-            return True
-        
-        # Для алертов типа z735 проверяем по номеру
-        if alert_normalized.startswith('z') and alert_normalized[1:].isdigit():
-            alert_number = alert_normalized
-            if alert_number in row_normalized:
-                return True
+    def delete_documents(self, user_id: int, agent_id: int, document_ids: List[Any],
+                         generation: Optional[int] = None) -> int:
+        """
+        Удаляет все чанки документов (по метаданным document_id) пачками.
+        Возвращает число удаленных записей.
+        """
+        if not document_ids:
+            return 0
         
-        # Для алертов типа [Alerting] проверяем по названию
-        if alert_normalized.startswith('[') and 'alerting' in alert_normalized:
-            # Извлекаем название без [Alerting] и alert
-            name_part = alert_normalized.replace('[alerting]', '').replace('alert', '').strip()
-            if name_part and name_part in row_normalized:
-                return True
+        with self._existing_collection(user_id, agent_id, generation=generation) as collection:
+            if collection is None:
+                return 0
+            
+            document_ids = [str(document_id) for document_id in document_ids]
+            batch_size = RAGConfig.UPSERT_BATCH_SIZE
+            removed_ids = []
+            for start in range(0, len(document_ids), batch_size):
+                batch = document_ids[start:start + batch_size]
+                condition = batch[0] if len(batch) == 1 else {"$in": batch}
+                records = self._get_agent_records(collection, user_id, agent_id, include=[],
+                                                  where_fields={'document_id': condition})
+                removed_ids.extend(records.get('ids') or [])
+            
+            for start in range(0, len(removed_ids), batch_size):
+                collection.delete(ids=removed_ids[start:start + batch_size])
+            
+            if removed_ids and generation is None:
+                alert_index = self._get_alert_index(user_id, agent_id)
+                if alert_index.exists():
+                    alert_index.remove_chunks(removed_ids)
+                self.invalidate_agent_cache(user_id, agent_id, collection)
         
-        return False
+        logger.info(f"Удалено {len(removed_ids)} чанков {len(document_ids)} документов из коллекции агента {agent_id}")
+        return len(removed_ids)
+    
+    def delete_document(self, user_id: int, agent_id: int, document_id: Any) -> int:
+        """Удаляет все чанки документа из векторной БД агента"""
+        return self.delete_documents(user_id, agent_id, [document_id])
     
     def delete_agent_collection(self, user_id: int, agent_id: int) -> bool:
         """Удаляет коллекцию агента"""
         try:
-            vector_path = self.get_agent_vector_path(user_id, agent_id)
-            if vector_path.exists():
-                import shutil
-                shutil.rmtree(vector_path)
-                logger.info(f"Удалена векторная БД для агента {agent_id}")
-                return True
-            return False
+            self._get_alert_index(user_id, agent_id).delete()
+            
+            deleted = False
+            if self.shared_mode:
+                with self._existing_collection(user_id, agent_id) as collection:
+                    if collection is not None:
+                        collection.delete(where=self._get_where(user_id, agent_id))
+                        logger.info(f"Удалены записи агента {agent_id} из общей коллекции {collection.name}")
+                        deleted = True
+            else:
+                vector_path = self.get_agent_vector_path(user_id, agent_id)
+                self.pool.discard(vector_path)
+                if vector_path.exists():
+                    import shutil
+                    shutil.rmtree(vector_path)
+                    logger.info(f"Удалена векторная БД для агента {agent_id}")
+                    deleted = True
+            
+            # Записей агента не осталось - новые документы эмбеддятся текущей моделью
+            self.get_agent_model_path(user_id, agent_id, self.generations.get(user_id, agent_id)).unlink(missing_ok=True)
+            
+            # Поколение увеличиваем после удаления, чтобы не закэшировать старые результаты под новым ключом
+            self.invalidate_agent_cache(user_id, agent_id)
+            return deleted
         except Exception as e:
             logger.error(f"Ошибка при удалении векторной БД агента {agent_id}: {e}")
             return False
+    
+    def get_index_generation(self, user_id: int, agent_id: int) -> int:
+        """Активное поколение индекса агента"""
+        return self.generations.get(user_id, agent_id)
+    
+    @contextmanager
+    def reindex_lock(self, user_id: int, agent_id: int):
+        """Блокировка переиндексации агента между процессами (отдает False, если переиндексация уже идет)"""
+        path = self.get_agent_reindex_lock_path(user_id, agent_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def create_shadow_collection(self, user_id: int, agent_id: int) -> int:
+        """
+        Создает пустую теневую коллекцию следующего поколения и возвращает его номер.
+        Остатки прерванной переиндексации того же поколения удаляются.
+        """
+        generation = self.generations.get(user_id, agent_id) + 1
+        self._drop_generation(user_id, agent_id, generation)
+        # Новое поколение строится текущей моделью из RAGConfig
+        self._set_generation_model(user_id, agent_id, generation, RAGConfig.EMBEDDING_MODEL)
+        with self._collection(user_id, agent_id, generation=generation):
+            pass
+        logger.info(f"Создана теневая коллекция поколения {generation} для агента {agent_id} "
+                    f"(модель эмбеддингов {RAGConfig.EMBEDDING_MODEL})")
+        return generation
+    
+    def swap_collection(self, user_id: int, agent_id: int, generation: int) -> bool:
+        """
+        Переключает поиск агента на теневую коллекцию поколения generation.
+        Индекс алертов строится по теневой коллекции заранее и подменяется файлом сразу после переключения.
+        Старая коллекция остается на месте для запросов, начатых до переключения (см. drop_collection_generation).
+        """
+        try:
+            active = self.generations.get(user_id, agent_id)
+            if generation != active + 1:
+                logger.error(f"Агент {agent_id}: нельзя переключиться на поколение {generation}, активное - {active}")
+                return False
+            
+            index_path = self.get_agent_index_path(user_id, agent_id)
+            shadow_index = AlertIndex(index_path.with_name(f"alert_index.g{generation}.json"))
+            with self._collection(user_id, agent_id, generation=generation) as shadow:
+                records = self._get_agent_records(shadow, user_id, agent_id, include=['documents'])
+            shadow_index.rebuild(records.get('ids') or [], records.get('documents') or [])
+            
+            self.generations.bump(user_id, agent_id)
+            self._get_alert_index(user_id, agent_id).replace_with(shadow_index)
+            self.invalidate_agent_cache(user_id, agent_id)
+            
+            logger.info(f"Агент {agent_id} пользователя {user_id} переключен на поколение индекса {generation}")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка переключения агента {agent_id} на поколение {generation}: {e}")
+            return False
+    
+    def drop_collection_generation(self, user_id: int, agent_id: int, generation: int) -> bool:
+        """Удаляет записи агента неактивного поколения (старую коллекцию после переиндексации)"""
+        if generation == self.generations.get(user_id, agent_id):
+            logger.warning(f"Поколение {generation} агента {agent_id} активно и не будет удалено")
+            return False
+        try:
+            return self._drop_generation(user_id, agent_id, generation)
+        except Exception as e:
+            logger.error(f"Ошибка удаления поколения {generation} агента {agent_id}: {e}")
+            return False
+    
+    def _drop_generation(self, user_id: int, agent_id: int, generation: int) -> bool:
+        self.get_agent_model_path(user_id, agent_id, generation).unlink(missing_ok=True)
+        location = self._get_location(user_id, agent_id, generation=generation)
+        if not self.shared_mode:
+            return self.pool.delete_collection(location["path"], location["name"], **location["versioning"])
+        
+        # В режиме shared коллекция общая с другими агентами шарда - удаляем только записи агента
+        with self.pool.existing_collection(location["path"], location["name"], **location["versioning"]) as collection:
+            if collection is None:
+                return False
+            collection.delete(where=self._get_where(user_id, agent_id))
+        logger.info(f"Удалены записи агента {agent_id} из коллекции {location['name']}")
+        return True
+    
+    def iter_per_agent_stores(self):
+        """Перебирает агентов, у которых есть отдельная векторная БД (раскладка per_agent)"""
+        for user_dir in sorted(self.base_path.iterdir()):
+            if not user_dir.is_dir() or not user_dir.name.isdigit():
+                continue
+            for agent_dir in sorted(user_dir.iterdir()):
+                if agent_dir.is_dir() and agent_dir.name.isdigit() and (agent_dir / "vector_store").exists():
+                    yield int(user_dir.name), int(agent_dir.name)
+    
+    def migrate_agent_to_shared(self, user_id: int, agent_id: int, remove_source: bool = False) -> int:
+        """
+        Переносит записи агента из отдельной векторной БД в общую коллекцию.
+        Эмбеддинги копируются как есть (без повторного вычисления). Возвращает число перенесенных записей.
+        """
+        source_path = self.get_agent_vector_path(user_id, agent_id)
+        source_name = self._get_location(user_id, agent_id, shared=False)["name"]
+        with self.pool.existing_collection(source_path, source_name) as source:
+            if source is None:
+                logger.warning(f"Векторная БД агента {agent_id} пользователя {user_id} не найдена")
+                return 0
+            
+            with self._collection(user_id, agent_id, shared=True) as target:
+                batch_size = RAGConfig.UPSERT_BATCH_SIZE
+                migrated = 0
+                offset = 0
+                
+                while True:
+                    batch = source.get(include=['documents', 'metadatas', 'embeddings'], limit=batch_size, offset=offset)
+                    ids = batch.get('ids') or []
+                    if not ids:
+                        break
+                    
+                    metadatas = []
+                    for metadata in batch.get('metadatas') or [{}] * len(ids):
+                        metadata = dict(metadata or {})
+                        metadata['user_id'] = user_id
+                        metadata['agent_id'] = agent_id
+                        metadatas.append(metadata)
+                    
+                    target.upsert(
+                        ids=[self._get_record_id(user_id, agent_id, record_id, shared=True) for record_id in ids],
+                        documents=batch['documents'],
+                        metadatas=metadatas,
+                        embeddings=batch['embeddings']
+                    )
+                    migrated += len(ids)
+                    offset += len(ids)
+                
+                # ID записей изменились - индекс алертов строим заново по общей коллекции
+                self._rebuild_alert_index(user_id, agent_id, target, shared=True)
+                self.invalidate_agent_cache(user_id, agent_id, target)
+        
+        if remove_source:
+            self.pool.discard(source_path)
+            import shutil
+            shutil.rmtree(source_path)
+        
+        logger.info(f"Агент {agent_id} пользователя {user_id}: перенесено {migrated} записей в общую коллекцию")
+        return migrated
@@ -1,3 +1,7 @@
-from .file_handlers import PDFHandler, ExcelHandler, WordHandler, FileProcessor
+from .file_handlers import PDFHandler, ExcelHandler, WordHandler, TextHandler, CSVHandler, MarkdownHandler, FileProcessor
+from .chunker import TextChunker
 
-__all__ = ["PDFHandler", "ExcelHandler", "WordHandler", "FileProcessor"]
+__all__ = [
+    "PDFHandler", "ExcelHandler", "WordHandler", "TextHandler", "CSVHandler", "MarkdownHandler",
+    "FileProcessor", "TextChunker"
+]
@@ -0,0 +1,169 @@
+import re
+import hashlib
+import logging
+from typing import List, Dict, Any, Optional, Iterable
+
+from src.core.rag_config import RAGConfig
+
+logger = logging.getLogger(__name__)
+
+# Сегменты этих типов - самостоятельные записи (строки таблиц), они не склеиваются с соседями
+ROW_KINDS = {"row", "table_row"}
+
+# Поля сегмента, которые переносятся в метаданные чанка
+LOCATION_FIELDS = ("page", "sheet", "table", "row", "paragraph", "section")
+
+
+def normalize_chunk_text(text: str) -> str:
+    """
+    Нормализует текст чанка для вычисления хеша: пробелы не важны, регистр важен -
+    иначе правка только регистра не обновила бы текст чанка в векторной БД
+    """
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def compute_chunk_hash(text: str) -> str:
+    """Вычисляет хеш содержимого чанка"""
+    return hashlib.sha256(normalize_chunk_text(text).encode("utf-8")).hexdigest()
+
+
+def make_chunk_id(document_id: Any, chunk_hash: str) -> str:
+    """Строит стабильный ID записи чанка в векторной БД"""
+    return f"doc_{document_id}_{chunk_hash[:16]}"
+
+
+class TextChunker:
+    """Разбивает сегменты документа на небольшие чанки для векторной БД"""
+
+    def __init__(self, chunk_size: Optional[int] = None, chunk_overlap: Optional[int] = None):
+        self.chunk_size = chunk_size or RAGConfig.CHUNK_SIZE
+        self.chunk_overlap = RAGConfig.CHUNK_OVERLAP if chunk_overlap is None else chunk_overlap
+
+        if self.chunk_overlap >= self.chunk_size:
+            raise ValueError("Перекрытие чанков должно быть меньше размера чанка")
+
+    def chunk_text(self, text: str) -> List[Dict[str, Any]]:
+        """Разбивает произвольный текст на чанки"""
+        if not text or not text.strip():
+            return []
+        return self.chunk_segments([{"text": text, "kind": "text"}])
+
+    def chunk_segments(self, segments: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Разбивает сегменты на чанки с учетом структуры документа:
+        - строки таблиц становятся отдельными чанками (с подписями колонок);
+        - страницы PDF режутся в пределах страницы;
+        - абзацы склеиваются до размера чанка.
+
+        Одинаковые по содержимому чанки внутри документа отбрасываются.
+        Сегменты могут приходить генератором - они обрабатываются по одному.
+        """
+        chunks = []
+        seen_hashes = set()
+
+        def emit(text: str, segment: Dict[str, Any]):
+            text = text.strip()
+            if not text:
+                return
+            chunk_hash = compute_chunk_hash(text)
+            # Повторы (колонтитулы, дубли строк) отбрасываем без учета регистра
+            duplicate_key = compute_chunk_hash(text.lower())
+            if duplicate_key in seen_hashes:
+                return
+            seen_hashes.add(duplicate_key)
+
+            chunk = {
+                "text": text,
+                "kind": segment.get("kind", "text"),
+                "chunk_index": len(chunks),
+                "chunk_hash": chunk_hash
+            }
+            for field in LOCATION_FIELDS:
+                if segment.get(field) is not None:
+                    chunk[field] = segment[field]
+            chunks.append(chunk)
+
+        buffer = []
+        buffer_len = 0
+        buffer_segment = None
+
+        def flush():
+            nonlocal buffer, buffer_len, buffer_segment
+            if buffer:
+                for piece in self._split_text("\n".join(buffer)):
+                    emit(piece, buffer_segment)
+            buffer, buffer_len, buffer_segment = [], 0, None
+
+        for segment in segments:
+            text = (segment.get("text") or "").strip()
+            if not text:
+                continue
+            kind = segment.get("kind", "text")
+
+            if kind in ROW_KINDS:
+                flush()
+                for piece in self._split_text(self._format_row(segment)):
+                    emit(piece, segment)
+            elif kind == "paragraph":
+                # Абзацы склеиваем, пока не превышен размер чанка
+                if buffer and buffer_len + len(text) + 1 > self.chunk_size:
+                    flush()
+                if buffer_segment is None:
+                    buffer_segment = segment
+                buffer.append(text)
+                buffer_len += len(text) + 1
+            else:
+                flush()
+                for piece in self._split_text(text):
+                    emit(piece, segment)
+
+        flush()
+        return chunks
+
+    def _format_row(self, segment: Dict[str, Any]) -> str:
+        """Форматирует строку таблицы как пары 'колонка: значение'"""
+        cells = segment.get("cells")
+        header = segment.get("header")
+        if not cells or not header:
+            return segment["text"]
+
+        parts = []
+        for i, value in enumerate(cells):
+            if not value:
+                continue
+            column = header[i] if i < len(header) and header[i] else ""
+            parts.append(f"{column}: {value}" if column else value)
+        return " | ".join(parts) if parts else segment["text"]
+
+    def _split_text(self, text: str) -> List[str]:
+        """Режет текст на окна размером chunk_size с перекрытием, стараясь резать по границам абзацев и предложений"""
+        text = text.strip()
+        if len(text) <= self.chunk_size:
+            return [text]
+
+        pieces = []
+        start = 0
+        while start < len(text):
+            end = min(start + self.chunk_size, len(text))
+            if end < len(text):
+                end = self._find_break(text, start, end)
+
+            pieces.append(text[start:end].strip())
+            if end >= len(text):
+                break
+
+            # Следующее окно начинается с перекрытием, но всегда продвигается вперед
+            next_start = max(end - self.chunk_overlap, start + 1)
+            space = text.find(" ", next_start, end)
+            start = space + 1 if space != -1 else next_start
+
+        return [piece for piece in pieces if piece]
+
+    def _find_break(self, text: str, start: int, end: int) -> int:
+        """Ищет удобную точку разреза во второй половине окна"""
+        min_end = start + self.chunk_size // 2
+        for separator in ("\n\n", "\n", ". ", " "):
+            position = text.rfind(separator, min_end, end)
+            if position != -1:
+                return position + len(separator)
+        return end
@@ -1,32 +1,71 @@
 import os
+import re
+import csv
+import math
+import codecs
 from abc import ABC, abstractmethod
-from typing import List
+from typing import List, Dict, Any, Iterator, Optional
 import logging
 
+from src.core.rag_config import RAGConfig
+
 logger = logging.getLogger(__name__)
 
+# Версия формата сегментов: увеличивать при изменении извлечения, чтобы сбросить кэш извлечения
+SEGMENTS_FORMAT_VERSION = 1
+
 
 class FileHandler(ABC):
     """Базовый класс для обработки файлов"""
     
     @abstractmethod
+    def iter_segments(self, file_path: str, part: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Построчно/постранично отдает структурные сегменты файла (страницы, строки таблиц, абзацы),
+        не собирая весь документ в памяти. part - часть файла из plan_parts (для параллельного извлечения).
+        """
+        pass
+    
+    def plan_parts(self, file_path: str, workers: int) -> List[Dict[str, Any]]:
+        """Делит файл на независимые части для параллельного извлечения (по умолчанию не делится)"""
+        return []
+    
+    def extract_segments(self, file_path: str) -> List[Dict[str, Any]]:
+        """Извлекает все структурные сегменты файла"""
+        return list(self.iter_segments(file_path))
+    
     def extract_text(self, file_path: str) -> str:
         """Извлекает текст из файла"""
-        pass
+        return "\n".join(segment["text"] for segment in self.iter_segments(file_path)).strip()
 
 
 class PDFHandler(FileHandler):
     """Обработчик PDF файлов"""
     
-    def extract_text(self, file_path: str) -> str:
+    def plan_parts(self, file_path: str, workers: int) -> List[Dict[str, Any]]:
+        """Делит PDF на диапазоны страниц"""
+        import PyPDF2
+        with open(file_path, 'rb') as file:
+            pages_count = len(PyPDF2.PdfReader(file).pages)
+        
+        # Несколько диапазонов на процесс выравнивают нагрузку (страницы бывают очень разными)
+        part_size = max(RAGConfig.PARALLEL_EXTRACTION_MIN_PAGES, math.ceil(pages_count / (workers * 2)))
+        return [
+            {"pages": (start, min(start + part_size, pages_count))}
+            for start in range(0, pages_count, part_size)
+        ]
+    
+    def iter_segments(self, file_path: str, part: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+        """Отдает текст PDF постранично (страницы разбираются по мере чтения)"""
         try:
             import PyPDF2
-            text = ""
             with open(file_path, 'rb') as file:
                 pdf_reader = PyPDF2.PdfReader(file)
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-            return text.strip()
+                start, end = part["pages"] if part else (0, len(pdf_reader.pages))
+                for page_number in range(start + 1, end + 1):
+                    page_text = (pdf_reader.pages[page_number - 1].extract_text() or "").strip()
+                    if page_text:
+                        yield {"text": page_text, "kind": "page", "page": page_number}
         except ImportError:
             logger.error("PyPDF2 не установлен")
             raise
@@ -39,48 +78,118 @@ class ExcelHandler(FileHandler):
     """Обработчик Excel файлов"""
     
     def extract_text(self, file_path: str) -> str:
+        """Текст всех листов с заголовками листов (строки собираются списком, без конкатенации строк)"""
+        parts = []
+        current_sheet = None
+        for segment in self.iter_segments(file_path):
+            if segment["sheet"] != current_sheet:
+                if current_sheet is not None:
+                    parts.append("")
+                current_sheet = segment["sheet"]
+                parts.append(f"Sheet: {current_sheet}")
+                if segment.get("header"):
+                    parts.append(" | ".join(segment["header"]))
+            parts.append(segment["text"])
+        return "\n".join(parts).strip()
+    
+    def plan_parts(self, file_path: str, workers: int) -> List[Dict[str, Any]]:
+        """Делит книгу по листам"""
+        import openpyxl
+        workbook = openpyxl.load_workbook(file_path, read_only=True)
+        try:
+            return [{"sheets": [sheet_name]} for sheet_name in workbook.sheetnames]
+        finally:
+            workbook.close()
+    
+    def iter_segments(self, file_path: str, part: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Отдает строки всех листов; первая непустая строка листа считается заголовком.
+        Книга открывается в режиме read_only - строки читаются потоком, без загрузки всего листа.
+        """
         try:
             import openpyxl
-            text = ""
-            workbook = openpyxl.load_workbook(file_path, data_only=True)
-            
-            for sheet_name in workbook.sheetnames:
-                sheet = workbook[sheet_name]
-                text += f"Sheet: {sheet_name}\n"
-                
-                for row in sheet.iter_rows(values_only=True):
-                    row_text = " | ".join(str(cell) if cell is not None else "" for cell in row)
-                    if row_text.strip():
-                        text += row_text + "\n"
-                text += "\n"
-            
-            return text.strip()
+            workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
         except ImportError:
             logger.error("openpyxl не установлен")
             raise
         except Exception as e:
             logger.error(f"Ошибка при обработке Excel файла {file_path}: {e}")
             raise
+        
+        try:
+            for sheet_name in (part["sheets"] if part else workbook.sheetnames):
+                sheet = workbook[sheet_name]
+                header = None
+                rows_count = 0
+                
+                for row_number, row in enumerate(sheet.iter_rows(values_only=True), start=1):
+                    cells = [str(cell).strip() if cell is not None else "" for cell in row]
+                    if not any(cells):
+                        continue
+                    if header is None:
+                        header = cells
+                        continue
+                    rows_count += 1
+                    yield {
+                        "text": " | ".join(cells),
+                        "kind": "row",
+                        "sheet": sheet_name,
+                        "row": row_number,
+                        "cells": cells,
+                        "header": header
+                    }
+                
+                # Лист из одной строки - сохраняем её как обычную строку
+                if header is not None and not rows_count:
+                    yield {
+                        "text": " | ".join(header),
+                        "kind": "row",
+                        "sheet": sheet_name,
+                        "row": 1
+                    }
+        except Exception as e:
+            logger.error(f"Ошибка при обработке Excel файла {file_path}: {e}")
+            raise
+        finally:
+            # В режиме read_only книга держит файл открытым до явного закрытия
+            workbook.close()
 
 
 class WordHandler(FileHandler):
     """Обработчик Word файлов"""
     
-    def extract_text(self, file_path: str) -> str:
+    def iter_segments(self, file_path: str, part: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+        """Отдает абзацы и строки таблиц; первая строка таблицы считается заголовком"""
         try:
             from docx import Document
             doc = Document(file_path)
-            text = ""
-            
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
             
-            for table in doc.tables:
-                for row in table.rows:
-                    row_text = " | ".join(cell.text for cell in row.cells)
-                    text += row_text + "\n"
+            for paragraph_number, paragraph in enumerate(doc.paragraphs, start=1):
+                if paragraph.text.strip():
+                    yield {
+                        "text": paragraph.text.strip(),
+                        "kind": "paragraph",
+                        "paragraph": paragraph_number
+                    }
             
-            return text.strip()
+            for table_number, table in enumerate(doc.tables, start=1):
+                header = None
+                rows = table.rows
+                for row_number, row in enumerate(rows, start=1):
+                    cells = [cell.text.strip() for cell in row.cells]
+                    if not any(cells):
+                        continue
+                    if header is None and len(rows) > 1:
+                        header = cells
+                        continue
+                    yield {
+                        "text": " | ".join(cells),
+                        "kind": "table_row",
+                        "table": table_number,
+                        "row": row_number,
+                        "cells": cells,
+                        "header": header
+                    }
         except ImportError:
             logger.error("python-docx не установлен")
             raise
@@ -89,6 +198,182 @@ class WordHandler(FileHandler):
             raise
 
 
+def detect_text_encoding(file_path: str, sample_size: int = 64 * 1024) -> str:
+    """Определяет кодировку текстового файла: UTF-8 (с BOM или без), иначе cp1251 (выгрузки из Windows)"""
+    with open(file_path, 'rb') as file:
+        sample = file.read(sample_size)
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    try:
+        # final=False: образец может обрываться посреди многобайтного символа
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "cp1251"
+
+
+class TextHandler(FileHandler):
+    """Обработчик текстовых файлов"""
+    
+    def iter_segments(self, file_path: str, part: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+        """Отдает абзацы (блоки строк, разделенные пустой строкой), читая файл построчно"""
+        try:
+            with open(file_path, 'r', encoding=detect_text_encoding(file_path), errors='replace') as file:
+                lines = []
+                paragraph_number = 0
+                for line in file:
+                    line = line.rstrip()
+                    if line.strip():
+                        lines.append(line)
+                        continue
+                    if lines:
+                        paragraph_number += 1
+                        yield {"text": "\n".join(lines).strip(), "kind": "paragraph", "paragraph": paragraph_number}
+                        lines = []
+                if lines:
+                    yield {"text": "\n".join(lines).strip(), "kind": "paragraph", "paragraph": paragraph_number + 1}
+        except Exception as e:
+            logger.error(f"Ошибка при обработке текстового файла {file_path}: {e}")
+            raise
+
+
+class CSVHandler(FileHandler):
+    """Обработчик CSV файлов"""
+    
+    def iter_segments(self, file_path: str, part: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Отдает строки таблицы (по одной записи на строку, как у листов Excel).
+        Первая непустая строка считается заголовком, разделитель определяется по началу файла.
+        """
+        try:
+            with open(file_path, 'r', encoding=detect_text_encoding(file_path), errors='replace', newline='') as file:
+                sample = file.read(64 * 1024)
+                file.seek(0)
+                try:
+                    dialect = csv.Sniffer().sniff(sample, delimiters=",;\t|")
+                except csv.Error:
+                    dialect = csv.excel
+                
+                header = None
+                rows_count = 0
+                reader = csv.reader(file, dialect)
+                for row in reader:
+                    cells = [cell.strip() for cell in row]
+                    if not any(cells):
+                        continue
+                    if header is None:
+                        header = cells
+                        continue
+                    rows_count += 1
+                    yield {
+                        "text": " | ".join(cells),
+                        "kind": "row",
+                        # Номер строки в файле, на которой закончилась запись (ячейки в кавычках бывают многострочными)
+                        "row": reader.line_num,
+                        "cells": cells,
+                        "header": header
+                    }
+                
+                # Файл из одной строки - сохраняем её как обычную строку
+                if header is not None and not rows_count:
+                    yield {"text": " | ".join(header), "kind": "row", "row": 1}
+        except Exception as e:
+            logger.error(f"Ошибка при обработке CSV файла {file_path}: {e}")
+            raise
+
+
+# Заголовок раздела Markdown (# ... ######) и разделитель заголовка таблицы (|---|:---:|)
+MARKDOWN_HEADING_PATTERN = re.compile(r'^#{1,6}\s+\S')
+MARKDOWN_TABLE_SEPARATOR_PATTERN = re.compile(r'^\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?$')
+
+
+class MarkdownHandler(FileHandler):
+    """Обработчик Markdown файлов"""
+    
+    def iter_segments(self, file_path: str, part: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Отдает разделы (заголовок вместе с текстом до следующего заголовка) и строки таблиц.
+        Строки таблицы - отдельные записи с подписями колонок из заголовка таблицы.
+        """
+        try:
+            with open(file_path, 'r', encoding=detect_text_encoding(file_path), errors='replace') as file:
+                section_lines = []
+                section_number = 0
+                table_number = 0
+                table_rows = []
+                in_code_block = False
+                
+                def flush_section():
+                    nonlocal section_lines
+                    text = "\n".join(section_lines).strip()
+                    section_lines = []
+                    if text:
+                        return {"text": text, "kind": "section", "section": section_number}
+                    return None
+                
+                def flush_table():
+                    nonlocal table_rows
+                    rows, table_rows = table_rows, []
+                    return self._table_segments(rows, table_number)
+                
+                for line_number, line in enumerate(file, start=1):
+                    line = line.rstrip()
+                    stripped = line.strip()
+                    
+                    if stripped.startswith("```"):
+                        in_code_block = not in_code_block
+                    is_table_row = not in_code_block and stripped.startswith("|")
+                    
+                    if table_rows and not is_table_row:
+                        yield from flush_table()
+                    
+                    if is_table_row:
+                        if not table_rows:
+                            segment = flush_section()
+                            if segment:
+                                yield segment
+                            table_number += 1
+                        table_rows.append((line_number, stripped))
+                        continue
+                    
+                    if not in_code_block and MARKDOWN_HEADING_PATTERN.match(stripped):
+                        segment = flush_section()
+                        if segment:
+                            yield segment
+                        section_number += 1
+                    section_lines.append(line)
+                
+                if table_rows:
+                    yield from flush_table()
+                segment = flush_section()
+                if segment:
+                    yield segment
+        except Exception as e:
+            logger.error(f"Ошибка при обработке Markdown файла {file_path}: {e}")
+            raise
+    
+    @staticmethod
+    def _table_segments(rows: List[tuple], table_number: int) -> Iterator[Dict[str, Any]]:
+        """Строки таблицы Markdown; первая строка - заголовок, если за ней идет разделитель"""
+        header = None
+        if len(rows) > 1 and MARKDOWN_TABLE_SEPARATOR_PATTERN.match(rows[1][1]):
+            header = [cell.strip() for cell in rows[0][1].strip("|").split("|")]
+            rows = rows[2:]
+        
+        for line_number, line in rows:
+            cells = [cell.strip() for cell in line.strip("|").split("|")]
+            if not any(cells):
+                continue
+            yield {
+                "text": " | ".join(cells),
+                "kind": "table_row",
+                "table": table_number,
+                "row": line_number,
+                "cells": cells,
+                "header": header
+            }
+
+
 class FileProcessor:
     """Основной класс для обработки файлов"""
     
@@ -98,7 +383,10 @@ class FileProcessor:
             'xlsx': ExcelHandler(),
             'xls': ExcelHandler(),
             'docx': WordHandler(),
-            'doc': WordHandler()
+            'doc': WordHandler(),
+            'txt': TextHandler(),
+            'csv': CSVHandler(),
+            'md': MarkdownHandler()
         }
     
     def get_handler(self, file_type: str) -> FileHandler:
@@ -116,6 +404,52 @@ class FileProcessor:
         handler = self.get_handler(file_type)
         return handler.extract_text(file_path)
     
+    def extract_segments(self, file_path: str, file_type: str) -> List[Dict[str, Any]]:
+        """Извлекает структурные сегменты файла используя соответствующий обработчик"""
+        return list(self.iter_segments(file_path, file_type))
+    
+    def iter_segments(self, file_path: str, file_type: str) -> Iterator[Dict[str, Any]]:
+        """
+        Потоково отдает структурные сегменты файла используя соответствующий обработчик.
+        Большие PDF и книги Excel извлекаются параллельно в пуле процессов (по частям, с сохранением порядка).
+        """
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"Файл не найден: {file_path}")
+        
+        handler = self.get_handler(file_type)
+        workers = RAGConfig.EXTRACTION_WORKERS
+        if workers > 1 and os.path.getsize(file_path) >= RAGConfig.PARALLEL_EXTRACTION_MIN_BYTES:
+            try:
+                parts = handler.plan_parts(file_path, workers)
+            except Exception as e:
+                logger.warning(f"Не удалось разделить файл {file_path} на части: {e}")
+                parts = []
+            if len(parts) > 1:
+                return self._iter_segments_parallel(file_path, file_type, parts, workers)
+        
+        return handler.iter_segments(file_path)
+    
+    def _iter_segments_parallel(self, file_path: str, file_type: str, parts: List[Dict[str, Any]],
+                                workers: int) -> Iterator[Dict[str, Any]]:
+        """Извлекает части файла в пуле процессов и отдает сегменты в исходном порядке"""
+        # billiard (из Celery) умеет создавать дочерние процессы из воркера prefork,
+        # multiprocessing в демонических процессах это запрещает
+        try:
+            from billiard.pool import Pool
+        except ImportError:
+            from multiprocessing import Pool
+        
+        logger.info(f"Параллельное извлечение {file_path}: {len(parts)} частей, {workers} процессов")
+        with Pool(processes=min(workers, len(parts))) as pool:
+            for segments in pool.imap(_extract_part, [(file_path, file_type, part) for part in parts]):
+                yield from segments
+    
     def get_supported_types(self) -> List[str]:
         """Возвращает список поддерживаемых типов файлов"""
         return list(self.handlers.keys())
+
+
+def _extract_part(args) -> List[Dict[str, Any]]:
+    """Извлекает сегменты одной части файла (выполняется в дочернем процессе)"""
+    file_path, file_type, part = args
+    return list(FileProcessor().get_handler(file_type).iter_segments(file_path, part))
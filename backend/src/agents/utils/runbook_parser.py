@@ -0,0 +1,103 @@
+import logging
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Tuple
+
+from ..services.alert_index import (
+    ALERT_CODE_PATTERN, MAX_NAME_LENGTH, MIN_NAME_LENGTH, normalize_alert_name
+)
+
+logger = logging.getLogger(__name__)
+
+# Подписи колонок таблицы регламента (сравниваются по вхождению, в нижнем регистре).
+# Порядок проверки важен: "Код алерта" - это код, а не название
+REACTION_COLUMNS = ("как реагировать", "реагирование", "реакция", "что делать", "действия", "reaction", "action")
+CODE_COLUMNS = ("код", "code")
+NAME_COLUMNS = ("наименование", "название", "алерт", "alert", "name")
+
+# Сегменты строк таблиц (Excel, CSV, таблицы Word и Markdown)
+ROW_KINDS = {"row", "table_row"}
+
+
+def _match_columns(header: List[str]) -> Optional[Dict[str, int]]:
+    """Находит колонки реакции, кода и названия алерта (None, если таблица - не регламент)"""
+    columns = {}
+    for i, title in enumerate(header):
+        title = (title or "").strip().lower()
+        if not title:
+            continue
+        for field, names in (("reaction", REACTION_COLUMNS), ("code", CODE_COLUMNS), ("name", NAME_COLUMNS)):
+            if field not in columns and any(name in title for name in names):
+                columns[field] = i
+                break
+
+    if "reaction" not in columns or not ({"code", "name"} & columns.keys()):
+        return None
+    return columns
+
+
+def _cell(cells: List[str], index: Optional[int]) -> str:
+    if index is None or index >= len(cells):
+        return ""
+    return (cells[index] or "").strip()
+
+
+def parse_runbook_row(cells: List[str], columns: Dict[str, int]) -> Optional[Dict[str, Any]]:
+    """Разбирает строку таблицы регламента в запись алерта (код, название, текст реакции)"""
+    reaction = _cell(cells, columns.get("reaction"))
+    if not reaction:
+        return None
+
+    code_cell = _cell(cells, columns.get("code"))
+    name_cell = _cell(cells, columns.get("name"))
+
+    # Код берем из своей колонки, иначе из начала названия ("z735 Инвалидные пакеты")
+    code_match = ALERT_CODE_PATTERN.search(code_cell) or ALERT_CODE_PATTERN.match(name_cell)
+    alert_code = code_match.group(1).lower() if code_match else None
+
+    name = name_cell
+    if code_match and not code_cell and name.lower().startswith(code_match.group(1).lower()):
+        name = name[len(code_match.group(1)):]
+    alert_name = normalize_alert_name(name) if name else None
+    if alert_name and not MIN_NAME_LENGTH <= len(alert_name) <= MAX_NAME_LENGTH:
+        alert_name = None
+
+    if not alert_code and not alert_name:
+        return None
+    return {
+        "alert_code": alert_code,
+        "alert_name": alert_name,
+        "title": name_cell or code_cell,
+        "reaction": reaction
+    }
+
+
+class RunbookParser:
+    """
+    Собирает записи алертов из строк таблиц регламентов по мере извлечения документа.
+    Сегменты пропускаются дальше без изменений (в чанкер), поэтому документ разбирается один раз.
+    """
+
+    def __init__(self):
+        self.records: List[Dict[str, Any]] = []
+        self._columns: Dict[Tuple[str, ...], Optional[Dict[str, int]]] = {}
+
+    def observe(self, segments: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        for segment in segments:
+            self._parse_segment(segment)
+            yield segment
+
+    def _parse_segment(self, segment: Dict[str, Any]):
+        header = segment.get("header")
+        cells = segment.get("cells")
+        if segment.get("kind") not in ROW_KINDS or not header or not cells:
+            return
+
+        key = tuple(header)
+        if key not in self._columns:
+            self._columns[key] = _match_columns(header)
+        columns = self._columns[key]
+        if columns is None:
+            return
+
+        record = parse_runbook_row(cells, columns)
+        if record:
+            self.records.append(record)
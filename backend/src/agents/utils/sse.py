@@ -0,0 +1,23 @@
+import json
+from typing import Any, AsyncIterator, Dict
+
+from fastapi.responses import StreamingResponse
+
+
+def format_sse_event(event: Dict[str, Any]) -> str:
+    """Форматирует событие анализа как Server-Sent Event: тип события и JSON с остальными полями"""
+    data = {key: value for key, value in event.items() if key != "event"}
+    return f"event: {event['event']}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def sse_response(events: AsyncIterator[Dict[str, Any]]) -> StreamingResponse:
+    """Ответ text/event-stream (буферизация nginx отключена, чтобы токены доходили сразу)"""
+    async def stream():
+        async for event in events:
+            yield format_sse_event(event)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -14,6 +14,7 @@ celery_app = Celery(
         "src.tasks.subscription_tasks",
         "src.tasks.document_tasks",
         "src.tasks.telegram_alert_tasks",
+        "src.tasks.vector_store_tasks",
     ]
 )
 
@@ -69,6 +70,13 @@ celery_app.conf.update(
             "task": "subscription_tasks.deactivate_expired_subscriptions",
             "schedule": crontab(hour=0, minute=10),
             "options": {"queue": "subscription_management"}
+        },
+        
+        # Очистка кэша извлечения от удаленных документов каждый день в 3:30
+        "prune-extraction-cache-daily": {
+            "task": "document_tasks.prune_extraction_cache",
+            "schedule": crontab(hour=3, minute=30),
+            "options": {"queue": "default"}
         }
     }
 )
@@ -100,10 +108,20 @@ celery_app.conf.task_routes = {
     "subscription_tasks.*": {"queue": "default"},
     
     # Документы
-    "document_tasks.process_document_task": {"queue": "default"},
-    "document_tasks.delete_document_from_vector_store_task": {"queue": "default"},
+    "document_tasks.process_document": {"queue": "document_processing"},
+    "document_tasks.process_documents_batch": {"queue": "document_processing"},
+    "document_tasks.delete_document_from_vector_store": {"queue": "default"},
+    "document_tasks.prune_extraction_cache": {"queue": "default"},
     "document_tasks.*": {"queue": "default"},
     
+    # Векторная БД
+    "vector_store_tasks.migrate_to_shared_layout": {"queue": "default"},
+    # Переиндексация выполняется воркером документов, а не основным воркером с алертами
+    "vector_store_tasks.reindex_agent": {"queue": "document_processing"},
+    "vector_store_tasks.reindex_all_agents": {"queue": "default"},
+    "vector_store_tasks.drop_collection_generation": {"queue": "default"},
+    "vector_store_tasks.*": {"queue": "default"},
+    
     # Telegram алерты
     "telegram_alert_tasks.process_telegram_alert_task": {"queue": "telegram_notifications"},
     "telegram_alert_tasks.*": {"queue": "telegram_notifications"},
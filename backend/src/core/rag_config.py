@@ -0,0 +1,105 @@
+import os
+
+
+class RAGConfig:
+    """Конфигурация для базы знаний агентов (чанкинг, векторная БД)"""
+
+    # Настройки чанкинга документов
+    CHUNK_SIZE: int = int(os.getenv("RAG_CHUNK_SIZE", "1000"))  # Максимальный размер чанка в символах
+    CHUNK_OVERLAP: int = int(os.getenv("RAG_CHUNK_OVERLAP", "150"))  # Перекрытие соседних чанков
+
+    # Пул клиентов ChromaDB: максимум одновременно открытых векторных БД и время простоя до закрытия
+    CHROMA_MAX_CLIENTS: int = int(os.getenv("RAG_CHROMA_MAX_CLIENTS", "256"))
+    CHROMA_CLIENT_IDLE_TTL: int = int(os.getenv("RAG_CHROMA_CLIENT_IDLE_TTL", "1800"))  # секунды
+
+    # Загрузка документов: максимальный размер файла и размер части при копировании в папку агента
+    UPLOAD_MAX_SIZE_MB: int = int(os.getenv("RAG_UPLOAD_MAX_SIZE_MB", "50"))
+    UPLOAD_CHUNK_SIZE: int = int(os.getenv("RAG_UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+    # Массовая загрузка: максимум документов за раз и размер архива
+    BULK_MAX_FILES: int = int(os.getenv("RAG_BULK_MAX_FILES", "500"))
+    BULK_MAX_ARCHIVE_SIZE_MB: int = int(os.getenv("RAG_BULK_MAX_ARCHIVE_SIZE_MB", "500"))
+    # Суммарный размер распакованных файлов архива (защита от zip-бомб)
+    BULK_MAX_EXTRACTED_SIZE_MB: int = int(os.getenv("RAG_BULK_MAX_EXTRACTED_SIZE_MB", "2000"))
+
+    # Кэш извлеченных сегментов документов (сжатый JSONL по хэшу содержимого в docs/extracted)
+    EXTRACTION_CACHE_ENABLED: bool = os.getenv("RAG_EXTRACTION_CACHE_ENABLED", "true").lower() == "true"
+
+    # Параллельное извлечение текста: число процессов (1 - выключено), минимальный размер файла
+    # и минимальное число страниц PDF в одной части
+    EXTRACTION_WORKERS: int = int(os.getenv("RAG_EXTRACTION_WORKERS", str(min(4, os.cpu_count() or 1))))
+    PARALLEL_EXTRACTION_MIN_BYTES: int = int(os.getenv("RAG_PARALLEL_EXTRACTION_MIN_BYTES", str(2 * 1024 * 1024)))
+    PARALLEL_EXTRACTION_MIN_PAGES: int = int(os.getenv("RAG_PARALLEL_EXTRACTION_MIN_PAGES", "20"))
+
+    # Режим хранения: per_agent - отдельная векторная БД на каждого агента,
+    # shared - общие коллекции (шарды по agent_id) с фильтрацией по метаданным user_id/agent_id
+    VECTOR_STORE_MODE: str = os.getenv("RAG_VECTOR_STORE_MODE", "per_agent").lower()
+    SHARED_SHARDS: int = int(os.getenv("RAG_SHARED_SHARDS", "8"))
+
+    # Модель эмбеддингов (та же all-MiniLM-L6-v2, что у ChromaDB по умолчанию - старые коллекции совместимы)
+    EMBEDDING_MODEL: str = os.getenv("RAG_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+    EMBEDDING_DEVICE: str = os.getenv("RAG_EMBEDDING_DEVICE", "cpu")
+    # Максимум текстов в одном проходе модели и время ожидания других запросов для объединения в пачку
+    EMBEDDING_BATCH_SIZE: int = int(os.getenv("RAG_EMBEDDING_BATCH_SIZE", "64"))
+    EMBEDDING_MAX_WAIT_MS: int = int(os.getenv("RAG_EMBEDDING_MAX_WAIT_MS", "10"))
+    EMBEDDING_TIMEOUT: int = int(os.getenv("RAG_EMBEDDING_TIMEOUT", "300"))  # секунды
+
+    # Кэш эмбеддингов по хэшу содержимого чанка (SQLite в директории векторных БД)
+    EMBEDDING_CACHE_ENABLED: bool = os.getenv("RAG_EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+    EMBEDDING_CACHE_MAX_ENTRIES: int = int(os.getenv("RAG_EMBEDDING_CACHE_MAX_ENTRIES", "1000000"))
+    # Очистка старых записей (COUNT по всей таблице) - раз в столько сохраненных векторов
+    EMBEDDING_CACHE_PRUNE_INTERVAL: int = int(os.getenv("RAG_EMBEDDING_CACHE_PRUNE_INTERVAL", "5000"))
+
+    # Потоки для поиска из async кода (API): максимум одновременных запросов к ChromaDB в процессе
+    SEARCH_THREADS: int = int(os.getenv("RAG_SEARCH_THREADS", "8"))
+
+    # Размер пачки записей при записи в ChromaDB
+    UPSERT_BATCH_SIZE: int = int(os.getenv("RAG_UPSERT_BATCH_SIZE", "500"))
+
+    # Буквы-префиксы кодов алертов (z735, c217): только такие токены считаются кодами
+    ALERT_CODE_PREFIXES: str = os.getenv("RAG_ALERT_CODE_PREFIXES", "zc")
+
+    # Ответ на алерт прямо из записей регламента (строки таблиц "Как реагировать"), без вызова LLM
+    RUNBOOK_DIRECT_ANSWERS: bool = os.getenv("RAG_RUNBOOK_DIRECT_ANSWERS", "true").lower() == "true"
+
+    # Объединение одинаковых одновременных анализов алертов (один алерт пришел в несколько чатов):
+    # генерация выполняется один раз, остальные задачи ждут ее результат через Redis.
+    # Блокировка должна пережить поиск и генерацию, результат хранится только для ожидающих задач
+    ALERT_SINGLE_FLIGHT_ENABLED: bool = os.getenv("RAG_ALERT_SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+    ALERT_SINGLE_FLIGHT_LOCK_TTL: int = int(os.getenv("RAG_ALERT_SINGLE_FLIGHT_LOCK_TTL", "180"))  # секунды
+    ALERT_SINGLE_FLIGHT_WAIT: int = int(os.getenv("RAG_ALERT_SINGLE_FLIGHT_WAIT", "180"))  # секунды
+    ALERT_SINGLE_FLIGHT_RESULT_TTL: int = int(os.getenv("RAG_ALERT_SINGLE_FLIGHT_RESULT_TTL", "30"))  # секунды
+
+    # Переиндексация: документов в одной пачке записи в теневую коллекцию и пауза между пачками,
+    # чтобы переиндексация всех агентов не отнимала CPU у обработки алертов
+    REINDEX_BATCH_DOCUMENTS: int = int(os.getenv("RAG_REINDEX_BATCH_DOCUMENTS", "20"))
+    REINDEX_BATCH_PAUSE_MS: int = int(os.getenv("RAG_REINDEX_BATCH_PAUSE_MS", "500"))
+    # Через сколько секунд после переключения удаляется старая коллекция (дожидаемся начатых запросов)
+    REINDEX_DROP_DELAY: int = int(os.getenv("RAG_REINDEX_DROP_DELAY", "600"))
+    REINDEX_TIME_LIMIT: int = int(os.getenv("RAG_REINDEX_TIME_LIMIT", str(6 * 60 * 60)))  # секунды
+
+    # Кэш результатов поиска: memory (в процессе) или redis (общий для всех воркеров)
+    SEARCH_CACHE_BACKEND: str = os.getenv("RAG_SEARCH_CACHE_BACKEND", "memory").lower()
+    # Инвалидация точная (по поколению коллекции), поэтому TTL может быть большим
+    SEARCH_CACHE_TTL: int = int(os.getenv("RAG_SEARCH_CACHE_TTL", "3600"))  # секунды
+    SEARCH_CACHE_MAX_ENTRIES: int = int(os.getenv("RAG_SEARCH_CACHE_MAX_ENTRIES", "2000"))
+    SEARCH_CACHE_MAX_BYTES: int = int(os.getenv("RAG_SEARCH_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    SEARCH_CACHE_MAX_ENTRY_BYTES: int = int(os.getenv("RAG_SEARCH_CACHE_MAX_ENTRY_BYTES", str(1024 * 1024)))
+
+    # Кэш ответов LLM на повторяющиеся алерты: redis (общий для воркеров Celery и API) или memory.
+    # Записи удаляются явно при изменении документов и промпта агента, TTL ограничивает объем
+    RESPONSE_CACHE_ENABLED: bool = os.getenv("RAG_RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+    RESPONSE_CACHE_BACKEND: str = os.getenv("RAG_RESPONSE_CACHE_BACKEND", "redis").lower()
+    RESPONSE_CACHE_TTL: int = int(os.getenv("RAG_RESPONSE_CACHE_TTL", str(24 * 60 * 60)))  # секунды
+    RESPONSE_CACHE_MAX_ENTRIES: int = int(os.getenv("RAG_RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+    RESPONSE_CACHE_MAX_BYTES: int = int(os.getenv("RAG_RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+    # Ограничение одновременных запросов к Ollama для всех воркеров (очередь в Redis; 0 - без ограничения).
+    # Аренда слота истекает, если процесс упал во время генерации
+    LLM_MAX_CONCURRENCY: int = int(os.getenv("RAG_LLM_MAX_CONCURRENCY", "2"))
+    LLM_SLOT_LEASE_TTL: int = int(os.getenv("RAG_LLM_SLOT_LEASE_TTL", "300"))  # секунды
+    # Сколько запрос может ждать слот (секунды) по приоритетам: алерты > анализ из интерфейса > проверка подключения.
+    # Ожидание алерта меньше блокировки объединения одинаковых алертов (ALERT_SINGLE_FLIGHT_LOCK_TTL)
+    LLM_ALERT_DEADLINE: int = int(os.getenv("RAG_LLM_ALERT_DEADLINE", "110"))
+    LLM_INTERACTIVE_DEADLINE: int = int(os.getenv("RAG_LLM_INTERACTIVE_DEADLINE", "60"))
+    LLM_HEALTH_CHECK_DEADLINE: int = int(os.getenv("RAG_LLM_HEALTH_CHECK_DEADLINE", "5"))
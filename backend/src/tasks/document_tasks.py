@@ -1,24 +1,30 @@
+import os
 import logging
 import asyncio
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Callable
 from sqlalchemy.ext.asyncio import AsyncSession
-from src.core.orm.database import get_async_session
+from src.core.orm.database import AsyncSessionLocal
 from src.agents.services.document_processor import DocumentProcessor
 from src.agents.services.agent_service import AgentService
+from src.agents.services.ollama_service import OllamaService
 from src.agents.repositories.document import DocumentRepository
+from src.agents.repositories.runbook_record import RunbookRecordRepository
+from src.agents.utils.runbook_parser import RunbookParser
 from src.core.celery_app import celery_app
+from src.core.rag_config import RAGConfig
 
 logger = logging.getLogger(__name__)
 
 
-@celery_app.task(bind=True, name="process_document")
+@celery_app.task(bind=True, name="document_tasks.process_document")
 def process_document_task(
     self, 
     document_id: int, 
     user_id: int, 
     agent_id: int, 
     file_path: str, 
-    filename: str
+    filename: str,
+    content_hash: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     Celery задача для обработки документа в векторную БД.
@@ -30,6 +36,7 @@ def process_document_task(
         agent_id: ID агента
         file_path: Путь к файлу
         filename: Имя файла
+        content_hash: Хэш содержимого файла (ключ кэша извлечения)
         
     Returns:
         Результат обработки документа
@@ -46,9 +53,14 @@ def process_document_task(
         try:
             # Выполняем асинхронную задачу
             result = loop.run_until_complete(_process_document_async(
-                document_id, user_id, agent_id, file_path, filename
+                document_id, user_id, agent_id, file_path, filename, content_hash,
+                progress=lambda stage, **meta: self.update_state(
+                    state="PROGRESS", meta={"stage": stage, "document_id": document_id, **meta}
+                )
             ))
         finally:
+            # HTTP клиент Ollama привязан к циклу задачи - закрываем вместе с ним
+            loop.run_until_complete(OllamaService.aclose())
             loop.close()
         
         logger.info(f"Document processing task {task_id} completed successfully")
@@ -64,15 +76,54 @@ def process_document_task(
         }
 
 
+def dispatch_document_processing(document_id: int, user_id: int, agent_id: int,
+                                 file_path: str, filename: str, content_hash: Optional[str] = None) -> str:
+    """Ставит документ в очередь обработки (document_processing) и возвращает ID задачи"""
+    task = process_document_task.delay(document_id, user_id, agent_id, file_path, filename, content_hash)
+    logger.info(f"Document {document_id} queued for processing, task {task.id}")
+    return task.id
+
+
+async def prepare_document_retry(document_repo: DocumentRepository, document, upload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Повторная загрузка файла, обработка которого не завершилась (ошибка, упавший воркер):
+    документ обрабатывается снова. Его файл переиспользуется, если он на месте, иначе документ
+    переключается на только что загруженный. Возвращает данные для постановки в очередь
+    """
+    if os.path.exists(document.file_path):
+        os.remove(upload["file_path"])
+        file_path = document.file_path
+    else:
+        await document_repo.update_file(document.id, upload["file_path"], upload["file_size"], upload["content_hash"])
+        file_path = upload["file_path"]
+    logger.info(f"Document {document.id} was not processed, queueing it again")
+    return {"document_id": document.id, "file_path": file_path, "filename": document.filename,
+            "content_hash": upload["content_hash"]}
+
+
+def get_document_job_status(job_id: str) -> Dict[str, Any]:
+    """Возвращает состояние задачи обработки документа из result backend"""
+    result = celery_app.AsyncResult(job_id)
+    status = {"job_id": job_id, "state": result.state}
+    if result.state == "PROGRESS":
+        status.update(result.info or {})
+    elif result.ready():
+        status["result"] = result.result if isinstance(result.result, dict) else {"error": str(result.result)}
+    return status
+
+
 async def _process_document_async(
     document_id: int, 
     user_id: int, 
     agent_id: int, 
     file_path: str, 
-    filename: str
+    filename: str,
+    content_hash: Optional[str] = None,
+    progress: Optional[Callable[..., None]] = None
 ) -> Dict[str, Any]:
-    """Асинхронная часть обработки документа"""
-    async with get_async_session() as db:
+    """Асинхронная часть обработки документа (progress - колбэк для статуса задачи)"""
+    progress = progress or (lambda stage, **meta: None)
+    async with AsyncSessionLocal() as db:
         try:
             # Создаем сервисы
             document_processor = DocumentProcessor()
@@ -81,12 +132,25 @@ async def _process_document_async(
             
             logger.info(f"Processing document {filename} for user {user_id}, agent {agent_id}")
             
-            # Извлекаем текст из документа
+            # Документ могли удалить, пока задача ждала в очереди
+            if await document_repo.get_by_id(document_id) is None:
+                logger.warning(f"Document {document_id} was deleted before processing, skipping")
+                return {
+                    "success": False,
+                    "error": "Документ удален до обработки",
+                    "document_id": document_id
+                }
+            
+            # Извлекаем текст из документа и разбиваем его на чанки
+            progress("extracting")
             try:
                 file_type = filename.split('.')[-1].lower()
-                extracted_text = document_processor.extract_text(file_path, file_type)
+                runbook_parser = RunbookParser()
+                chunks = document_processor.extract_chunks(
+                    file_path, file_type, content_hash, runbook_parser=runbook_parser
+                )
                 
-                if not extracted_text.strip():
+                if not chunks:
                     logger.warning(f"No text extracted from {filename}")
                     return {
                         "success": False,
@@ -94,7 +158,8 @@ async def _process_document_async(
                         "document_id": document_id
                     }
                 
-                logger.info(f"Extracted {len(extracted_text)} characters from {filename}")
+                text_length = sum(len(chunk['text']) for chunk in chunks)
+                logger.info(f"Extracted {len(chunks)} chunks ({text_length} characters) from {filename}")
                 
             except Exception as e:
                 logger.error(f"Error extracting text from {filename}: {e}")
@@ -105,22 +170,35 @@ async def _process_document_async(
                 }
             
             # Добавляем документ в векторную БД
+            progress("indexing", chunks_count=len(chunks))
             try:
                 # Подготавливаем данные для добавления
                 doc_data = {
                     'id': str(document_id),
-                    'text': extracted_text,
+                    'chunks': chunks,
                     'filename': filename,
                     'file_type': file_type,
                     'uploaded_at': str(document_id)  # Используем document_id как timestamp
                 }
                 
-                # Добавляем в векторную БД
-                success = agent_service.vector_store.add_documents(user_id, agent_id, [doc_data])
+                # Добавляем в векторную БД (или обновляем на месте, если документ уже обрабатывался)
+                result = agent_service.vector_store.update_document(user_id, agent_id, doc_data)
                 
-                if success:
-                    # Обновляем статус документа в БД
-                    await document_repo.update_processed_status(document_id, True)
+                if result is not None:
+                    # Обновляем статус документа в БД. Документ могли удалить во время обработки:
+                    # удаление из векторной БД тогда могло пройти раньше записи - убираем записанные чанки
+                    if await document_repo.update_processed_status(document_id, True) is None:
+                        removed = agent_service.vector_store.delete_document(user_id, agent_id, document_id)
+                        logger.warning(f"Document {document_id} was deleted during processing, "
+                                       f"{removed} chunks removed from vector store")
+                        return {
+                            "success": False,
+                            "error": "Документ удален во время обработки",
+                            "document_id": document_id
+                        }
+                    runbook_records = await _save_runbook_records(
+                        db, document_id, agent_id, user_id, runbook_parser.records
+                    )
                     
                     logger.info(f"Document {filename} successfully added to vector store")
                     
@@ -128,7 +206,12 @@ async def _process_document_async(
                         "success": True,
                         "message": f"Документ {filename} успешно обработан",
                         "document_id": document_id,
-                        "text_length": len(extracted_text)
+                        "text_length": text_length,
+                        "chunks_count": len(chunks),
+                        "chunks_added": result["added"],
+                        "chunks_removed": result["removed"],
+                        "chunks_unchanged": result["unchanged"],
+                        "runbook_records": runbook_records
                     }
                 else:
                     logger.error(f"Failed to add document {filename} to vector store")
@@ -155,7 +238,162 @@ async def _process_document_async(
             }
 
 
-@celery_app.task(bind=True, name="delete_document_from_vector_store")
+async def _save_runbook_records(db, document_id: int, agent_id: int, user_id: int,
+                                records: List[Dict[str, Any]]) -> int:
+    """Сохраняет записи регламента документа (ошибка не прерывает обработку - остается поиск через LLM)"""
+    try:
+        saved = await RunbookRecordRepository(db).replace_for_document(document_id, agent_id, user_id, records)
+        if saved:
+            logger.info(f"Document {document_id}: {saved} runbook records saved")
+        return saved
+    except Exception as e:
+        logger.error(f"Error saving runbook records for document {document_id}: {e}")
+        await db.rollback()
+        return 0
+
+
+@celery_app.task(bind=True, name="document_tasks.process_documents_batch")
+def process_documents_batch_task(
+    self,
+    user_id: int,
+    agent_id: int,
+    documents: List[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """
+    Celery задача для массовой загрузки документов в векторную БД.
+    Чанки нескольких документов записываются общими пачками (одна запись в коллекцию
+    и одно обновление индекса алертов на пачку, а не на каждый файл).
+    
+    Args:
+        user_id: ID пользователя
+        agent_id: ID агента
+        documents: Документы [{'document_id', 'file_path', 'filename'}]
+        
+    Returns:
+        Результат обработки
+    """
+    task_id = self.request.id
+    logger.info(f"Starting batch processing task {task_id} for {len(documents)} documents")
+    
+    try:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        
+        try:
+            result = loop.run_until_complete(_process_documents_batch_async(
+                user_id, agent_id, documents,
+                progress=lambda stage, **meta: self.update_state(state="PROGRESS", meta={"stage": stage, **meta})
+            ))
+        finally:
+            loop.run_until_complete(OllamaService.aclose())
+            loop.close()
+        
+        logger.info(f"Batch processing task {task_id} completed: {result['processed']} processed, {len(result['failed'])} failed")
+        return result
+        
+    except Exception as e:
+        logger.error(f"Error in batch processing task {task_id}: {e}")
+        return {
+            "task_id": task_id,
+            "success": False,
+            "error": str(e)
+        }
+
+
+def dispatch_documents_batch(user_id: int, agent_id: int, documents: List[Dict[str, Any]]) -> str:
+    """Ставит пачку документов в очередь обработки (document_processing) и возвращает ID задачи"""
+    task = process_documents_batch_task.delay(user_id, agent_id, documents)
+    logger.info(f"{len(documents)} documents queued for batch processing, task {task.id}")
+    return task.id
+
+
+async def _process_documents_batch_async(
+    user_id: int,
+    agent_id: int,
+    documents: List[Dict[str, Any]],
+    progress: Optional[Callable[..., None]] = None
+) -> Dict[str, Any]:
+    """Асинхронная часть массовой обработки документов"""
+    progress = progress or (lambda stage, **meta: None)
+    document_processor = DocumentProcessor()
+    agent_service = AgentService()
+    
+    processed_ids = []
+    failed = []
+    pending = []
+    pending_chunks = 0
+    runbook_records = {}
+    
+    def flush():
+        nonlocal pending, pending_chunks
+        if not pending:
+            return
+        if agent_service.vector_store.add_documents(user_id, agent_id, pending):
+            processed_ids.extend(int(doc['id']) for doc in pending)
+        else:
+            failed.extend({"document_id": int(doc['id']), "error": "Не удалось добавить документ в векторную БД"}
+                          for doc in pending)
+        pending, pending_chunks = [], 0
+    
+    for position, document in enumerate(documents):
+        progress("extracting", done=position, total=len(documents))
+        filename = document['filename']
+        file_type = filename.split('.')[-1].lower()
+        runbook_parser = RunbookParser()
+        try:
+            chunks = document_processor.extract_chunks(
+                document['file_path'], file_type, document.get('content_hash'), runbook_parser=runbook_parser
+            )
+        except Exception as e:
+            logger.error(f"Error extracting text from {filename}: {e}")
+            failed.append({"document_id": document['document_id'], "error": f"Ошибка извлечения текста: {str(e)}"})
+            continue
+        
+        if not chunks:
+            failed.append({"document_id": document['document_id'], "error": "Не удалось извлечь текст из документа"})
+            continue
+        
+        runbook_records[document['document_id']] = runbook_parser.records
+        pending.append({
+            'id': str(document['document_id']),
+            'chunks': chunks,
+            'filename': filename,
+            'file_type': file_type,
+            'uploaded_at': str(document['document_id'])
+        })
+        pending_chunks += len(chunks)
+        if pending_chunks >= RAGConfig.UPSERT_BATCH_SIZE:
+            progress("indexing", done=position + 1, total=len(documents))
+            flush()
+    
+    progress("indexing", done=len(documents), total=len(documents))
+    flush()
+    
+    async with AsyncSessionLocal() as db:
+        document_repo = DocumentRepository(db)
+        await document_repo.update_processed_status_many(processed_ids, True)
+        
+        # Документы, удаленные во время обработки: их чанки могли быть записаны уже после удаления
+        existing_ids = await document_repo.get_existing_ids(processed_ids)
+        deleted_ids = [document_id for document_id in processed_ids if document_id not in existing_ids]
+        if deleted_ids:
+            removed = agent_service.vector_store.delete_documents(user_id, agent_id, deleted_ids)
+            logger.warning(f"Documents {deleted_ids} were deleted during processing, "
+                           f"{removed} chunks removed from vector store")
+            processed_ids = [document_id for document_id in processed_ids if document_id in existing_ids]
+        
+        for document_id in processed_ids:
+            await _save_runbook_records(db, document_id, agent_id, user_id, runbook_records.get(document_id, []))
+    
+    return {
+        "success": not failed,
+        "processed": len(processed_ids),
+        "processed_ids": processed_ids,
+        "failed": failed
+    }
+
+
+@celery_app.task(bind=True, name="document_tasks.delete_document_from_vector_store")
 def delete_document_from_vector_store_task(
     self, 
     user_id: int, 
@@ -187,6 +425,7 @@ def delete_document_from_vector_store_task(
                 user_id, agent_id, document_metadata
             ))
         finally:
+            loop.run_until_complete(OllamaService.aclose())
             loop.close()
         
         logger.info(f"Document deletion task {task_id} completed")
@@ -210,21 +449,23 @@ async def _delete_document_from_vector_store_async(
     try:
         agent_service = AgentService()
         
-        # Удаляем документ из векторной БД
-        success = True
-        
-        if success:
-            logger.info(f"Document successfully removed from vector store")
-            return {
-                "success": True,
-                "message": "Документ успешно удален из векторной БД"
-            }
-        else:
-            logger.error(f"Failed to remove document from vector store")
+        # Удаляем все чанки документа (по метаданным document_id)
+        document_id = document_metadata.get("document_id") or document_metadata.get("id")
+        if document_id is None:
             return {
                 "success": False,
-                "error": "Не удалось удалить документ из векторной БД"
+                "error": "Не указан document_id"
             }
+        
+        removed = agent_service.vector_store.delete_document(user_id, agent_id, document_id)
+        
+        logger.info(f"Document {document_id} removed from vector store ({removed} chunks)")
+        return {
+            "success": True,
+            "message": "Документ успешно удален из векторной БД",
+            "document_id": document_id,
+            "chunks_removed": removed
+        }
             
     except Exception as e:
         logger.error(f"Error removing document from vector store: {e}")
@@ -232,3 +473,27 @@ async def _delete_document_from_vector_store_async(
             "success": False,
             "error": str(e)
         }
+
+
+@celery_app.task(bind=True, name="document_tasks.prune_extraction_cache")
+def prune_extraction_cache_task(self) -> Dict[str, Any]:
+    """Celery задача: удаляет из кэша извлечения сегменты документов, которых больше нет"""
+    document_processor = DocumentProcessor()
+    if document_processor.extraction_cache is None:
+        return {"success": True, "removed": 0}
+    
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        keep = loop.run_until_complete(_get_content_keys())
+    finally:
+        loop.close()
+    
+    removed = document_processor.extraction_cache.prune(keep)
+    logger.info(f"Extraction cache pruned: {removed} files removed, {len(keep)} documents kept")
+    return {"success": True, "removed": removed}
+
+
+async def _get_content_keys() -> set:
+    async with AsyncSessionLocal() as db:
+        return await DocumentRepository(db).get_content_keys()
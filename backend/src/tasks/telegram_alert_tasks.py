@@ -1,7 +1,8 @@
 import logging
 import asyncio
 import re
-from typing import Dict, Any, List
+import time
+from typing import Dict, Any, List, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from src.core.orm.database import AsyncSessionLocal, SessionLocal
@@ -14,6 +15,11 @@ from src.agents.models.telegram_config import TelegramConfig
 from src.agents.models.agent import Agent
 from src.agents.services.vector_store import VectorStore
 from src.agents.services.ollama_service import OllamaService
+from src.agents.repositories.runbook_record import build_runbook_lookup, pick_runbook_match
+from src.agents.services.single_flight import SingleFlight, build_alert_flight_key
+from src.agents.services.response_cache import get_response_cache
+from src.agents.services.llm_scheduler import LLMPriority
+from src.core.rag_config import RAGConfig
 from src.core.config import settings
 import requests
 
@@ -23,6 +29,15 @@ logger = logging.getLogger(__name__)
 telegram_service = TelegramService()
 agent_service = AgentService()
 
+# Один и тот же алерт часто приходит сразу в несколько отслеживаемых чатов -
+# анализ выполняется один раз, остальные задачи получают его результат
+alert_analysis_flight = SingleFlight(
+    "alert_analysis",
+    lock_ttl=RAGConfig.ALERT_SINGLE_FLIGHT_LOCK_TTL,
+    wait_timeout=RAGConfig.ALERT_SINGLE_FLIGHT_WAIT,
+    result_ttl=RAGConfig.ALERT_SINGLE_FLIGHT_RESULT_TTL
+) if RAGConfig.ALERT_SINGLE_FLIGHT_ENABLED else None
+
 
 def _extract_alert_keywords(user_text: str) -> List[str]:
     """Извлекает ключевые слова из текста алерта"""
@@ -146,7 +161,8 @@ def _process_telegram_alert_sync(
                     analysis_result = _analyze_with_agent_sync_simple(
                         telegram_config.agent_id,
                         telegram_config.user_id,
-                        alert_context
+                        alert_context,
+                        alert_text=message_text
                     )
                     
                     if analysis_result and analysis_result.get("response"):
@@ -220,12 +236,35 @@ def _process_telegram_alert_sync(
             }
 
 
+def _find_runbook_record_sync(db: Session, agent_id: int, user_id: int, text: str):
+    """Ищет запись регламента, точно соответствующую алерту (синхронная сессия)"""
+    if not RAGConfig.RUNBOOK_DIRECT_ANSWERS:
+        return None
+    try:
+        statement = build_runbook_lookup(agent_id, user_id, text)
+        if statement is None:
+            return None
+        record = pick_runbook_match(db.execute(statement).scalars().all(), text)
+        if record is not None:
+            logger.info(f"Alert found in runbook records of agent {agent_id}: '{record.title[:100]}'")
+        return record
+    except Exception as e:
+        logger.error(f"Error looking up runbook records: {e}")
+        db.rollback()
+        return None
+
+
 def _analyze_with_agent_sync_simple(
     agent_id: int,
     user_id: int,
-    text: str
+    text: str,
+    alert_text: Optional[str] = None
 ) -> Dict[str, Any]:
-    """Анализирует текст через ИИ агента (полностью синхронная версия)"""
+    """
+    Анализирует текст через ИИ агента (полностью синхронная версия).
+    alert_text - исходный текст алерта без данных чата: по нему одинаковые одновременные
+    анализы объединяются в один
+    """
     try:
         # Создаем сервисы
         vector_store = VectorStore()
@@ -240,39 +279,86 @@ def _analyze_with_agent_sync_simple(
             if not agent:
                 return {"response": "Агент не найден"}
             
-            # Выполняем поиск в векторной БД
-            logger.info(f"Searching vector database for agent {agent_id}, user {user_id}")
-            similar_docs = vector_store.search_similar(
-                user_id=user_id,
-                agent_id=agent_id,
-                query=text,
-                n_results=3
-            )
-            
-            logger.info(f"Found {len(similar_docs)} similar documents")
-            
-            # Формируем контекст
-            context = ""
-            if similar_docs:
-                context = "\n\n".join([doc.get("text", "") for doc in similar_docs])
-                logger.info(f"Context length: {len(context)} characters")
-                logger.info(f"First document preview: {similar_docs[0].get('text', '')[:200]}...")
+            # Алерт есть в таблице регламента - отвечаем текстом реакции без поиска и LLM
+            runbook_record = _find_runbook_record_sync(db, agent_id, user_id, text)
+            if runbook_record is not None:
+                from src.agents.models.agent_log import AgentLog
+                db.add(AgentLog(
+                    agent_id=agent_id,
+                    user_id=user_id,
+                    text_analyzed=text,
+                    response=runbook_record.reaction,
+                    processing_time=0.0,
+                    text_length=len(text),
+                    documents_used=1
+                ))
+                db.commit()
+                return {"response": runbook_record.reaction}
+            
+            def generate() -> Dict[str, Any]:
+                # Выполняем поиск в векторной БД
+                logger.info(f"Searching vector database for agent {agent_id}, user {user_id}")
+                similar_docs = vector_store.search_similar(
+                    user_id=user_id,
+                    agent_id=agent_id,
+                    query=text,
+                    n_results=3
+                )
+                
+                logger.info(f"Found {len(similar_docs)} similar documents")
+                
+                # Формируем контекст
+                context = ""
+                if similar_docs:
+                    context = "\n\n".join([doc.get("text", "") for doc in similar_docs])
+                    logger.info(f"Context length: {len(context)} characters")
+                    logger.info(f"First document preview: {similar_docs[0].get('text', '')[:200]}...")
+                else:
+                    logger.warning("No similar documents found")
+                
+                # Генерируем ответ через LLM (используем тот же подход, что и на фронтенде)
+                logger.info("Generating response with LLM")
+                logger.info(f"Context preview: {context[:500]}...")
+                logger.info(f"User text: {text[:200]}...")
+                
+                # Повторный алерт с теми же документами - ответ из кэша без вызова LLM
+                response_cache = get_response_cache()
+                cache_key = response_cache.build_key(
+                    agent_id, user_id, ollama_service.model_name, agent.prompt, similar_docs, alert_text or text
+                ) if response_cache is not None else None
+                if cache_key:
+                    response = response_cache.get(cache_key)
+                    if response is not None:
+                        logger.info(f"Response for agent {agent_id} found in LLM response cache")
+                        return {"response": response, "documents_used": len(similar_docs)}
+                
+                # Используем промпт агента, как на фронтенде
+                generation_start = time.time()
+                response = ollama_service.generate_response(
+                    prompt=agent.prompt,
+                    context=context,
+                    user_text=text,
+                    priority=LLMPriority.ALERT
+                )
+                if cache_key:
+                    response_cache.set(cache_key, response, time.time() - generation_start)
+                
+                logger.info(f"Generated response: {response[:100]}...")
+                
+                return {"response": response, "documents_used": len(similar_docs)}
+            
+            if alert_analysis_flight is not None:
+                # Одинаковые алерты агента пользователя при неизменной базе знаний дают одинаковый ответ
+                flight_key = build_alert_flight_key(
+                    user_id,
+                    agent_id,
+                    alert_text or text,
+                    vector_store.get_collection_version(user_id, agent_id)
+                )
+                result = alert_analysis_flight.run(flight_key, generate)
             else:
-                logger.warning("No similar documents found")
-            
-            # Генерируем ответ через LLM (используем тот же подход, что и на фронтенде)
-            logger.info("Generating response with LLM")
-            logger.info(f"Context preview: {context[:500]}...")
-            logger.info(f"User text: {text[:200]}...")
-            
-            # Используем промпт агента, как на фронтенде
-            response = ollama_service.generate_response(
-                prompt=agent.prompt,
-                context=context,
-                user_text=text
-            )
-            
-            logger.info(f"Generated response: {response[:100]}...")
+                result = generate()
+            response = result["response"]
             
             # Сохраняем лог
             from src.agents.models.agent_log import AgentLog
@@ -283,7 +369,7 @@ def _analyze_with_agent_sync_simple(
                 response=response,
                 processing_time=0.0,  # Будет обновлено позже
                 text_length=len(text),
-                documents_used=len(similar_docs)
+                documents_used=result["documents_used"]
             )
             db.add(agent_log)
             db.commit()
@@ -314,6 +400,9 @@ async def _analyze_with_agent_sync(
     except Exception as e:
         logger.error(f"Error in agent analysis: {e}")
         return {"response": f"Ошибка анализа: {str(e)}"}
+    finally:
+        # Event loop создан задачей и будет закрыт - закрываем и его HTTP клиент Ollama
+        await OllamaService.aclose()
 
 
 async def _analyze_with_agent(
@@ -334,6 +423,8 @@ async def _analyze_with_agent(
     except Exception as e:
         logger.error(f"Error in agent analysis: {e}")
         return {"response": f"Ошибка анализа: {str(e)}"}
+    finally:
+        await OllamaService.aclose()
 
 
 async def _process_telegram_alert_async(
@@ -462,6 +553,8 @@ async def _process_telegram_alert_async(
                 "success": False,
                 "error": str(e)
             }
+        finally:
+            await OllamaService.aclose()
 
 
 @celery_app.task(bind=True, name="test_telegram_monitoring")
@@ -494,6 +587,7 @@ def test_telegram_monitoring_task(
                 monitored_chat_id, test_message
             ))
         finally:
+            loop.run_until_complete(OllamaService.aclose())
             loop.close()
         
         logger.info(f"Telegram monitoring test task {task_id} completed")
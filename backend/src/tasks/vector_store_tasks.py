@@ -0,0 +1,298 @@
+import time
+import asyncio
+import logging
+from typing import Dict, Any, List, Optional, Callable
+from celery import chain
+from src.core.orm.database import AsyncSessionLocal
+from src.core.celery_app import celery_app
+from src.core.rag_config import RAGConfig
+from src.agents.services.vector_store import VectorStore
+from src.agents.services.document_processor import DocumentProcessor
+from src.agents.repositories.document import DocumentRepository
+
+logger = logging.getLogger(__name__)
+
+
+@celery_app.task(bind=True, name="vector_store_tasks.migrate_to_shared_layout")
+def migrate_to_shared_layout_task(
+    self,
+    user_id: Optional[int] = None,
+    agent_id: Optional[int] = None,
+    remove_source: bool = False
+) -> Dict[str, Any]:
+    """
+    Celery задача для переноса векторных БД агентов в общие коллекции (режим shared).
+    Без параметров переносит всех агентов, у которых есть отдельная векторная БД.
+    Запускать до переключения RAG_VECTOR_STORE_MODE=shared: перенос идемпотентен,
+    поэтому задачу можно повторить для агентов, загрузивших документы во время миграции.
+
+    Args:
+        user_id: ID пользователя (только вместе с agent_id)
+        agent_id: ID агента
+        remove_source: Удалить отдельную векторную БД после переноса
+
+    Returns:
+        Результат миграции
+    """
+    task_id = self.request.id
+    logger.info(f"Начинаем перенос векторных БД в общие коллекции (задача {task_id})")
+
+    vector_store = VectorStore()
+    if user_id is not None and agent_id is not None:
+        agents = [(user_id, agent_id)]
+    else:
+        agents = list(vector_store.iter_per_agent_stores())
+
+    migrated_agents = 0
+    migrated_records = 0
+    errors = []
+    for agent_user_id, agent_agent_id in agents:
+        try:
+            migrated_records += vector_store.migrate_agent_to_shared(
+                agent_user_id, agent_agent_id, remove_source=remove_source
+            )
+            migrated_agents += 1
+        except Exception as e:
+            logger.error(f"Ошибка переноса векторной БД агента {agent_agent_id}: {e}")
+            errors.append({"user_id": agent_user_id, "agent_id": agent_agent_id, "error": str(e)})
+
+    logger.info(f"Перенесено агентов: {migrated_agents}, записей: {migrated_records}, ошибок: {len(errors)}")
+    return {
+        "task_id": task_id,
+        "success": not errors,
+        "migrated_agents": migrated_agents,
+        "migrated_records": migrated_records,
+        "errors": errors
+    }
+
+
+@celery_app.task(
+    bind=True,
+    name="vector_store_tasks.reindex_agent",
+    time_limit=RAGConfig.REINDEX_TIME_LIMIT,
+    soft_time_limit=RAGConfig.REINDEX_TIME_LIMIT - 60
+)
+def reindex_agent_task(self, user_id: int, agent_id: int) -> Dict[str, Any]:
+    """
+    Celery задача для переиндексации агента без простоя поиска.
+    Строит теневую коллекцию из сохраненных документов (текст берется из кэша извлечения),
+    затем атомарно переключает на нее search_similar; старая коллекция удаляется позже
+    (RAG_REINDEX_DROP_DELAY). Нужна после смены модели эмбеддингов или параметров чанкинга.
+
+    Args:
+        user_id: ID пользователя
+        agent_id: ID агента
+
+    Returns:
+        Результат переиндексации
+    """
+    task_id = self.request.id
+    logger.info(f"Начинаем переиндексацию агента {agent_id} пользователя {user_id} (задача {task_id})")
+
+    try:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+        try:
+            result = loop.run_until_complete(_reindex_agent_async(
+                user_id, agent_id,
+                progress=lambda stage, **meta: self.update_state(
+                    state="PROGRESS", meta={"stage": stage, "user_id": user_id, "agent_id": agent_id, **meta}
+                )
+            ))
+        finally:
+            loop.close()
+
+        result["task_id"] = task_id
+        return result
+
+    except Exception as e:
+        logger.error(f"Ошибка переиндексации агента {agent_id} (задача {task_id}): {e}")
+        return {
+            "task_id": task_id,
+            "success": False,
+            "error": str(e),
+            "user_id": user_id,
+            "agent_id": agent_id
+        }
+
+
+async def _get_agent_documents(user_id: int, agent_id: int) -> Dict[int, Dict[str, Any]]:
+    """Документы агента из БД (ID -> данные, нужные для индексации)"""
+    async with AsyncSessionLocal() as db:
+        documents = await DocumentRepository(db).get_by_agent_and_user(agent_id, user_id)
+        return {
+            document.id: {
+                "file_path": document.file_path,
+                "filename": document.filename,
+                "file_type": document.file_type,
+                "content_hash": document.content_hash,
+                "uploaded_at": document.uploaded_at.timestamp() if document.uploaded_at else time.time()
+            }
+            for document in documents
+        }
+
+
+def _get_changed_documents(before: Dict[int, Dict[str, Any]],
+                           after: Dict[int, Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+    """Новые документы и документы с замененным файлом"""
+    return {
+        document_id: document for document_id, document in after.items()
+        if document_id not in before or before[document_id]['content_hash'] != document['content_hash']
+    }
+
+
+def _index_into_shadow(vector_store: VectorStore, document_processor: DocumentProcessor,
+                       user_id: int, agent_id: int, generation: int,
+                       documents: Dict[int, Dict[str, Any]],
+                       progress: Callable[..., None]) -> Dict[str, Any]:
+    """Записывает документы в теневую коллекцию пачками с паузой между ними"""
+    indexed = set()
+    failed = []
+    pending = []
+    pause = RAGConfig.REINDEX_BATCH_PAUSE_MS / 1000
+
+    def flush():
+        nonlocal pending
+        if not pending:
+            return
+        if vector_store.add_documents(user_id, agent_id, pending, generation=generation):
+            indexed.update(int(doc['id']) for doc in pending)
+        else:
+            failed.extend({"document_id": int(doc['id']), "error": "Не удалось записать документ в теневую коллекцию"}
+                          for doc in pending)
+        pending = []
+        # Уступаем CPU обработке алертов и загрузкам
+        time.sleep(pause)
+
+    for position, (document_id, document) in enumerate(documents.items()):
+        progress("indexing", done=position, total=len(documents))
+        try:
+            chunks = document_processor.extract_chunks(
+                document['file_path'], document['file_type'], document['content_hash']
+            )
+        except Exception as e:
+            logger.error(f"Ошибка извлечения текста из {document['filename']}: {e}")
+            chunks = []
+        if not chunks:
+            failed.append({"document_id": document_id, "error": "Не удалось извлечь текст из документа"})
+            continue
+
+        pending.append({
+            'id': str(document_id),
+            'chunks': chunks,
+            'filename': document['filename'],
+            'file_type': document['file_type'],
+            'uploaded_at': document['uploaded_at']
+        })
+        if len(pending) >= RAGConfig.REINDEX_BATCH_DOCUMENTS:
+            flush()
+    flush()
+
+    return {"indexed": indexed, "failed": failed}
+
+
+async def _reindex_agent_async(
+    user_id: int,
+    agent_id: int,
+    progress: Optional[Callable[..., None]] = None
+) -> Dict[str, Any]:
+    """Асинхронная часть переиндексации агента"""
+    progress = progress or (lambda stage, **meta: None)
+    vector_store = VectorStore()
+    document_processor = DocumentProcessor()
+
+    with vector_store.reindex_lock(user_id, agent_id) as acquired:
+        if not acquired:
+            logger.warning(f"Переиндексация агента {agent_id} уже выполняется")
+            return {"success": False, "error": "Переиндексация агента уже выполняется",
+                    "user_id": user_id, "agent_id": agent_id}
+
+        documents = await _get_agent_documents(user_id, agent_id)
+        generation = vector_store.create_shadow_collection(user_id, agent_id)
+        result = _index_into_shadow(vector_store, document_processor, user_id, agent_id,
+                                    generation, documents, progress)
+
+        # Документы, загруженные, замененные и удаленные за время переиндексации,
+        # досинхронизируем перед переключением
+        progress("catching_up")
+        current = await _get_agent_documents(user_id, agent_id)
+        changed = _get_changed_documents(documents, current)
+        stale = [document_id for document_id in result["indexed"] if document_id not in current or document_id in changed]
+        if stale:
+            vector_store.delete_documents(user_id, agent_id, stale, generation=generation)
+            result["indexed"] -= set(stale)
+        if changed:
+            caught_up = _index_into_shadow(vector_store, document_processor, user_id, agent_id,
+                                           generation, changed, progress)
+            result["indexed"] |= caught_up["indexed"]
+            result["failed"] += caught_up["failed"]
+
+        progress("swapping")
+        if not vector_store.swap_collection(user_id, agent_id, generation):
+            vector_store.drop_collection_generation(user_id, agent_id, generation)
+            return {"success": False, "error": "Не удалось переключить поиск на новую коллекцию",
+                    "user_id": user_id, "agent_id": agent_id}
+
+    drop_collection_generation_task.apply_async(
+        (user_id, agent_id, generation - 1), countdown=RAGConfig.REINDEX_DROP_DELAY
+    )
+
+    # Документы, обработанные в старую коллекцию между досинхронизацией и переключением,
+    # отправляем на обработку повторно - теперь они попадут в активную коллекцию
+    missed = _get_changed_documents(current, await _get_agent_documents(user_id, agent_id))
+    if missed:
+        from src.tasks.document_tasks import dispatch_document_processing
+        for document_id, document in missed.items():
+            dispatch_document_processing(document_id, user_id, agent_id, document['file_path'],
+                                         document['filename'], document['content_hash'])
+
+    logger.info(f"Агент {agent_id} пользователя {user_id} переиндексирован: поколение {generation}, "
+                f"документов {len(result['indexed'])}, ошибок {len(result['failed'])}")
+    return {
+        "success": True,
+        "user_id": user_id,
+        "agent_id": agent_id,
+        "generation": generation,
+        "documents_indexed": len(result["indexed"]),
+        "documents_requeued": len(missed),
+        "failed": result["failed"]
+    }
+
+
+@celery_app.task(bind=True, name="vector_store_tasks.reindex_all_agents")
+def reindex_all_agents_task(self) -> Dict[str, Any]:
+    """
+    Celery задача для переиндексации всех агентов с документами.
+    Агенты переиндексируются по одному (цепочка задач с низким приоритетом в очереди document_processing),
+    поэтому одновременно занят не больше одного процесса воркера документов.
+    """
+    task_id = self.request.id
+
+    async def get_agents() -> List[tuple]:
+        async with AsyncSessionLocal() as db:
+            return await DocumentRepository(db).get_agent_owners()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        agents = loop.run_until_complete(get_agents())
+    finally:
+        loop.close()
+
+    if agents:
+        chain(*[
+            reindex_agent_task.si(user_id, agent_id).set(priority=9)
+            for user_id, agent_id in agents
+        ]).apply_async()
+
+    logger.info(f"Переиндексация {len(agents)} агентов поставлена в очередь (задача {task_id})")
+    return {"task_id": task_id, "success": True, "agents": len(agents)}
+
+
+@celery_app.task(bind=True, name="vector_store_tasks.drop_collection_generation")
+def drop_collection_generation_task(self, user_id: int, agent_id: int, generation: int) -> Dict[str, Any]:
+    """Celery задача для удаления старой коллекции агента после переиндексации"""
+    dropped = VectorStore().drop_collection_generation(user_id, agent_id, generation)
+    return {"task_id": self.request.id, "success": dropped, "user_id": user_id,
+            "agent_id": agent_id, "generation": generation}
@@ -0,0 +1,77 @@
+from src.agents.services.alert_index import AlertIndex, extract_alert_keys, extract_query_keys
+
+
+def test_lookup_by_code_and_alerting_name(tmp_path):
+    index = AlertIndex(tmp_path / "alert_index.json")
+    index.add_chunks(
+        ["doc_1_a", "doc_1_b", "doc_1_c"],
+        [
+            "Код: z735 | Название: Инвалидные пакеты в MTBDM | Как реагировать: Перезапустить",
+            "Код: c217 | Название: <10% свободного места | Как реагировать: Почистить диск",
+            "Общий раздел\nПри срабатывании [Alerting] Memory OpenApi IS/CS alert смотреть дашборд",
+        ]
+    )
+
+    match = index.lookup("Сработал z735 Инвалидные пакеты в MTBDM")
+    assert match["ids"] == ["doc_1_a"]
+    assert match["match_type"] == "first_line"
+
+    match = index.lookup("[Alerting] Memory OpenApi IS/CS alert\nMetrics: memory")
+    assert match["ids"] == ["doc_1_c"]
+    assert match["match_type"] == "full_text"
+
+    assert index.lookup("Просто текст без алертов") is None
+
+
+def test_reindexing_chunk_replaces_old_keys(tmp_path):
+    index = AlertIndex(tmp_path / "alert_index.json")
+    index.add_chunks(["doc_1_a"], ["z735 Старое название"])
+    index.rebuild(["doc_1_a"], ["z736 Новое название"])
+
+    assert index.lookup("z735") is None
+    assert index.lookup("z736")["ids"] == ["doc_1_a"]
+
+
+def test_query_keys_are_ordered_and_unique():
+    keys = extract_query_keys("[Alerting] Disk full alert\nz735 z735")
+    assert keys[0] == "name:disk full"
+    assert keys.count("code:z735") == 1
+
+
+def _add_codes(index_path, prefix):
+    index = AlertIndex(index_path)
+    for i in range(30):
+        index.add_chunks([f"{prefix}_{i}"], [f"z{100 + i} Алерт {prefix}"])
+
+
+def test_concurrent_updates_from_processes_are_not_lost(tmp_path):
+    import multiprocessing
+
+    index_path = tmp_path / "alert_index.json"
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_add_codes, args=(index_path, prefix)) for prefix in ("a", "b")]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    match = AlertIndex(index_path).lookup("z105")
+    assert sorted(match["ids"]) == ["a_5", "b_5"]
+
+
+def test_ordinary_tokens_are_not_alert_codes(tmp_path):
+    index = AlertIndex(tmp_path / "alert_index.json")
+    index.add_chunks(
+        ["doc_1_a", "doc_1_b"],
+        ["Задержка p99 на хостах x86 выше нормы", "Линтер: E501 слишком длинная строка, кодек h264, релиз v12"]
+    )
+
+    assert not [key for key in extract_query_keys("p99 latency on x86 host, E501 lint") if key.startswith("code:")]
+    for query in ("p99", "x86", "E501", "Сработал p99 latency"):
+        assert index.lookup(query) is None
+
+
+def test_alert_keys_come_only_from_alert_title():
+    assert extract_alert_keys("z735 Инвалидные пакеты\nсм. также c217") == ["code:z735", "name:инвалидные пакеты"]
+    assert extract_alert_keys("Сравнить z735 и c217\nтекст") == []
+    assert extract_alert_keys("[Alerting] Disk full alert\nz735") == ["name:disk full"]
@@ -0,0 +1,85 @@
+from src.agents.services.chroma_pool import ChromaClientPool
+
+
+class FakeCollection:
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeClient:
+    def get_or_create_collection(self, name, metadata=None):
+        return FakeCollection(name)
+
+
+class FakePool(ChromaClientPool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stopped = []
+
+    def _create_client(self, path_str):
+        return FakeClient(), None
+
+    def _detach_client(self, path_str, entry):
+        pass
+
+    def _stop_client(self, path_str, entry):
+        self.stopped.append(entry["client"])
+
+
+def test_stale_client_is_stopped_after_last_lease(tmp_path):
+    pool = FakePool(max_clients=4, idle_ttl=3600)
+
+    with pool.collection(tmp_path, "docs", version=1) as old:
+        # Другой процесс изменил коллекцию: новый запрос получает новый клиент,
+        # а клиент начатого запроса не закрывается
+        with pool.collection(tmp_path, "docs", version=2) as new:
+            assert new is not old
+            assert pool.stopped == []
+        assert pool.stats()["retired_in_use"] == 1
+
+    assert len(pool.stopped) == 1
+    assert pool.stats()["retired_in_use"] == 0
+    assert pool.stats()["clients"] == 1
+
+
+def test_own_write_keeps_client_fresh(tmp_path):
+    pool = FakePool(max_clients=4, idle_ttl=3600)
+
+    with pool.collection(tmp_path, "docs", version=1) as collection:
+        pool.adopt_version(tmp_path, collection, 2)
+    with pool.collection(tmp_path, "docs", version=2) as again:
+        assert again is collection
+
+    # Поколение увеличилось больше чем на одну запись этого процесса - клиент переоткрывается
+    with pool.collection(tmp_path, "docs", version=2) as collection:
+        pool.adopt_version(tmp_path, collection, 4)
+    with pool.collection(tmp_path, "docs", version=4) as again:
+        assert again is not collection
+    assert len(pool.stopped) == 1
+
+
+def test_evicted_client_in_use_is_not_stopped(tmp_path):
+    pool = FakePool(max_clients=1, idle_ttl=3600)
+
+    with pool.collection(tmp_path / "a", "docs"):
+        with pool.collection(tmp_path / "b", "docs"):
+            assert pool.stopped == []
+        assert pool.stopped == []
+    assert len(pool.stopped) == 1
+
+
+def test_shared_client_freshness_is_per_agent(tmp_path):
+    pool = FakePool(max_clients=4, idle_ttl=3600)
+
+    with pool.collection(tmp_path, "shared_docs_0", version=3, version_key=(1, 1), changed_at=0.0) as collection:
+        pass
+    # Агент, коллекция которого не менялась после открытия клиента, использует тот же клиент
+    with pool.collection(tmp_path, "shared_docs_0", version=7, version_key=(1, 2), changed_at=0.0) as again:
+        assert again is collection
+    # Другой процесс изменил первого агента - клиент переоткрывается
+    with pool.collection(tmp_path, "shared_docs_0", version=4, version_key=(1, 1), changed_at=0.0) as again:
+        assert again is not collection
+    # Третий агент изменился после открытия нового клиента - клиент переоткрывается
+    with pool.collection(tmp_path, "shared_docs_0", version=8, version_key=(1, 3), changed_at=float("inf")):
+        pass
+    assert len(pool.stopped) == 2
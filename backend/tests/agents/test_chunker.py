@@ -0,0 +1,51 @@
+from src.agents.utils.chunker import TextChunker, compute_chunk_hash, make_chunk_id
+
+
+def test_short_text_is_single_chunk():
+    chunks = TextChunker(chunk_size=100, chunk_overlap=10).chunk_text("z735 Инвалидные пакеты в MTBDM")
+    assert len(chunks) == 1
+    assert chunks[0]["chunk_index"] == 0
+    assert chunks[0]["chunk_hash"] == compute_chunk_hash("z735  Инвалидные пакеты в MTBDM")
+
+
+def test_long_text_is_split_with_overlap():
+    text = " ".join(f"слово{i}" for i in range(200))
+    chunks = TextChunker(chunk_size=100, chunk_overlap=20).chunk_text(text)
+    assert len(chunks) > 1
+    assert all(len(chunk["text"]) <= 100 for chunk in chunks)
+    # Конец каждого чанка повторяется в начале следующего
+    last_word = chunks[0]["text"].split()[-1]
+    assert last_word in chunks[1]["text"]
+
+
+def test_table_rows_are_separate_chunks_with_columns():
+    header = ["Код", "Название", "Как реагировать"]
+    segments = [
+        {"text": "z735 | Пакеты | Перезапустить", "kind": "row", "sheet": "Алерты", "row": 2,
+         "cells": ["z735", "Пакеты", "Перезапустить"], "header": header},
+        {"text": "c217 | Диск | Почистить", "kind": "row", "sheet": "Алерты", "row": 3,
+         "cells": ["c217", "Диск", "Почистить"], "header": header},
+    ]
+    chunks = TextChunker(chunk_size=100, chunk_overlap=10).chunk_segments(segments)
+    assert [chunk["row"] for chunk in chunks] == [2, 3]
+    assert chunks[0]["text"] == "Код: z735 | Название: Пакеты | Как реагировать: Перезапустить"
+    assert chunks[1]["sheet"] == "Алерты"
+
+
+def test_paragraphs_are_merged_and_duplicates_dropped():
+    segments = [
+        {"text": "Первый абзац.", "kind": "paragraph", "paragraph": 1},
+        {"text": "Второй абзац.", "kind": "paragraph", "paragraph": 2},
+        {"text": "Страница", "kind": "page", "page": 1},
+        {"text": "страница", "kind": "page", "page": 2},
+    ]
+    chunks = TextChunker(chunk_size=100, chunk_overlap=10).chunk_segments(segments)
+    assert len(chunks) == 2
+    assert chunks[0]["text"] == "Первый абзац.\nВторой абзац."
+    assert chunks[1]["page"] == 1
+
+
+def test_chunk_id_is_stable():
+    chunk_hash = compute_chunk_hash("Текст")
+    assert make_chunk_id(5, chunk_hash) == make_chunk_id("5", compute_chunk_hash("  Текст "))
+    assert chunk_hash != compute_chunk_hash("текст")
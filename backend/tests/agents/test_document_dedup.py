@@ -0,0 +1,99 @@
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from src.agents.repositories.document import DocumentRepository
+from src.agents.schemas.document import DocumentCreate
+from src.tasks.document_tasks import prepare_document_retry
+
+
+class ConflictSession:
+    """Сессия, в которой вставка нарушает уникальный индекс по хэшу содержимого"""
+
+    def __init__(self):
+        self.added = []
+        self.commits = 0
+
+    @asynccontextmanager
+    async def begin_nested(self):
+        yield
+        raise IntegrityError("INSERT INTO documents", {}, Exception("duplicate key value"))
+
+    def add(self, document):
+        self.added.append(document)
+
+    def add_all(self, documents):
+        self.added.extend(documents)
+
+    async def commit(self):
+        self.commits += 1
+
+    async def refresh(self, document):
+        pass
+
+
+def _upload(tmp_path, name, content_hash="ab12"):
+    path = tmp_path / name
+    path.write_bytes(b"z735")
+    return DocumentCreate(filename=name, file_path=str(path), file_type="md", file_size=4, content_hash=content_hash)
+
+
+def _existing(tmp_path, processed=False):
+    return SimpleNamespace(id=5, filename="runbook.md", file_path=str(tmp_path / "5_runbook.md"),
+                           file_size=4, content_hash="ab12", processed=processed)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_duplicate_returns_existing_document(tmp_path, monkeypatch):
+    existing = _existing(tmp_path)
+    repo = DocumentRepository(ConflictSession())
+
+    async def get_by_content_hash(agent_id, user_id, content_hash):
+        return existing if content_hash == "ab12" else None
+    monkeypatch.setattr(repo, "get_by_content_hash", get_by_content_hash)
+
+    assert await repo.create(_upload(tmp_path, "1_runbook.md"), agent_id=7, user_id=1) is existing
+    assert await repo.create_many([_upload(tmp_path, "2_runbook.md")], agent_id=7, user_id=1) == [existing]
+
+    # Конфликт не по хэшу содержимого не маскируется
+    with pytest.raises(IntegrityError):
+        await repo.create(_upload(tmp_path, "3_other.md", content_hash=None), agent_id=7, user_id=1)
+
+
+class FakeDocumentRepository:
+    def __init__(self):
+        self.updated = []
+
+    async def update_file(self, document_id, file_path, file_size, content_hash=None):
+        self.updated.append((document_id, file_path, content_hash))
+
+
+@pytest.mark.asyncio
+async def test_unprocessed_duplicate_reuses_its_file(tmp_path):
+    existing = _existing(tmp_path)
+    (tmp_path / "5_runbook.md").write_bytes(b"z735")
+    upload = _upload(tmp_path, "6_runbook.md").model_dump()
+    repo = FakeDocumentRepository()
+
+    retry = await prepare_document_retry(repo, existing, upload)
+
+    assert retry == {"document_id": 5, "file_path": existing.file_path, "filename": "runbook.md",
+                     "content_hash": "ab12"}
+    assert repo.updated == []
+    assert not (tmp_path / "6_runbook.md").exists()
+
+
+@pytest.mark.asyncio
+async def test_unprocessed_duplicate_without_file_takes_uploaded_file(tmp_path):
+    existing = _existing(tmp_path)
+    upload = _upload(tmp_path, "6_runbook.md").model_dump()
+    repo = FakeDocumentRepository()
+
+    retry = await prepare_document_retry(repo, existing, upload)
+
+    assert retry["document_id"] == 5
+    assert retry["file_path"] == upload["file_path"]
+    assert repo.updated == [(5, upload["file_path"], "ab12")]
+    assert (tmp_path / "6_runbook.md").exists()
@@ -0,0 +1,142 @@
+import hashlib
+import io
+import tarfile
+import zipfile
+
+import pytest
+
+from src.core.rag_config import RAGConfig
+from src.agents.services.document_processor import DocumentProcessor
+
+
+def _zip(path, members):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return str(path)
+
+
+def _tar(path, members):
+    with tarfile.open(path, "w:gz") as archive:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return str(path)
+
+
+def _saved_files(processor):
+    return sorted(path.name for path in processor.get_agent_docs_path(1, 7).iterdir())
+
+
+@pytest.fixture
+def processor(tmp_path, monkeypatch):
+    monkeypatch.setattr(RAGConfig, "EXTRACTION_CACHE_ENABLED", False)
+    monkeypatch.setattr(RAGConfig, "UPLOAD_MAX_SIZE_MB", 1)
+    monkeypatch.setattr(RAGConfig, "UPLOAD_CHUNK_SIZE", 64 * 1024)
+    return DocumentProcessor(str(tmp_path / "docs"))
+
+
+@pytest.mark.parametrize("make_archive", [_zip, _tar])
+def test_archive_members_are_saved_and_skipped(processor, tmp_path, make_archive):
+    archive_path = make_archive(tmp_path / "archive", {
+        "runbooks/z735.md": "z735 Инвалидные пакеты".encode(),
+        "notes.txt": b"notes",
+        ".DS_Store": b"service",
+        "__MACOSX/runbooks/._z735.md": b"service",
+        "setup.exe": b"binary",
+        "big.txt": b"x" * (1024 * 1024 + 1),
+    })
+
+    results = processor.save_archive(1, 7, archive_path)
+
+    saved = {result["original_filename"]: result for result in results if result["success"]}
+    failed = {result["original_filename"]: result["error"] for result in results if not result["success"]}
+    assert sorted(saved) == ["notes.txt", "z735.md"]
+    assert saved["notes.txt"]["file_size"] == 5
+    assert sorted(failed) == ["big.txt", "setup.exe"]
+    assert "1MB" in failed["big.txt"]
+    # Пропущенные и слишком большие файлы не оставляют ни файлов, ни .part
+    assert _saved_files(processor) == sorted(result["filename"] for result in saved.values())
+
+
+@pytest.mark.parametrize("make_archive", [_zip, _tar])
+def test_archive_over_total_size_is_rejected_whole(processor, tmp_path, make_archive):
+    chunk = b"z735 " * (150 * 1024)
+    archive_path = make_archive(tmp_path / "archive", {f"part{i}.txt": chunk for i in range(3)})
+
+    with pytest.raises(ValueError, match="2MB"):
+        processor.save_archive(1, 7, archive_path, max_total_mb=2)
+
+    # Уже распакованные файлы и недописанный .part удалены
+    assert _saved_files(processor) == []
+
+
+def test_unknown_archive_format_is_rejected(processor, tmp_path):
+    path = tmp_path / "archive.rar"
+    path.write_bytes(b"not an archive")
+
+    with pytest.raises(ValueError):
+        processor.save_archive(1, 7, str(path))
+
+
+class FakeUpload:
+    """Загруженный файл: как UploadFile, читается частями через async read"""
+
+    def __init__(self, data):
+        self.stream = io.BytesIO(data)
+        self.reads = 0
+
+    async def read(self, size=-1):
+        self.reads += 1
+        return self.stream.read(size)
+
+
+@pytest.mark.asyncio
+async def test_upload_is_saved_with_hash(processor):
+    data = "z735 Инвалидные пакеты".encode()
+
+    result = await processor.save_upload_stream(1, 7, FakeUpload(data), "runbook.md")
+
+    assert result["success"]
+    assert result["file_size"] == len(data)
+    assert result["content_hash"] == hashlib.sha256(data).hexdigest()
+    assert _saved_files(processor) == [result["filename"]]
+
+
+@pytest.mark.asyncio
+async def test_upload_over_size_limit_is_rejected(processor):
+    upload = FakeUpload(b"x" * (3 * 1024 * 1024))
+
+    result = await processor.save_upload_stream(1, 7, upload, "big.txt")
+
+    assert not result["success"]
+    assert "1MB" in result["error"]
+    # Чтение останавливается сразу после превышения, а не дочитывает файл до конца
+    assert upload.reads == 1024 * 1024 // RAGConfig.UPLOAD_CHUNK_SIZE + 1
+    assert _saved_files(processor) == []
+
+
+@pytest.mark.asyncio
+async def test_failed_upload_leaves_no_part_file(processor):
+    class BrokenUpload(FakeUpload):
+        async def read(self, size=-1):
+            if self.reads:
+                raise ConnectionError("соединение разорвано")
+            return await super().read(size)
+
+    result = await processor.save_upload_stream(1, 7, BrokenUpload(b"x" * 1024), "runbook.md")
+
+    assert not result["success"]
+    assert _saved_files(processor) == []
+
+
+@pytest.mark.asyncio
+async def test_unsupported_upload_is_not_written(processor):
+    upload = FakeUpload(b"binary")
+
+    result = await processor.save_upload_stream(1, 7, upload, "setup.exe")
+
+    assert not result["success"]
+    assert upload.reads == 0
+    assert not processor.get_agent_docs_path(1, 7).exists()
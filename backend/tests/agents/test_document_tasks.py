@@ -0,0 +1,203 @@
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import pytest
+
+from src.core.celery_app import celery_app
+from src.tasks import document_tasks
+
+
+def _queue(task_name):
+    return celery_app.amqp.router.route({}, task_name)["queue"].name
+
+
+def test_processing_tasks_are_routed_to_document_queue():
+    assert _queue(document_tasks.process_document_task.name) == "document_processing"
+    assert _queue(document_tasks.process_documents_batch_task.name) == "document_processing"
+    assert _queue(document_tasks.delete_document_from_vector_store_task.name) == "default"
+
+
+@pytest.mark.parametrize("state, kwargs, expected", [
+    ("PENDING", {}, {}),
+    ("PROGRESS", {"info": {"stage": "indexing", "document_id": 5, "chunks_count": 12}},
+     {"stage": "indexing", "document_id": 5, "chunks_count": 12}),
+    ("SUCCESS", {"result": {"success": True, "document_id": 5}}, {"result": {"success": True, "document_id": 5}}),
+    ("FAILURE", {"result": RuntimeError("воркер упал")}, {"result": {"error": "воркер упал"}}),
+])
+def test_job_status_transitions(monkeypatch, state, kwargs, expected):
+    result = SimpleNamespace(state=state, info=kwargs.get("info"), result=kwargs.get("result"),
+                             ready=lambda: state in ("SUCCESS", "FAILURE"))
+    monkeypatch.setattr(celery_app, "AsyncResult", lambda job_id: result)
+
+    assert document_tasks.get_document_job_status("job-1") == {"job_id": "job-1", "state": state, **expected}
+
+
+class FakeVectorStore:
+    def __init__(self):
+        self.updated = []
+        self.added = []
+        self.deleted = []
+
+    def update_document(self, user_id, agent_id, document):
+        self.updated.append(document["id"])
+        return {"added": len(document["chunks"]), "removed": 0, "unchanged": 0}
+
+    def add_documents(self, user_id, agent_id, documents):
+        self.added.extend(document["id"] for document in documents)
+        return True
+
+    def delete_document(self, user_id, agent_id, document_id):
+        return self.delete_documents(user_id, agent_id, [document_id])
+
+    def delete_documents(self, user_id, agent_id, document_ids):
+        self.deleted.extend(document_ids)
+        return len(document_ids)
+
+
+class FakeDocumentRepository:
+    """Документы в БД: existing - ID, которые еще не удалены"""
+
+    existing = set()
+    processed = []
+
+    def __init__(self, db):
+        pass
+
+    async def get_by_id(self, document_id):
+        return SimpleNamespace(id=document_id) if document_id in self.existing else None
+
+    async def update_processed_status(self, document_id, processed):
+        if document_id not in self.existing:
+            return None
+        self.processed.append(document_id)
+        return SimpleNamespace(id=document_id, processed=processed)
+
+    async def update_processed_status_many(self, document_ids, processed):
+        existing = [document_id for document_id in document_ids if document_id in self.existing]
+        self.processed.extend(existing)
+        return len(existing)
+
+    async def get_existing_ids(self, document_ids):
+        return {document_id for document_id in document_ids if document_id in self.existing}
+
+
+class FakeRunbookRecordRepository:
+    def __init__(self, db):
+        pass
+
+    async def replace_for_document(self, document_id, agent_id, user_id, records):
+        return len(records)
+
+
+@pytest.fixture
+def services(monkeypatch):
+    vector_store = FakeVectorStore()
+
+    @asynccontextmanager
+    async def session():
+        yield SimpleNamespace()
+
+    class FakeDocumentProcessor:
+        def extract_chunks(self, file_path, file_type, content_hash=None, runbook_parser=None):
+            return [{"text": f"Текст {file_path}", "chunk_index": 0, "chunk_hash": file_path}]
+
+    monkeypatch.setattr(document_tasks, "AsyncSessionLocal", session)
+    monkeypatch.setattr(document_tasks, "DocumentProcessor", FakeDocumentProcessor)
+    monkeypatch.setattr(document_tasks, "AgentService", lambda: SimpleNamespace(vector_store=vector_store))
+    monkeypatch.setattr(document_tasks, "DocumentRepository", FakeDocumentRepository)
+    monkeypatch.setattr(document_tasks, "RunbookRecordRepository", FakeRunbookRecordRepository)
+    monkeypatch.setattr(FakeDocumentRepository, "existing", set())
+    monkeypatch.setattr(FakeDocumentRepository, "processed", [])
+    return vector_store
+
+
+@pytest.mark.asyncio
+async def test_document_is_processed_with_progress(services):
+    FakeDocumentRepository.existing = {5}
+    stages = []
+
+    result = await document_tasks._process_document_async(
+        5, 1, 7, "5.md", "runbook.md", progress=lambda stage, **meta: stages.append(stage)
+    )
+
+    assert result["success"] and result["chunks_added"] == 1
+    assert stages == ["extracting", "indexing"]
+    assert services.updated == ["5"]
+    assert FakeDocumentRepository.processed == [5]
+
+
+@pytest.mark.asyncio
+async def test_document_deleted_before_processing_is_skipped(services):
+    result = await document_tasks._process_document_async(5, 1, 7, "5.md", "runbook.md")
+
+    assert not result["success"]
+    assert services.updated == []
+
+
+@pytest.mark.asyncio
+async def test_chunks_of_document_deleted_during_processing_are_dropped(services, monkeypatch):
+    FakeDocumentRepository.existing = {5}
+
+    # Документ удаляют, пока его чанки записываются в векторную БД
+    update_document = services.update_document
+
+    def update_and_delete(user_id, agent_id, document):
+        FakeDocumentRepository.existing.discard(5)
+        return update_document(user_id, agent_id, document)
+    monkeypatch.setattr(services, "update_document", update_and_delete)
+
+    result = await document_tasks._process_document_async(5, 1, 7, "5.md", "runbook.md")
+
+    assert not result["success"]
+    assert services.deleted == [5]
+    assert FakeDocumentRepository.processed == []
+
+
+@pytest.mark.asyncio
+async def test_batch_drops_chunks_of_deleted_documents(services):
+    FakeDocumentRepository.existing = {1, 3}
+    documents = [
+        {"document_id": document_id, "file_path": f"{document_id}.md", "filename": f"{document_id}.md"}
+        for document_id in (1, 2, 3)
+    ]
+
+    result = await document_tasks._process_documents_batch_async(1, 7, documents)
+
+    assert services.added == ["1", "2", "3"]
+    assert services.deleted == [2]
+    assert result["processed_ids"] == [1, 3]
+    assert FakeDocumentRepository.processed == [1, 3]
+
+
+@pytest.mark.asyncio
+async def test_status_endpoint_reports_only_own_job(monkeypatch):
+    from fastapi import HTTPException
+    from src.agents.routers import document as document_router
+
+    document = SimpleNamespace(id=5, agent_id=7, user_id=1, filename="runbook.md", processed=False)
+
+    class Repository:
+        def __init__(self, db):
+            pass
+
+        async def get_by_id(self, document_id):
+            return document if document_id == 5 else None
+
+    jobs = {
+        "job-5": {"job_id": "job-5", "state": "PROGRESS", "stage": "indexing", "document_id": 5},
+        "job-6": {"job_id": "job-6", "state": "SUCCESS", "result": {"success": True, "document_id": 6}},
+    }
+    monkeypatch.setattr(document_router, "DocumentRepository", Repository)
+    monkeypatch.setattr(document_tasks, "get_document_job_status", jobs.get)
+    user = SimpleNamespace(id=1)
+
+    status = await document_router.get_document_status(7, 5, "job-5", current_user=user, db=None)
+    assert status == {"document_id": 5, "filename": "runbook.md", "processed": False, "job": jobs["job-5"]}
+
+    # Задача другого документа не раскрывается
+    status = await document_router.get_document_status(7, 5, "job-6", current_user=user, db=None)
+    assert "job" not in status
+
+    with pytest.raises(HTTPException) as error:
+        await document_router.get_document_status(7, 6, None, current_user=user, db=None)
+    assert error.value.status_code == 404
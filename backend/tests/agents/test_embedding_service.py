@@ -0,0 +1,66 @@
+import threading
+
+from src.agents.services.embedding_service import EmbeddingService
+from src.agents.services.embedding_cache import EmbeddingCache
+
+
+def _make_service():
+    EmbeddingService._instances = {}
+    service = EmbeddingService()
+    service.max_wait = 0.05
+    service._model = object()
+    service._encode = lambda texts: [[float(len(text))] for text in texts]
+    return service
+
+
+def test_concurrent_queries_share_one_batch():
+    service = _make_service()
+    results = {}
+    start = threading.Barrier(8)
+
+    def worker(i):
+        start.wait()
+        results[i] = service.embed_query("x" * i)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {i: [float(i)] for i in range(8)}
+    assert service.requests == 8
+    assert service.batches < 8
+
+
+def test_embed_keeps_order():
+    service = _make_service()
+    assert service.embed(["a", "bbb", "cc"]) == [[1.0], [3.0], [2.0]]
+    assert service.embed([]) == []
+
+
+def test_embedding_cache_is_keyed_by_model(tmp_path):
+    cache = EmbeddingCache(tmp_path / "cache.sqlite3", model_name="m1", max_entries=2)
+    cache.put_many([("h1", [0.5, 1.0]), ("h2", [2.0, 3.0])])
+
+    assert cache.get_many(["h1", "h3"]) == {"h1": [0.5, 1.0]}
+    assert EmbeddingCache(tmp_path / "cache.sqlite3", model_name="m2", max_entries=2).get_many(["h1"]) == {}
+
+    cache.put_many([("h3", [4.0])])
+    assert len(cache.get_many(["h1", "h2", "h3"])) == 2
+
+
+def test_embedding_cache_is_pruned_every_interval(tmp_path):
+    cache = EmbeddingCache(tmp_path / "cache.sqlite3", model_name="m1", max_entries=2, prune_interval=3)
+    hashes = [f"h{i}" for i in range(1, 7)]
+    for i, chunk_hash in enumerate(hashes[:3]):
+        cache.put_many([(chunk_hash, [float(i)])])
+    assert cache.get_many(hashes).keys() == {"h2", "h3"}
+
+    # До следующей очистки кэш может превышать max_entries
+    for i, chunk_hash in enumerate(hashes[3:5]):
+        cache.put_many([(chunk_hash, [float(i)])])
+    assert cache.get_many(hashes).keys() == {"h2", "h3", "h4", "h5"}
+
+    cache.put_many([("h6", [6.0])])
+    assert cache.get_many(hashes).keys() == {"h5", "h6"}
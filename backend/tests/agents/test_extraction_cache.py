@@ -0,0 +1,35 @@
+import os
+
+from src.agents.services.extraction_cache import ExtractionCache
+
+
+def _write(cache, content_hash, file_type, text):
+    return list(cache.write_through(content_hash, file_type, iter([{"text": text}])))
+
+
+def test_same_bytes_with_different_types_are_cached_separately(tmp_path):
+    cache = ExtractionCache(tmp_path)
+    _write(cache, "ab12", "csv", "строка таблицы")
+
+    assert cache.read("ab12", "txt") is None
+    assert list(cache.read("ab12", "csv")) == [{"text": "строка таблицы"}]
+
+
+def test_prune_keeps_only_existing_documents(tmp_path):
+    cache = ExtractionCache(tmp_path)
+    _write(cache, "ab12", "csv", "нужен")
+    _write(cache, "cd34", "pdf", "документ удален")
+    legacy = tmp_path / "ab" / "ab12.v1.jsonl.gz"
+    legacy.write_bytes(b"")
+    for path in tmp_path.glob("*/*"):
+        os.utime(path, (0, 0))
+
+    assert cache.prune({("ab12", "csv")}) == 2
+    assert cache.exists("ab12", "csv")
+    assert not cache.exists("cd34", "pdf")
+    assert not legacy.exists()
+
+    # Только что сохраненные сегменты не удаляются, даже если документа еще нет в БД
+    _write(cache, "ef56", "md", "новый")
+    assert cache.prune(set()) == 1
+    assert cache.exists("ef56", "md")
@@ -0,0 +1,172 @@
+import inspect
+
+from src.agents.utils.file_handlers import FileProcessor
+
+
+def _write_xlsx(path, sheets):
+    import openpyxl
+    workbook = openpyxl.Workbook()
+    workbook.remove(workbook.active)
+    for title, rows in sheets.items():
+        sheet = workbook.create_sheet(title)
+        for row in rows:
+            sheet.append(row)
+    workbook.save(path)
+    return str(path)
+
+
+def _write_pdf(path, pages):
+    """Минимальный PDF: по одной строке текста (латиница, шрифт Helvetica) на страницу"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    data = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(data)
+    data += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    data += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    data += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_txt_paragraphs_and_cp1251(tmp_path):
+    path = tmp_path / "runbook.txt"
+    path.write_bytes("z735 Инвалидные пакеты\nПерезапустить сервис\n\nc217 Диск\n".encode("cp1251"))
+    segments = list(FileProcessor().iter_segments(str(path), "txt"))
+    assert [segment["text"] for segment in segments] == ["z735 Инвалидные пакеты\nПерезапустить сервис", "c217 Диск"]
+    assert segments[1]["paragraph"] == 2
+
+
+def test_csv_rows_with_header(tmp_path):
+    path = tmp_path / "alerts.csv"
+    path.write_text('Код;Название;Как реагировать\nz735;Пакеты;"Перезапустить\nсервис"\n\nc217;Диск;Почистить\n',
+                    encoding="utf-8")
+    segments = list(FileProcessor().iter_segments(str(path), "csv"))
+    assert [segment["cells"][0] for segment in segments] == ["z735", "c217"]
+    assert segments[0]["header"] == ["Код", "Название", "Как реагировать"]
+    assert segments[0]["row"] == 3
+    assert segments[1]["row"] == 5
+
+
+def test_markdown_sections_and_table_rows(tmp_path):
+    path = tmp_path / "runbook.md"
+    path.write_text(
+        "# Алерты\nОписание\n\n| Код | Как реагировать |\n|---|---|\n| z735 | Перезапустить |\n\n"
+        "## Диск\n```\n# не заголовок\n```\n",
+        encoding="utf-8"
+    )
+    segments = list(FileProcessor().iter_segments(str(path), "md"))
+    assert [segment["kind"] for segment in segments] == ["section", "table_row", "section"]
+    assert segments[0]["text"] == "# Алерты\nОписание"
+    assert segments[1]["cells"] == ["z735", "Перезапустить"]
+    assert segments[1]["header"] == ["Код", "Как реагировать"]
+    assert segments[2]["text"].endswith("# не заголовок\n```")
+
+
+def test_excel_rows_stream_with_sheet_and_row(tmp_path):
+    path = _write_xlsx(tmp_path / "alerts.xlsx", {
+        "Сеть": [["Код", "Как реагировать"], ["z735", "Перезапустить"], [None, None], ["z736", "Проверить канал"]],
+        "Диск": [["Код", "Как реагировать"], ["c217", "Почистить диск"]],
+        "Пустой": [["Только заголовок"]],
+    })
+    segments = FileProcessor().iter_segments(path, "xlsx")
+    assert inspect.isgenerator(segments)
+
+    segments = list(segments)
+    assert [(segment["sheet"], segment["row"], segment["text"]) for segment in segments] == [
+        ("Сеть", 2, "z735 | Перезапустить"),
+        ("Сеть", 4, "z736 | Проверить канал"),
+        ("Диск", 2, "c217 | Почистить диск"),
+        ("Пустой", 1, "Только заголовок"),
+    ]
+    assert segments[0]["header"] == ["Код", "Как реагировать"]
+
+
+def test_pdf_pages_stream_in_order(tmp_path):
+    path = _write_pdf(tmp_path / "runbook.pdf", ["z735 Restart service", "", "c217 Clean disk"])
+    segments = FileProcessor().iter_segments(path, "pdf")
+    assert inspect.isgenerator(segments)
+
+    # Пустая страница пропускается, номера страниц сохраняются
+    assert [(segment["page"], segment["text"]) for segment in segments] == [
+        (1, "z735 Restart service"), (3, "c217 Clean disk")
+    ]
+
+
+def test_word_paragraphs_then_table_rows(tmp_path):
+    from docx import Document
+
+    document = Document()
+    document.add_paragraph("Регламент дежурного")
+    document.add_paragraph("")
+    document.add_paragraph("Алерты сети")
+    table = document.add_table(rows=3, cols=2)
+    for row, cells in zip(table.rows, [["Код", "Как реагировать"], ["z735", "Перезапустить"], ["c217", "Почистить"]]):
+        for cell, text in zip(row.cells, cells):
+            cell.text = text
+    path = tmp_path / "runbook.docx"
+    document.save(path)
+
+    segments = list(FileProcessor().iter_segments(str(path), "docx"))
+    assert [(segment["kind"], segment.get("paragraph") or segment.get("row")) for segment in segments] == [
+        ("paragraph", 1), ("paragraph", 3), ("table_row", 2), ("table_row", 3)
+    ]
+    assert segments[2]["cells"] == ["z735", "Перезапустить"]
+    assert segments[2]["header"] == ["Код", "Как реагировать"]
+    assert segments[3]["table"] == 1
+
+
+def _enable_parallel_extraction(monkeypatch):
+    from src.core.rag_config import RAGConfig
+    monkeypatch.setattr(RAGConfig, "EXTRACTION_WORKERS", 2)
+    monkeypatch.setattr(RAGConfig, "PARALLEL_EXTRACTION_MIN_BYTES", 0)
+    monkeypatch.setattr(RAGConfig, "PARALLEL_EXTRACTION_MIN_PAGES", 1)
+
+
+def test_parallel_extraction_matches_sequential(tmp_path, monkeypatch):
+    workbook = _write_xlsx(tmp_path / "alerts.xlsx", {
+        f"Лист {i}": [["Код", "Как реагировать"]] + [[f"z{i}{row:02d}", f"Реакция {row}"] for row in range(20)]
+        for i in range(5)
+    })
+    pdf = _write_pdf(tmp_path / "runbook.pdf", [f"Page {i} text" for i in range(1, 8)])
+    processor = FileProcessor()
+    sequential = {
+        "xlsx": list(processor.get_handler("xlsx").iter_segments(workbook)),
+        "pdf": list(processor.get_handler("pdf").iter_segments(pdf)),
+    }
+
+    _enable_parallel_extraction(monkeypatch)
+    calls = []
+    parallel = FileProcessor._iter_segments_parallel
+
+    def spy(self, file_path, file_type, parts, workers):
+        calls.append((file_type, len(parts)))
+        return parallel(self, file_path, file_type, parts, workers)
+    monkeypatch.setattr(FileProcessor, "_iter_segments_parallel", spy)
+
+    assert list(processor.iter_segments(workbook, "xlsx")) == sequential["xlsx"]
+    assert list(processor.iter_segments(pdf, "pdf")) == sequential["pdf"]
+    assert calls == [("xlsx", 5), ("pdf", 4)]
+
+
+def test_single_part_file_is_extracted_sequentially(tmp_path, monkeypatch):
+    workbook = _write_xlsx(tmp_path / "alerts.xlsx", {"Сеть": [["Код", "Как реагировать"], ["z735", "Перезапустить"]]})
+    _enable_parallel_extraction(monkeypatch)
+
+    def fail(*args):
+        raise AssertionError("файл из одной части не должен извлекаться в пуле процессов")
+    monkeypatch.setattr(FileProcessor, "_iter_segments_parallel", fail)
+
+    segments = list(FileProcessor().iter_segments(workbook, "xlsx"))
+    assert [segment["cells"] for segment in segments] == [["z735", "Перезапустить"]]
@@ -0,0 +1,108 @@
+import time
+import asyncio
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+# Скрипт захвата слота выполняется в Redis на Lua - fakeredis нужен интерпретатор lupa
+pytest.importorskip("lupa")
+
+from src.agents.services import llm_scheduler
+from src.agents.services.llm_scheduler import LLMOverloadedError, LLMPriority, LLMScheduler
+
+
+@pytest.fixture
+def make_scheduler(monkeypatch):
+    """Планировщики с общим Redis - как воркеры разных процессов"""
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(llm_scheduler.redis.Redis, "from_url",
+                        lambda url, **kwargs: fakeredis.FakeRedis(server=server))
+
+    def make(max_concurrency=1, **kwargs):
+        return LLMScheduler(max_concurrency=max_concurrency, lease_ttl=60, poll_interval=0.01,
+                            url="redis://test", **kwargs)
+    return make
+
+
+def test_waiters_get_slot_in_priority_order(make_scheduler):
+    scheduler = make_scheduler()
+    enqueued_at = time.time()
+
+    with scheduler.slot():
+        # Проверка подключения встала в очередь первой, алерт - последним
+        assert scheduler._try_acquire("health", LLMPriority.HEALTH_CHECK, enqueued_at) == 0
+        assert scheduler._try_acquire("interactive", LLMPriority.INTERACTIVE, enqueued_at + 1) == 0
+        assert scheduler._try_acquire("alert", LLMPriority.ALERT, enqueued_at + 2) == 0
+
+    assert scheduler._try_acquire("health", LLMPriority.HEALTH_CHECK, enqueued_at) == 2
+    assert scheduler._try_acquire("interactive", LLMPriority.INTERACTIVE, enqueued_at + 1) == 1
+    assert scheduler._try_acquire("alert", LLMPriority.ALERT, enqueued_at + 2) == -1
+
+    scheduler._release("alert")
+    assert scheduler._try_acquire("health", LLMPriority.HEALTH_CHECK, enqueued_at) == 1
+    assert scheduler._try_acquire("interactive", LLMPriority.INTERACTIVE, enqueued_at + 1) == -1
+
+
+def test_slot_is_released_on_exception(make_scheduler):
+    scheduler = make_scheduler()
+
+    with pytest.raises(RuntimeError):
+        with scheduler.slot():
+            raise RuntimeError("ошибка генерации")
+    assert scheduler.client.zcard(scheduler.holders_key) == 0
+
+    async def failing():
+        async with scheduler.aslot():
+            raise RuntimeError("ошибка генерации")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(failing())
+    assert scheduler.client.zcard(scheduler.holders_key) == 0
+
+    with scheduler.slot(deadline=0.1):
+        assert scheduler.client.zcard(scheduler.holders_key) == 1
+
+
+def test_request_is_shed_after_deadline(make_scheduler):
+    busy = make_scheduler()
+    scheduler = make_scheduler()
+
+    with busy.slot():
+        with pytest.raises(LLMOverloadedError):
+            with scheduler.slot(priority=LLMPriority.HEALTH_CHECK, deadline=0.05):
+                pass
+
+        async def wait_slot():
+            async with scheduler.aslot(deadline=0.05):
+                pass
+
+        with pytest.raises(LLMOverloadedError):
+            asyncio.run(wait_slot())
+
+        # По оценке (средняя генерация дольше срока) запрос отклоняется сразу, не дожидаясь срока
+        scheduler.avg_duration = 30.0
+        started_at = time.time()
+        with pytest.raises(LLMOverloadedError):
+            with scheduler.slot(deadline=10):
+                pass
+        assert time.time() - started_at < 1
+
+        # Отклоненные запросы не остаются в очереди
+        assert scheduler.client.zcard(scheduler.queue_key) == 0
+        assert scheduler.client.zcard(scheduler.beats_key) == 0
+
+
+def test_expired_leases_and_stale_waiters_are_removed(make_scheduler):
+    scheduler = make_scheduler()
+    now = time.time()
+    # Процесс упал со слотом: аренда истекла
+    scheduler.client.zadd(scheduler.holders_key, {"crashed": now - 1})
+    # Процесс упал в очереди: ожидающий с наивысшим приоритетом перестал обновлять отметку
+    scheduler.client.zadd(scheduler.queue_key, {"ghost": 0})
+    scheduler.client.zadd(scheduler.beats_key, {"ghost": now - 60})
+
+    with scheduler.slot(priority=LLMPriority.INTERACTIVE, deadline=0.5):
+        holders = scheduler.client.zrange(scheduler.holders_key, 0, -1)
+        assert len(holders) == 1 and b"crashed" not in holders
+    assert scheduler.client.zcard(scheduler.queue_key) == 0
+    assert scheduler.client.zcard(scheduler.beats_key) == 0
@@ -0,0 +1,34 @@
+from src.core.rag_config import RAGConfig
+from tests.fixtures.vector_store import make_document, make_store
+
+
+def test_model_change_applies_only_after_swap(tmp_path, monkeypatch):
+    calls = []
+    store = make_store(tmp_path, monkeypatch, calls)
+    assert store.add_documents(1, 7, [make_document(1, "Диск заполнен на 90 процентов")])
+
+    # Модель сменили: до переиндексации запросы и новые документы эмбеддятся прежней моделью
+    monkeypatch.setattr(RAGConfig, "EMBEDDING_MODEL", "new-model")
+    assert store.add_documents(1, 7, [make_document(2, "Очередь сообщений растет")])
+    assert len(store.search_similar(1, 7, "заполнен диск")) == 2
+    assert {model for model, _ in calls} == {"old-model"}
+
+    generation = store.create_shadow_collection(1, 7)
+    assert store.add_documents(1, 7, [make_document(1, "Диск заполнен на 90 процентов"),
+                                      make_document(2, "Очередь сообщений растет")], generation=generation)
+    # Досинхронизация: документ удалили и загрузили новый, пока строилась теневая коллекция
+    assert store.delete_documents(1, 7, [2], generation=generation) == 1
+    assert store.add_documents(1, 7, [make_document(3, "Сертификат истекает")], generation=generation)
+    assert store.get_generation_model(1, 7) == "old-model"
+    assert store.get_generation_model(1, 7, generation) == "new-model"
+
+    calls.clear()
+    assert store.swap_collection(1, 7, generation)
+    results = store.search_similar(1, 7, "заполнен диск")
+    assert {result["metadata"]["document_id"] for result in results} == {"1", "3"}
+    assert calls == [("new-model", 1)]
+
+    assert store.drop_collection_generation(1, 7, generation - 1)
+    assert not store.get_agent_model_path(1, 7, generation - 1).exists()
+    client = store.pool.clients[str(store.get_agent_vector_path(1, 7))]
+    assert list(client.collections) == [store.get_collection_name(7, generation)]
@@ -0,0 +1,38 @@
+from src.agents.services.response_cache import ResponseCache, MemoryResponseCache
+from src.agents.services.ollama_service import OllamaService
+
+
+def _docs(chunk_hash="h1"):
+    return [{"text": "z735 Инвалидные пакеты", "metadata": {"document_id": "7", "chunk_index": 0, "chunk_hash": chunk_hash}}]
+
+
+def _cache():
+    return ResponseCache(MemoryResponseCache(ttl=60, max_entries=100, max_bytes=100_000))
+
+
+def test_key_depends_on_prompt_chunks_and_alert():
+    cache = _cache()
+    key = cache.build_key(1, 2, "llama3.2:3b", "prompt", _docs(), "[Alerting] z735 Инвалидные пакеты alert")
+    assert key == cache.build_key(1, 2, "llama3.2:3b", "prompt", _docs(), "[alerting]  Z735 инвалидные пакеты alert")
+    assert key != cache.build_key(1, 2, "llama3.2:3b", "new prompt", _docs(), "[Alerting] z735 Инвалидные пакеты alert")
+    assert key != cache.build_key(1, 2, "llama3.2:3b", "prompt", _docs("h2"), "[Alerting] z735 Инвалидные пакеты alert")
+    assert cache.build_key(1, 2, "llama3.2:3b", "prompt", [], "z735") is None
+
+
+def test_same_alert_code_with_different_details_is_not_shared():
+    cache = _cache()
+    key = cache.build_key(1, 2, "llama3.2:3b", "prompt", _docs(), "z735 Инвалидные пакеты: host-1, 120 шт.")
+    assert key != cache.build_key(1, 2, "llama3.2:3b", "prompt", _docs(), "z735 Инвалидные пакеты: host-2, 5 шт.")
+
+
+def test_failed_responses_are_not_cached_and_invalidation():
+    cache = _cache()
+    key = cache.build_key(1, 2, "llama3.2:3b", "prompt", _docs(), "z735")
+    cache.set(key, OllamaService.EMPTY_RESPONSE, 1.0)
+    assert cache.get(key) is None
+
+    cache.set(key, "Перезапустить сервис", 1.5)
+    assert cache.get(key) == "Перезапустить сервис"
+    assert cache.invalidate_agent(1, user_id=3) == 0
+    assert cache.invalidate_agent(1, user_id=2) == 1
+    assert cache.get(key) is None
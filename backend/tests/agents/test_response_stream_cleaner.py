@@ -0,0 +1,17 @@
+from src.agents.services.ollama_service import ResponseStreamCleaner
+
+
+def test_prefix_is_stripped_and_spaces_collapsed_across_tokens():
+    cleaner = ResponseStreamCleaner()
+    tokens = ["  Ответ", ":  Перезапустить", "\n\n сервис", " MTBDM"]
+    streamed = "".join(cleaner.feed(token) for token in tokens) + cleaner.finish()
+    assert streamed == "Перезапустить сервис MTBDM"
+    assert cleaner.raw_text == "".join(tokens)
+
+
+def test_tokens_are_released_after_head():
+    cleaner = ResponseStreamCleaner()
+    assert cleaner.feed("x" * (ResponseStreamCleaner.HEAD_SIZE - 1)) == ""
+    assert cleaner.feed("yz") == "x" * (ResponseStreamCleaner.HEAD_SIZE - 1) + "yz"
+    assert cleaner.feed(" tail") == " tail"
+    assert cleaner.finish() == ""
@@ -0,0 +1,33 @@
+from src.agents.utils.runbook_parser import RunbookParser
+
+
+def _row(cells, header, kind="row"):
+    return {"text": " | ".join(cells), "kind": kind, "cells": cells, "header": header}
+
+
+def test_runbook_rows_become_records():
+    header = ["Код алерта", "Название", "Как реагировать"]
+    parser = RunbookParser()
+    segments = [
+        _row(["z735", "Инвалидные пакеты в MTBDM", "Перезапустить сервис"], header),
+        _row(["c217", "Диск", ""], header),
+        {"text": "Описание", "kind": "paragraph"},
+    ]
+    assert list(parser.observe(segments)) == segments
+    assert parser.records == [{
+        "alert_code": "z735",
+        "alert_name": "инвалидные пакеты в mtbdm",
+        "title": "Инвалидные пакеты в MTBDM",
+        "reaction": "Перезапустить сервис"
+    }]
+
+
+def test_code_is_taken_from_name_and_other_tables_are_ignored():
+    parser = RunbookParser()
+    list(parser.observe([
+        _row(["C214a Memory OpenApi alert", "Очистить кэш"], ["Алерт", "Действия"], kind="table_row"),
+        _row(["Иванов", "Дежурный"], ["ФИО", "Роль"]),
+    ]))
+    assert len(parser.records) == 1
+    assert parser.records[0]["alert_code"] == "c214a"
+    assert parser.records[0]["alert_name"] == "memory openapi"
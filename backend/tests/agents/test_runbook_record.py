@@ -0,0 +1,31 @@
+from types import SimpleNamespace
+
+from src.agents.repositories.runbook_record import build_runbook_lookup, pick_runbook_match
+
+
+def _record(code, name, reaction):
+    return SimpleNamespace(alert_code=code, alert_name=name, title=name, reaction=reaction)
+
+
+def test_code_mentioned_outside_alert_title_is_not_answered_directly():
+    records = [_record("z735", "инвалидные пакеты в mtbdm", "Перезапустить сервис")]
+
+    assert pick_runbook_match(records, "Сработал z735 Инвалидные пакеты в MTBDM") is records[0]
+    # Код только упомянут в тексте - это не сам алерт
+    text = "Медленные ответы API\nПохоже на z735, но пакеты в норме"
+    assert pick_runbook_match(records, text) is None
+    assert build_runbook_lookup(7, 1, text) is None
+    # Обычные токены (p99, x86) кодами алертов не считаются
+    assert build_runbook_lookup(7, 1, "p99 latency on x86 host") is None
+
+
+def test_code_from_several_runbook_rows_is_ambiguous():
+    records = [
+        _record("c217", "мало места на диске", "Почистить диск"),
+        _record("c217", "мало места в базе", "Увеличить том базы"),
+    ]
+    assert pick_runbook_match(records, "c217 Диск заполнен") is None
+
+    # Одинаковая реакция в нескольких таблицах - ответ однозначен
+    records[1].reaction = "Почистить диск"
+    assert pick_runbook_match(records, "c217 Диск заполнен") is records[0]
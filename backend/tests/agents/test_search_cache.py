@@ -0,0 +1,36 @@
+import time
+
+from src.agents.services.search_cache import MemorySearchCache
+from src.agents.services.collection_version import CollectionVersionStore
+
+
+def test_lru_eviction_by_entries():
+    cache = MemorySearchCache(ttl=60, max_entries=2, max_bytes=10_000)
+    cache.set("a", [1])
+    cache.set("b", [2])
+    assert cache.get("a") == [1]  # "a" становится самым свежим
+    cache.set("c", [3])
+
+    assert cache.get("b") is None
+    assert cache.get("a") == [1]
+    assert cache.evictions == 1
+
+
+def test_byte_budget_and_ttl():
+    cache = MemorySearchCache(ttl=0.05, max_entries=100, max_bytes=20)
+    cache.set("big", ["x" * 100])
+    assert cache.get("big") is None
+
+    cache.set("small", ["x"])
+    assert cache.get("small") == ["x"]
+    time.sleep(0.06)
+    assert cache.get("small") is None
+
+
+def test_collection_version_bump(tmp_path):
+    versions = CollectionVersionStore(tmp_path)
+    assert versions.get(1, 1) == 0
+    assert versions.bump(1, 1) == 1
+    assert versions.bump(1, 1) == 2
+    assert versions.get(1, 1) == 2
+    assert versions.get(1, 2) == 0
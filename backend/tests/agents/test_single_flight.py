@@ -0,0 +1,71 @@
+import threading
+
+from src.agents.services.single_flight import SingleFlight, build_alert_flight_key
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, nx=False, ex=None):
+        with self.lock:
+            if nx and key in self.values:
+                return None
+            self.values[key] = value
+            return True
+
+    def setex(self, key, ttl, value):
+        self.values[key] = value
+
+    def exists(self, key):
+        return key in self.values
+
+    def release(self, keys, args):
+        with self.lock:
+            if self.values.get(keys[0]) == args[0]:
+                del self.values[keys[0]]
+
+
+def _make_flight():
+    flight = SingleFlight.__new__(SingleFlight)
+    flight.name = "alert_analysis"
+    flight.lock_ttl = 10
+    flight.wait_timeout = 5
+    flight.result_ttl = 10
+    flight.poll_interval = 0.01
+    flight.client = FakeRedis()
+    flight._release_lock = flight.client.release
+    return flight
+
+
+def test_alert_flight_key_depends_on_user():
+    key = build_alert_flight_key(1, 7, "Сработал  z735\nДиск", 3)
+    assert key == build_alert_flight_key(1, 7, "сработал z735 диск", 3)
+    assert key != build_alert_flight_key(2, 7, "Сработал z735 Диск", 3)
+    assert key != build_alert_flight_key(1, 7, "Сработал z735 Диск", 4)
+
+
+def test_different_users_never_share_a_flight():
+    flight = _make_flight()
+    started = threading.Barrier(2)
+    results = {}
+
+    def analyze(user_id):
+        def generate():
+            started.wait(timeout=5)
+            return {"response": f"ответ для {user_id}"}
+        key = build_alert_flight_key(user_id, 7, "z735 Диск заполнен", 1)
+        results[user_id] = flight.run(key, generate)
+
+    threads = [threading.Thread(target=analyze, args=(user_id,)) for user_id in (1, 2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Оба вызова выполнены лидерами одновременно (барьер), каждый получил свой ответ
+    assert results == {1: {"response": "ответ для 1"}, 2: {"response": "ответ для 2"}}
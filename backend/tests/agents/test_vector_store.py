@@ -0,0 +1,97 @@
+from tests.fixtures.vector_store import make_document, make_store
+
+
+def _collection(store, user_id=1, agent_id=7):
+    client = store.pool.clients[str(store.get_agent_vector_path(user_id, agent_id))]
+    return client.collections[store.get_collection_name(agent_id)]
+
+
+def _embedded(calls):
+    return sum(count for _, count in calls)
+
+
+def test_unchanged_document_is_not_reembedded(tmp_path, monkeypatch):
+    calls = []
+    store = make_store(tmp_path, monkeypatch, calls)
+    document = make_document(1, "z735 Инвалидные пакеты", "c217 Мало места на диске")
+    assert store.update_document(1, 7, document) == {"added": 2, "removed": 0, "unchanged": 0}
+    version = store.get_collection_version(1, 7)
+
+    calls.clear()
+    _collection(store).operations.clear()
+    assert store.update_document(1, 7, document) == {"added": 0, "removed": 0, "unchanged": 2}
+    assert calls == []
+    assert _collection(store).operations == []
+    assert store.get_collection_version(1, 7) == version
+
+
+def test_changed_chunk_is_replaced(tmp_path, monkeypatch):
+    calls = []
+    store = make_store(tmp_path, monkeypatch, calls)
+    store.update_document(1, 7, make_document(1, "z735 Инвалидные пакеты", "c217 Мало места на диске"))
+
+    calls.clear()
+    collection = _collection(store)
+    collection.operations.clear()
+    result = store.update_document(1, 7, make_document(1, "z735 Инвалидные пакеты", "c217 Мало места в базе"))
+
+    assert result == {"added": 1, "removed": 1, "unchanged": 1}
+    assert _embedded(calls) == 1
+    assert [(operation, len(ids)) for operation, ids in collection.operations] == [("delete", 1), ("upsert", 1)]
+    assert sorted(document for document, _, _ in collection.records.values()) == [
+        "c217 Мало места в базе", "z735 Инвалидные пакеты"
+    ]
+    assert store._get_alert_index(1, 7).lookup("c217 Мало места в базе") is not None
+
+
+def test_shifted_chunk_updates_only_metadata(tmp_path, monkeypatch):
+    calls = []
+    store = make_store(tmp_path, monkeypatch, calls)
+    store.update_document(1, 7, make_document(1, "Первый раздел", "Второй раздел"))
+
+    calls.clear()
+    collection = _collection(store)
+    collection.operations.clear()
+    result = store.update_document(1, 7, make_document(1, "Второй раздел", "Первый раздел"))
+
+    assert result == {"added": 0, "removed": 0, "unchanged": 2}
+    assert calls == []
+    assert [(operation, len(ids)) for operation, ids in collection.operations] == [("update", 2)]
+    positions = {document: metadata["chunk_index"] for document, metadata, _ in collection.records.values()}
+    assert positions == {"Второй раздел": 0, "Первый раздел": 1}
+
+
+def test_case_only_edit_is_reembedded(tmp_path, monkeypatch):
+    calls = []
+    store = make_store(tmp_path, monkeypatch, calls)
+    store.update_document(1, 7, make_document(1, "Перезапустить сервис mtbdm"))
+
+    calls.clear()
+    assert store.update_document(1, 7, make_document(1, "Перезапустить сервис MTBDM"))["added"] == 1
+    assert [document for document, _, _ in _collection(store).records.values()] == ["Перезапустить сервис MTBDM"]
+
+
+def test_delete_documents_removes_only_their_chunks(tmp_path, monkeypatch):
+    store = make_store(tmp_path, monkeypatch, [])
+    assert store.add_documents(1, 7, [
+        make_document(1, "z735 Инвалидные пакеты", "Общий раздел"),
+        make_document(2, "c217 Мало места на диске"),
+        make_document(3, "z736 Очередь сообщений растет"),
+    ])
+    version = store.get_collection_version(1, 7)
+    alert_index = store._get_alert_index(1, 7)
+    assert alert_index.lookup("z735") is not None
+
+    assert store.delete_documents(1, 7, [1, 2]) == 3
+
+    remaining = _collection(store).records.values()
+    assert [metadata["document_id"] for _, metadata, _ in remaining] == ["3"]
+    assert alert_index.lookup("z735") is None
+    assert alert_index.lookup("c217") is None
+    assert alert_index.lookup("z736") is not None
+    assert store.get_collection_version(1, 7) > version
+
+    # Повторное удаление ничего не находит и не сбрасывает кэш агента
+    version = store.get_collection_version(1, 7)
+    assert store.delete_documents(1, 7, [1]) == 0
+    assert store.get_collection_version(1, 7) == version
@@ -0,0 +1,141 @@
+from src.core.rag_config import RAGConfig
+from src.agents.services.chroma_pool import ChromaClientPool
+from src.agents.services.embedding_service import EmbeddingService
+from src.agents.services.vector_store import VectorStore
+from src.agents.utils.chunker import compute_chunk_hash
+
+
+class FakeEmbedder:
+    def __init__(self, model_name, calls):
+        self.model_name = model_name
+        self.calls = calls
+
+    def embed(self, texts):
+        self.calls.append((self.model_name, len(texts)))
+        return [[float(len(self.model_name))] for _ in texts]
+
+    def embed_query(self, text):
+        return self.embed([text])[0]
+
+    def stats(self):
+        return {"model": self.model_name}
+
+
+def _matches(metadata, where):
+    if not where:
+        return True
+    if "$and" in where:
+        return all(_matches(metadata, condition) for condition in where["$and"])
+    (field, value), = where.items()
+    if isinstance(value, dict):
+        return metadata.get(field) in value["$in"]
+    return metadata.get(field) == value
+
+
+class FakeCollection:
+    def __init__(self, name, metadata):
+        self.name = name
+        self.metadata = metadata
+        self.records = {}
+        # Записи, измененные каждой операцией: ("upsert" | "update" | "delete", ids)
+        self.operations = []
+
+    def upsert(self, ids, documents, metadatas, embeddings):
+        self.operations.append(("upsert", list(ids)))
+        for record in zip(ids, documents, metadatas, embeddings):
+            self.records[record[0]] = record[1:]
+
+    def update(self, ids, metadatas):
+        self.operations.append(("update", list(ids)))
+        for record_id, metadata in zip(ids, metadatas):
+            document, _, embedding = self.records[record_id]
+            self.records[record_id] = (document, metadata, embedding)
+
+    def _select(self, ids=None, where=None):
+        return [record_id for record_id, (_, metadata, _) in self.records.items()
+                if (ids is None or record_id in ids) and _matches(metadata, where)]
+
+    def get(self, ids=None, where=None, include=(), limit=None, offset=0):
+        selected = self._select(ids, where)
+        return {
+            "ids": selected,
+            "documents": [self.records[record_id][0] for record_id in selected],
+            "metadatas": [self.records[record_id][1] for record_id in selected],
+        }
+
+    def query(self, query_embeddings, n_results, where=None):
+        # Векторы разных моделей несовместимы - ищем только среди записей той же модели
+        selected = [record_id for record_id in self._select(where=where)
+                    if self.records[record_id][2] == query_embeddings[0]][:n_results]
+        return {
+            "documents": [[self.records[record_id][0] for record_id in selected]],
+            "metadatas": [[self.records[record_id][1] for record_id in selected]],
+            "distances": [[0.0 for _ in selected]],
+        }
+
+    def delete(self, ids=None, where=None):
+        self.operations.append(("delete", self._select(ids, where)))
+        for record_id in self._select(ids, where):
+            del self.records[record_id]
+
+    def count(self):
+        return len(self.records)
+
+
+class FakeClient:
+    def __init__(self):
+        self.collections = {}
+
+    def get_or_create_collection(self, name, metadata=None):
+        if name not in self.collections:
+            self.collections[name] = FakeCollection(name, metadata)
+        return self.collections[name]
+
+    def get_collection(self, name):
+        return self.collections[name]
+
+    def delete_collection(self, name):
+        del self.collections[name]
+
+
+class FakePool(ChromaClientPool):
+    """Клиенты живут, пока жив пул: вместо файлов ChromaDB - словари в памяти"""
+
+    def __init__(self):
+        super().__init__(max_clients=8, idle_ttl=3600)
+        self.clients = {}
+
+    def _create_client(self, path_str):
+        from pathlib import Path
+        Path(path_str).mkdir(parents=True, exist_ok=True)
+        return self.clients.setdefault(path_str, FakeClient()), None
+
+    def _detach_client(self, path_str, entry):
+        pass
+
+    def _stop_client(self, path_str, entry):
+        entry["collections"].clear()
+
+
+def make_document(document_id, *texts):
+    return {
+        "id": document_id, "filename": f"{document_id}.md", "file_type": "md", "uploaded_at": "2024-01-01",
+        "chunks": [{"text": text, "chunk_index": i, "chunk_hash": compute_chunk_hash(text)}
+                   for i, text in enumerate(texts)]
+    }
+
+
+def make_store(tmp_path, monkeypatch, calls):
+    """VectorStore в tmp_path с коллекциями в памяти; calls - журнал вызовов эмбеддеров (модель, число текстов)"""
+    monkeypatch.setattr(RAGConfig, "EMBEDDING_MODEL", "old-model")
+    monkeypatch.setattr(RAGConfig, "EMBEDDING_CACHE_ENABLED", False)
+    monkeypatch.setattr(RAGConfig, "RESPONSE_CACHE_ENABLED", False)
+    monkeypatch.setattr(RAGConfig, "SEARCH_CACHE_BACKEND", "memory")
+    monkeypatch.setattr(EmbeddingService, "_instances", {
+        "old-model": FakeEmbedder("old-model", calls),
+        "new-model": FakeEmbedder("new-model", calls),
+    })
+    VectorStore._instance = None
+    store = VectorStore(str(tmp_path))
+    store.pool = FakePool()
+    return store